@@ -0,0 +1,106 @@
+import os
+
+from yaml import dump
+
+# Notebook at each level of the synthetic tree. Shows carry the decoding
+# regexp, like a real library where each show names its files differently.
+ROOT_NOTEBOOK = {
+    'name': 'bench',
+    'genre': 'Benchmark',
+    'under_influence': False,
+}
+
+SHOW_NOTEBOOK = {
+    'platform': 'Platform {show}',
+    'title': 'Show {show}',
+    'decoding': {
+        'regexp': r'ep(\d+)_(\d{4}-\d{2}-\d{2})_(\d{2}-\d{2}-\d{2})',
+        'date-group': 2,
+        'time-group': 3,
+    },
+    'time_format': '%H-%M-%S',
+}
+
+SEASON_NOTEBOOK = {
+    'subgenre': 'Season {season}',
+}
+
+
+def format_notebook(template, **values):
+    """
+    Fills the {placeholders} in a notebook template's string values.
+    """
+    filled = {}
+    for key, value in template.items():
+        if isinstance(value, str):
+            # Not str.format, the regexps have braces of their own
+            for name, replacement in values.items():
+                value = value.replace(f"{{{name}}}", str(replacement))
+        elif isinstance(value, dict):
+            value = format_notebook(value, **values)
+        filled[key] = value
+    return filled
+
+
+def write_notebook(dirpath, notebook, fosse_file='fosse.yml'):
+    with open(os.path.join(dirpath, fosse_file), 'w') as file:
+        dump(notebook, file)
+
+
+def build_library(root, videos, videos_per_dir=50, seasons_per_show=4, fosse_file='fosse.yml'):
+    """
+    Builds a synthetic library: root/showNNNN/seasonNN/epNNNN_<date>_<time>.mp4
+    with a notebook in the root, in every show and in every season. The
+    video files only hold their own path, so each has its own content
+    fingerprint, and need a stubbed metadata extractor.
+
+    Args:
+        root (str): Directory to build the library in.
+        videos (int): Number of video files.
+        videos_per_dir (int): Video files per season directory.
+        seasons_per_show (int): Season directories per show.
+        fosse_file (str): Notebook file name.
+
+    Returns:
+        dict: Counts of what was created: videos, directories, notebooks.
+    """
+    os.makedirs(root, exist_ok=True)
+    write_notebook(root, ROOT_NOTEBOOK, fosse_file)
+    counts = {'videos': 0, 'directories': 1, 'notebooks': 1}
+
+    season_dirs = -(-videos // videos_per_dir)
+    for season_index in range(season_dirs):
+        show, season = divmod(season_index, seasons_per_show)
+        show_dir = os.path.join(root, f"show{show:04d}")
+        if season == 0:
+            os.makedirs(show_dir, exist_ok=True)
+            write_notebook(show_dir, format_notebook(SHOW_NOTEBOOK, show=show), fosse_file)
+            counts['directories'] += 1
+            counts['notebooks'] += 1
+
+        season_dir = os.path.join(show_dir, f"season{season:02d}")
+        os.makedirs(season_dir, exist_ok=True)
+        write_notebook(season_dir, format_notebook(SEASON_NOTEBOOK, season=season), fosse_file)
+        counts['directories'] += 1
+        counts['notebooks'] += 1
+
+        first = season_index * videos_per_dir
+        for episode in range(first, min(first + videos_per_dir, videos)):
+            day = episode % 28 + 1
+            path = os.path.join(season_dir, f"ep{episode:07d}_2021-01-{day:02d}_12-30-00.mp4")
+            with open(path, 'w') as file:
+                file.write(path)
+            counts['videos'] += 1
+
+    return counts
+
+
+def video_paths(root):
+    """
+    Returns:
+        list: Absolute paths of every video file in a synthetic library.
+    """
+    paths = []
+    for dirpath, _, filenames in os.walk(os.path.abspath(root)):
+        paths.extend(os.path.join(dirpath, name) for name in filenames if name.endswith('.mp4'))
+    return sorted(paths)
@@ -0,0 +1,333 @@
+"""
+Benchmarks scanning, config resolution and database writes against synthetic
+libraries of several sizes, and the start-up time of the CLI. Run from the
+repository root:
+
+    python -m benchmarks.run --scales 1000,10000 --output bench.json
+    python -m benchmarks.run --scales 1000,10000 --compare bench.json
+"""
+import datetime
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+from loguru import logger
+from yaml import dump
+
+from benchmarks.library import build_library, video_paths
+from fosse.config import Config
+from fosse.db import FosseData
+from fosse.probe import default_metadata, PROBE_OK
+from fosse.scanner import Scanner
+
+# Share of the videos deleted before the last scan, to give end_of_scan
+# something to purge
+DELETE_FRACTION = 0.01
+
+# What `fosse list` runs; it should only need click
+LIST_COMMAND = "from fosse.cli import cli; cli(['list'], standalone_mode=False)"
+
+# Modules `fosse list` must not import; they belong to the commands using them
+LAZY_MODULES = (
+    'sqlite3', 'yaml', 'loguru', 'pickle', 'mimetypes', 'multiprocessing',
+    'fosse.config', 'fosse.db', 'fosse.scanner', 'fosse.server',
+)
+
+
+class StubScanner(Scanner):
+    """
+    Scanner that returns fixed metadata instead of running MediaInfo, so the
+    benchmarks measure fosse rather than the probe.
+    """
+
+    def extract_video_metadata(self, file_path):
+        metadata = default_metadata()
+        metadata.update({
+            'duration_seconds': 1320,
+            'width': 1920,
+            'height': 1080,
+            'video_format': 'MPEG-4',
+            'codec': 'AVC',
+            'frame_rate': 29.97,
+            'probe_status': PROBE_OK,
+        })
+        return metadata
+
+
+class Stopwatch:
+    """
+    Accumulates time spent in methods of the objects it's attached to.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+
+    def attach(self, obj, name):
+        original = getattr(obj, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+        setattr(obj, name, timed)
+
+
+def measure(results, name, items, func):
+    """
+    Times func() and records the result under `name`.
+
+    Returns:
+        The return value of func().
+    """
+    start = time.perf_counter()
+    value = func()
+    record(results, name, items, time.perf_counter() - start)
+    return value
+
+
+def record(results, name, items, seconds):
+    results[name] = {
+        'seconds': round(seconds, 6),
+        'items': items,
+        'per_item_us': round(seconds / items * 1e6, 3) if items else None,
+    }
+    logger.info(f"{name:<30} {seconds:9.3f}s  {items:>9} items")
+
+
+def scan(config, results, name, items, incremental=False):
+    """
+    Runs a stubbed scan, recording its total time and the time spent in
+    end_of_scan separately.
+    """
+    scanner = StubScanner(config)
+    stopwatch = Stopwatch()
+    stopwatch.attach(scanner.db, 'end_of_scan')
+    measure(results, name, items, lambda: scanner.scan(incremental=incremental))
+    record(results, f"{name}_end_of_scan", items, stopwatch.seconds.get('end_of_scan', 0.0))
+
+
+def run_scale(workdir, videos, videos_per_dir):
+    """
+    Runs every benchmark against a fresh library of `videos` files.
+
+    Returns:
+        dict: Benchmark name -> {seconds, items, per_item_us}.
+    """
+    root = os.path.join(workdir, 'library')
+    config_path = os.path.join(workdir, 'fosse-config.yml')
+    with open(config_path, 'w') as file:
+        dump({
+            'root': root,
+            'db_file': os.path.join(workdir, 'fosse.db'),
+            'fosse_file': 'fosse.yml',
+            'video_extensions': ['mp4'],
+            # The stub extracts in this process
+            'probe_isolation': False,
+        }, file)
+    config = Config(config_path)
+
+    results = {}
+    counts = measure(results, 'build_library', videos, lambda: build_library(root, videos, videos_per_dir))
+    results['build_library'].update(counts)
+
+    scan(config, results, 'scan_cold', videos)
+    scan(config, results, 'scan_warm', videos)
+    scan(config, results, 'scan_incremental', videos, incremental=True)
+
+    paths = video_paths(root)
+    db = FosseData(config)
+    db.reset_config_cache()
+
+    def resolve_all():
+        for path in paths:
+            db.get_combined_config_for_file(path)
+
+    measure(results, 'config_cold', len(paths), resolve_all)
+    measure(results, 'config_warm', len(paths), resolve_all)
+
+    show = os.path.dirname(os.path.dirname(paths[0]))
+    show_videos = sum(1 for path in paths if path.startswith(show + '/'))
+    measure(results, 'update_config_show', show_videos, lambda: db.update_videos_for_config(show))
+    measure(results, 'update_config_root', len(paths), lambda: db.update_videos_for_config(root))
+    del db
+
+    removed = paths[::int(1 / DELETE_FRACTION)]
+    for path in removed:
+        os.remove(path)
+    scan(config, results, 'scan_after_delete', len(paths))
+    results['scan_after_delete']['removed'] = len(removed)
+
+    return results
+
+
+def import_times(code):
+    """
+    Runs `code` in a fresh interpreter under `-X importtime`.
+
+    Returns:
+        dict: Module name -> cumulative import time in microseconds.
+    """
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True,
+    ).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def best_wall_time(code, runs):
+    """
+    Returns:
+        float: Shortest wall time, in seconds, of `runs` fresh interpreters
+            running `code`.
+    """
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], stdout=subprocess.DEVNULL, check=True)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def run_startup(runs):
+    """
+    Times `fosse list` in fresh interpreters, next to a bare interpreter, and
+    checks which modules it imports.
+
+    Returns:
+        tuple: (results dict, modules from LAZY_MODULES that were imported)
+    """
+    results = {}
+    record(results, 'startup_interpreter', 1, best_wall_time('pass', runs))
+    record(results, 'startup_list', 1, best_wall_time(LIST_COMMAND, runs))
+
+    times = import_times(LIST_COMMAND)
+    record(results, 'startup_import_cli', 1, times.get('fosse.cli', 0) / 1e6)
+    eager = [name for name in LAZY_MODULES if name in times]
+    return results, eager
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold, min_seconds):
+    """
+    Prints each benchmark's time against a baseline run. Building the
+    library isn't fosse code, and benchmarks that took less than
+    `min_seconds` in the baseline are too noisy, so neither is flagged.
+
+    Returns:
+        int: Number of benchmarks slower than the threshold ratio.
+    """
+    regressions = 0
+    for scale, results in current['results'].items():
+        previous = baseline['results'].get(scale)
+        if not previous:
+            continue
+        label = f"{scale} videos" if scale.isdigit() else scale
+        print(f"\n{label} ({baseline['meta']['revision']} -> {current['meta']['revision']})")
+        for name, result in results.items():
+            if name not in previous or not previous[name]['seconds']:
+                continue
+            ratio = result['seconds'] / previous[name]['seconds']
+            flag = ''
+            if ratio > threshold and name != 'build_library' and previous[name]['seconds'] >= min_seconds:
+                flag = '  SLOWER'
+                regressions += 1
+            print(f"  {name:<30} {previous[name]['seconds']:9.3f}s {result['seconds']:9.3f}s {ratio:6.2f}x{flag}")
+    return regressions
+
+
+@click.command()
+@click.option('--scales', default='1000,10000', help='Comma separated library sizes, in videos.')
+@click.option('--videos-per-dir', default=50, help='Video files per directory.')
+@click.option('--output', '-o', help='Write results as JSON to this file.')
+@click.option('--compare', 'baseline', type=click.Path(exists=True), help='Compare against an earlier JSON result.')
+@click.option('--threshold', default=1.2, help='Slowdown ratio reported as a regression.')
+@click.option('--min-seconds', default=0.05, help='Ignore slowdowns of benchmarks faster than this.')
+@click.option('--workdir', help='Where to build libraries. Defaults to a temporary directory.')
+@click.option('--keep', is_flag=True, help="Don't delete the libraries afterwards.")
+@click.option('--startup-runs', default=10, help='Interpreters started per start-up benchmark; the best run counts.')
+@click.option('--startup-budget', default=100.0, help='Most milliseconds `fosse list` may take, interpreter included.')
+def main(scales, videos_per_dir, output, baseline, threshold, min_seconds, workdir, keep,
+         startup_runs, startup_budget):
+    """
+    Benchmarks fosse against synthetic libraries, and its start-up time.
+    """
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+    logger.add(sys.stderr, level='INFO', filter=__name__, format='{message}')
+
+    current = {
+        'meta': {
+            'revision': git_revision(),
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'videos_per_dir': videos_per_dir,
+        },
+        'results': {},
+    }
+
+    base = workdir or tempfile.mkdtemp(prefix='fosse-bench-')
+    try:
+        for scale in (int(s) for s in scales.split(',')):
+            logger.info(f"\n{scale} videos")
+            scale_dir = os.path.join(base, str(scale))
+            shutil.rmtree(scale_dir, ignore_errors=True)
+            os.makedirs(scale_dir)
+            current['results'][str(scale)] = run_scale(scale_dir, scale, videos_per_dir)
+    finally:
+        if not keep:
+            shutil.rmtree(base, ignore_errors=True)
+
+    logger.info("\nstartup")
+    current['results']['startup'], eager = run_startup(startup_runs)
+    failed = False
+    if eager:
+        print(f"`fosse list` imports {', '.join(eager)}, which should be imported lazily")
+        failed = True
+    list_ms = current['results']['startup']['startup_list']['seconds'] * 1000
+    if list_ms > startup_budget:
+        print(f"`fosse list` took {list_ms:.1f}ms, over the {startup_budget:g}ms budget")
+        failed = True
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(current, file, indent=2)
+
+    if baseline:
+        with open(baseline) as file:
+            if compare(json.load(file), current, threshold, min_seconds):
+                failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,155 @@
 import click
+import datetime
 
-from loguru import logger
-from fosse.config import Config
-from fosse.scanner import Scanner
+# Everything else is imported by the command that needs it: the CLI is run
+# from cron and health checks, and `fosse list` or `fosse --help` shouldn't
+# pay for sqlite3, YAML, loguru and the scanner on every start.
 
 
-def list_commands(config):
+def list_commands(config, options=None):
     print("Available commands:\n")
     for command in COMMANDS.keys():
         print(f"'{command}'- {COMMANDS[command]['desc']}")
         print(f"{' '*4}{COMMANDS[command]['details']}\n")
 
 
-def scan(config):
+def scan(config, options):
     """
     Scans the configured root directory for video files and stores or updates the results in the database.
     """
-    scanner = Scanner(config)
-    scanner.scan()
+    from fosse.scanner import Scanner
 
+    scanner = Scanner(config, stats=options['stats'])
+    scanner.scan(incremental=options['incremental'])
 
-def init(config):
+
+def watch(config, options):
+    """
+    Scans once, then keeps the database up to date as files change.
+    """
+    from fosse.watch import Watcher
+
+    watcher = Watcher(config)
+    watcher.run()
+
+
+def stream(config, options):
+    """
+    Serves the channels over HTTP.
+    """
+    from fosse.server import StreamServer
+
+    server = StreamServer(config)
+    server.run()
+
+
+def playlist(config, options):
+    """
+    Prints a shuffled playlist of `target_hours` from the `stream` config section.
+    """
+    from fosse.db import FosseData
+    from fosse.playlist import Catalog, Playlist
+
+    settings = config.get('stream') or {}
+    catalog = Catalog.load(FosseData(config))
+    if not len(catalog):
+        print("No videos found, run 'fosse scan' first.")
+        return
+
+    playlist = Playlist.from_config(catalog, settings)
+    for pos, start in playlist.take(settings.get('target_hours', 24) * 3600):
+        started = datetime.datetime.fromtimestamp(start).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"{started} {catalog.duration_seconds[pos] or 0:>6}s {catalog.file_path[pos]}")
+
+
+def schedule(config, options):
+    """
+    Extends every channel's schedule and shows what is on each one now.
+    """
+    from fosse.schedule import Scheduler
+
+    scheduler = Scheduler(config)
+    added = scheduler.extend()
+    for channel in scheduler.channels:
+        playing = scheduler.now_playing(channel)
+        if playing is None:
+            print(f"{channel}: nothing scheduled ({added[channel]} added)")
+            continue
+        _, file_path, _, end_time = playing
+        ends = datetime.datetime.fromtimestamp(end_time).strftime('%H:%M:%S')
+        print(f"{channel}: {file_path} until {ends} ({added[channel]} added)")
+
+
+def query(config, options):
+    """
+    Prints the videos matching the --where filters as JSON Lines or CSV, one
+    row at a time as they come from the database.
+    """
+    from fosse.db import FosseData, QUERY_COLUMNS
+
+    filters = {}
+    for where in options['where']:
+        name, _, value = where.partition('=')
+        filters[name.strip()] = value.strip()
+
+    # The sort key of the last row of the previous page: ID, or VALUE,ID
+    after = options['after']
+    try:
+        if after is not None and options['order'] != 'id':
+            value, _, row_id = after.rpartition(',')
+            after = (int(value) if value.lstrip('-').isdigit() else value, int(row_id))
+        elif after is not None:
+            after = int(after)
+    except ValueError:
+        raise click.UsageError(f"Invalid --after '{after}'")
+
+    db = FosseData(config)
+    try:
+        rows = db.query(filters, order=options['order'], after=after,
+                        limit=options['limit'], descending=options['desc'])
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+    write_rows(rows, QUERY_COLUMNS, options['format'])
+
+
+def search(config, options):
+    """
+    Prints the videos best matching the search words, as JSON Lines or CSV.
+    """
+    from fosse.db import FosseData, SEARCH_COLUMNS
+
+    text = ' '.join(options['terms'])
+    if not text.strip():
+        raise click.UsageError("Nothing to search for, e.g. 'fosse search some title'")
+
+    db = FosseData(config)
+    rows = db.search(text, limit=options['limit'] or 20)
+    write_rows(rows, SEARCH_COLUMNS, options['format'])
+
+
+def write_rows(rows, columns, format):
+    """
+    Writes rows (dicts) to stdout as they come, as JSON Lines or CSV.
+    """
+    import csv
+    import json
+    import sys
+
+    if format == 'csv':
+        writer = csv.DictWriter(sys.stdout, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            sys.stdout.write(json.dumps(row) + '\n')
+
+
+def init(config, options):
     pass
 
 
-def unimplemented(config):
+def unimplemented(config, options):
     print("This command is not yet implemented.")
 
 
@@ -33,16 +158,46 @@ COMMANDS = {
         'desc': 'List commands',
         'details': 'Lists the available commands and their descriptions.',
         'func': list_commands,
+        # Runs without reading the config file
+        'config': False,
     },
     'scan': {
         'desc': 'Scan video files',
-        'details': 'Scans the configured root directory for video files and stores or updates the results in the database.',
+        'details': 'Scans the configured root directory for video files and stores or updates the results in the database. '
+                   'With --incremental, directories unchanged since the last scan are skipped.',
         'func': scan,
     },
+    'watch': {
+        'desc': 'Watch video files',
+        'details': 'Scans, then keeps the database up to date as files are added, changed, moved or removed.',
+        'func': watch,
+    },
     'stream': {
         'desc': 'Stream video files',
-        'details': 'Starts the video stream.',
-        'func': unimplemented,
+        'details': 'Serves each channel over HTTP as an HLS-style playlist and as a continuous stream.',
+        'func': stream,
+    },
+    'playlist': {
+        'desc': 'Print a playlist',
+        'details': 'Prints a shuffled playlist, weighted and spaced out as configured under `stream`.',
+        'func': playlist,
+    },
+    'schedule': {
+        'desc': 'Schedule channels',
+        'details': 'Fills each configured channel\'s schedule `schedule_hours` ahead and shows what is on now.',
+        'func': schedule,
+    },
+    'query': {
+        'desc': 'Query videos',
+        'details': 'Prints the videos matching --where filters (genre, platform, title, min_duration, '
+                   'recorded_after, under, ...) as JSON Lines or CSV. Page with --order, --limit and --after.',
+        'func': query,
+    },
+    'search': {
+        'desc': 'Search videos',
+        'details': 'Prints the videos best matching the words after the command, found in titles, platforms, '
+                   'genres, paths and notebook fields. Words match as prefixes.',
+        'func': search,
     },
     'check': {
         'desc': 'Check setup',
@@ -61,30 +216,85 @@ COMMANDS = {
 @click.option(
     '--config', '-c', default='fosse-config.yml', help='Path to config file.'
 )
+@click.option(
+    '--incremental', is_flag=True,
+    help='Scan: skip directories that have not changed since the last scan.'
+)
+@click.option(
+    '--stats', is_flag=True,
+    help='Scan: report per-stage timings, counters and throughput.'
+)
+@click.option(
+    '--profile', type=click.Path(dir_okay=False),
+    help='Write a cProfile dump of the command to this file, for pstats.'
+)
+@click.option(
+    '--where', '-w', multiple=True, metavar='FILTER=VALUE',
+    help='Query: only videos matching this filter, e.g. genre=Comedy. Repeatable.'
+)
+@click.option(
+    '--order', default='id', type=click.Choice(['id', 'duration', 'recording_date', 'last_used']),
+    help='Query: sort order to page through.'
+)
+@click.option(
+    '--after', metavar='KEY',
+    help='Query: start after this row: its id, or VALUE,ID when ordered by another column.'
+)
+@click.option('--limit', type=int, help='Query, search: most rows to print (search: default 20).')
+@click.option('--desc', is_flag=True, help='Query: sort in descending order.')
+@click.option(
+    '--format', 'format', default='jsonl', type=click.Choice(['jsonl', 'csv']),
+    help='Query, search: output format.'
+)
 @click.argument('command')
-def cli(config, command):
+@click.argument('terms', nargs=-1)
+def cli(config, command, **options):
     """
     The Bob Fosse of video streaming.
 
     \b
     Commands:
-        list   - List commands
-        scan   - Scan video files
-        stream - Stream video files
-        check  - Check setup
+        list     - List commands
+        scan     - Scan video files
+        watch    - Watch video files
+        stream   - Stream video files
+        playlist - Print a playlist
+        schedule - Schedule channels
+        query    - Query videos
+        search   - Search videos
+        check    - Check setup
     """
-    config = Config(config)
-
-    if 'log_file' in config:
-        logger.add(
-            config['log_file'],
-            rotation='1 MB',
-            compression='zip',
-        )
-
     if command not in COMMANDS.keys():
         print(f"Error: Command '{command}' not found.")
-        list_commands()
+        list_commands(None)
+        return
+
+    if COMMANDS[command].get('config', True):
+        from fosse.config import Config
+
+        config = Config(config)
+
+        if 'log_file' in config:
+            from loguru import logger
+
+            logger.add(
+                config['log_file'],
+                rotation='1 MB',
+                compression='zip',
+            )
+    else:
+        config = None
+
+    if not options['profile']:
+        COMMANDS[command]['func'](config, options)
         return
 
-    COMMANDS[command]['func'](config)
+    import cProfile
+    from loguru import logger
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(COMMANDS[command]['func'], config, options)
+    finally:
+        profiler.dump_stats(options['profile'])
+        logger.info(f"Profile written to {options['profile']}")
@@ -14,6 +14,9 @@ class Config:
     def __getitem__(self, key):
         return self._config[key]
 
+    def get(self, key, default=None):
+        return self._config.get(key, default)
+
     def keys(self):
         return self._config.keys()
 
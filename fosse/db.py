@@ -1,9 +1,306 @@
 import sqlite3
 import os
+import contextlib
 import datetime
 import sqlite3
-import pickle
 import json
+import hashlib
+import queue
+import threading
+import time
+
+from loguru import logger
+
+from fosse.index import VideoIndex
+from fosse.notebook import Notebook
+from fosse.probe import PROBE_OK, default_metadata
+from fosse.stats import NULL_STATS
+
+# Version of the notebook storage format: canonical JSON of the notebook's
+# raw data plus its SHA-256. Rows without a version hold pickled Notebooks.
+NOTEBOOK_FORMAT = 1
+
+# Small dimension tables, cached in memory by FosseData
+LOOKUP_TABLES = ('genres', 'subgenres', 'platforms', 'titles')
+
+UPSERT_VIDEO_SQL = """
+    INSERT INTO videos (
+        file_path, file_data, duration_seconds, width, height,
+        video_format, codec, frame_rate, file_size_bytes,
+        genre_id, subgenre_id, platform_id, title_id,
+        recording_date, under_influence, source_notebooks,
+        stat_mtime_ns, stat_size, stat_inode, fingerprint, last_used,
+        bit_rate, aspect_ratio, container, overall_bit_rate,
+        audio_codec, audio_channels, audio_sample_rate, can_remux,
+        probe_status, probe_error, probe_attempts, probe_retry_at
+    ) VALUES (
+        ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+        ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+    )
+    ON CONFLICT(file_path) DO UPDATE SET
+        file_data = excluded.file_data,
+        duration_seconds = excluded.duration_seconds,
+        width = excluded.width,
+        height = excluded.height,
+        video_format = excluded.video_format,
+        codec = excluded.codec,
+        frame_rate = excluded.frame_rate,
+        file_size_bytes = excluded.file_size_bytes,
+        genre_id = excluded.genre_id,
+        subgenre_id = excluded.subgenre_id,
+        platform_id = excluded.platform_id,
+        title_id = excluded.title_id,
+        recording_date = excluded.recording_date,
+        under_influence = excluded.under_influence,
+        source_notebooks = excluded.source_notebooks,
+        stat_mtime_ns = excluded.stat_mtime_ns,
+        stat_size = excluded.stat_size,
+        stat_inode = excluded.stat_inode,
+        fingerprint = excluded.fingerprint,
+        last_used = COALESCE(videos.last_used, excluded.last_used),
+        bit_rate = excluded.bit_rate,
+        aspect_ratio = excluded.aspect_ratio,
+        container = excluded.container,
+        overall_bit_rate = excluded.overall_bit_rate,
+        audio_codec = excluded.audio_codec,
+        audio_channels = excluded.audio_channels,
+        audio_sample_rate = excluded.audio_sample_rate,
+        can_remux = excluded.can_remux,
+        probe_status = excluded.probe_status,
+        probe_error = excluded.probe_error,
+        probe_attempts = excluded.probe_attempts,
+        probe_retry_at = excluded.probe_retry_at,
+        last_modified = CURRENT_TIMESTAMP
+"""
+
+# Replaces a video's tracks, looking the video up by path so it works on
+# rows written in the same batch
+DELETE_TRACKS_SQL = """
+    DELETE FROM tracks WHERE video_id = (SELECT id FROM videos WHERE file_path = ?)
+"""
+
+INSERT_TRACK_SQL = """
+    INSERT INTO tracks (
+        video_id, track_index, track_type, codec, codec_id, bit_rate,
+        duration_seconds, width, height, frame_rate, gop, channels,
+        sample_rate, language
+    )
+    SELECT id, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? FROM videos WHERE file_path = ?
+"""
+
+# Track fields, in INSERT_TRACK_SQL order after track_index and track_type
+TRACK_COLUMNS = (
+    'codec', 'codec_id', 'bit_rate', 'duration_seconds', 'width', 'height',
+    'frame_rate', 'gop', 'channels', 'sample_rate', 'language',
+)
+
+# Full-text index over what people search videos by. Its rowid is the
+# video's id. Prefix indexes make `term*` queries cheap.
+CREATE_SEARCH_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS videos_fts USING fts5(
+        title, platform, genre, subgenre, path, notes,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+"""
+
+INSERT_SEARCH_SQL = """
+    INSERT INTO videos_fts (rowid, title, platform, genre, subgenre, path, notes)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# bm25 weights of the search columns, in CREATE_SEARCH_SQL order: a match
+# in the title counts for more than one somewhere in the path
+SEARCH_WEIGHTS = (10.0, 5.0, 3.0, 3.0, 1.0, 2.0)
+
+# Columns of the rows returned by FosseData.search, in order
+SEARCH_COLUMNS = ('id', 'file_path', 'title', 'platform', 'genre', 'subgenre', 'rank')
+
+# Keys of a video's data that aren't notebook descriptions: settings,
+# extracted metadata, and fields with a search column of their own
+UNSEARCHED_KEYS = frozenset((
+    'decoding', 'date_format', 'time_format', 'skip', 'exclude',
+    'source_notebooks', 'under_influence', 'file_path', 'file_size_bytes',
+    'recording_date', 'genre', 'subgenre', 'platform', 'title',
+)) | frozenset(default_metadata())
+
+# Columns added after the first release, by table. init_tables adds any that
+# an existing database is missing.
+MIGRATED_COLUMNS = {
+    'notebooks': (
+        ('config_hash', 'TEXT'),
+        ('config_format', 'INTEGER'),
+    ),
+    'videos': (
+        ('stat_mtime_ns', 'INTEGER'),
+        ('stat_size', 'INTEGER'),
+        ('stat_inode', 'INTEGER'),
+        ('fingerprint', 'TEXT'),
+        ('bit_rate', 'INTEGER'),
+        ('aspect_ratio', 'REAL'),
+        ('container', 'TEXT'),
+        ('overall_bit_rate', 'INTEGER'),
+        ('audio_codec', 'TEXT'),
+        ('audio_channels', 'INTEGER'),
+        ('audio_sample_rate', 'INTEGER'),
+        ('can_remux', 'BOOLEAN DEFAULT 0'),
+        ('probe_status', 'TEXT'),
+        ('probe_error', 'TEXT'),
+        ('probe_attempts', 'INTEGER DEFAULT 0'),
+        ('probe_retry_at', 'INTEGER'),
+    ),
+    'schedule': (
+        ('sequence', 'INTEGER NOT NULL DEFAULT 0'),
+    ),
+}
+
+
+def encode_notebook(raw):
+    """
+    Serializes a notebook's raw data for storage.
+
+    Args:
+        raw (dict): The notebook's raw data, as returned by Notebook.raw().
+
+    Returns:
+        tuple: (config_data, config_hash). The data is canonical JSON (sorted
+            keys, no whitespace), so equal notebooks always hash the same.
+    """
+    # YAML can produce dates, which JSON can't hold; store them as text
+    config_data = json.dumps(raw, sort_keys=True, separators=(',', ':'), default=str)
+    config_hash = hashlib.sha256(config_data.encode('utf-8')).hexdigest()
+    return config_data, config_hash
+
+
+def subtree_range(dir_path):
+    """
+    Returns the bounds of an index-friendly range predicate matching every
+    path below a directory: `path >= low AND path < high`. '0' is the
+    character right after '/', so nothing outside the directory can fall
+    in between.
+
+    Args:
+        dir_path (str): Path to the directory.
+
+    Returns:
+        tuple: (low, high)
+    """
+    prefix = dir_path.rstrip('/')
+    return prefix + '/', prefix + '0'
+
+
+def search_notes(data):
+    """
+    Collects the free text of the notebook fields in a video's data, such
+    as `name` or a description, for the search index.
+
+    Args:
+        data (dict): The video's metadata or combined config.
+
+    Returns:
+        str: The fields' text values, space separated.
+    """
+    words = []
+    for key, value in data.items():
+        if key in UNSEARCHED_KEYS:
+            continue
+        if isinstance(value, str):
+            words.append(value)
+        elif isinstance(value, list):
+            words.extend(item for item in value if isinstance(item, str))
+    return ' '.join(words)
+
+
+def search_query(text, prefix=True):
+    """
+    Turns what someone typed into an FTS5 query matching every word, without
+    letting FTS5 syntax in the text through.
+
+    Args:
+        text (str): Search words.
+        prefix (bool): Also match words starting with each word.
+
+    Returns:
+        str: The FTS5 query, empty if there are no words.
+    """
+    star = '*' if prefix else ''
+    return ' '.join('"' + word.replace('"', '""') + '"' + star for word in text.split())
+
+
+def like_pattern(word):
+    """
+    Turns a search word into a LIKE pattern matching it anywhere, with any
+    `%` or `_` in the word matched literally. Use with ESCAPE '\\'.
+
+    Args:
+        word (str): A search word.
+
+    Returns:
+        str: The pattern.
+    """
+    escaped = word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+def to_bool(value):
+    """
+    Reads a boolean given as text, e.g. on the command line.
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+# Columns of the rows yielded by FosseData.query, in order
+QUERY_COLUMNS = (
+    'id', 'file_path', 'duration_seconds', 'width', 'height', 'codec',
+    'recording_date', 'genre', 'subgenre', 'platform', 'title',
+    'under_influence', 'can_remux', 'last_used',
+)
+
+QUERY_SQL = """
+    SELECT v.id, v.file_path, v.duration_seconds, v.width, v.height, v.codec,
+           v.recording_date, g.name, sg.name, p.name, t.name,
+           v.under_influence, v.can_remux, v.last_used
+    FROM videos v
+    LEFT JOIN genres g ON v.genre_id = g.id
+    LEFT JOIN subgenres sg ON v.subgenre_id = sg.id
+    LEFT JOIN platforms p ON v.platform_id = p.id
+    LEFT JOIN titles t ON v.title_id = t.id
+"""
+
+# Filters matched by name against a lookup table: filter -> table
+LOOKUP_FILTERS = {
+    'genre': 'genres',
+    'subgenre': 'subgenres',
+    'platform': 'platforms',
+    'title': 'titles',
+}
+
+# Other filters: filter -> (condition, converter). The converter turns the
+# filter's value, possibly given as text, into the condition's parameters.
+QUERY_FILTERS = {
+    'min_duration': ('v.duration_seconds >= ?', int),
+    'max_duration': ('v.duration_seconds <= ?', int),
+    'min_width': ('v.width >= ?', int),
+    'min_height': ('v.height >= ?', int),
+    'recorded_after': ('v.recording_date >= ?', str),
+    'recorded_before': ('v.recording_date < ?', str),
+    'under_influence': ('v.under_influence = ?', to_bool),
+    'can_remux': ('v.can_remux = ?', to_bool),
+    'probe_status': ('v.probe_status = ?', str),
+    'under': ('v.file_path >= ? AND v.file_path < ?', lambda path: subtree_range(str(path))),
+}
+
+# Orders FosseData.query can page through, each backed by an index: order ->
+# column. Rows come in (column, id) order; rows where the column is NULL are
+# left out.
+QUERY_ORDERS = {
+    'id': None,
+    'duration': 'v.duration_seconds',
+    'recording_date': 'v.recording_date',
+    'last_used': 'v.last_used',
+}
 
 
 class FosseData:
@@ -12,11 +309,126 @@ class FosseData:
 
         self.db_file = config['db_file']
 
-        self._con = sqlite3.connect(self.db_file)
+        # Number of video upserts to collect before writing them during a scan
+        self.batch_size = config.get('scan_batch_size', 500)
+        # List of pending video rows while a scan is running, None otherwise
+        self._pending_videos = None
+        # Track rows to write after the pending videos: (file_path, tracks)
+        self._pending_tracks = []
+        # Search index rows to write after the pending videos
+        self._pending_search = []
+        # Paths are indexed relative to the library root, so a search for a
+        # word in the root's own path doesn't match every video
+        root = config.get('root')
+        self._search_root = os.path.join(os.path.abspath(root), '') if root else None
+        # Directory fingerprints to record, only while a full or incremental
+        # scan is running
+        self._pending_dirs = None
+
+        # Days to keep cached metadata for videos that have disappeared
+        self.media_cache_days = config.get('media_cache_days', 30)
+
+        # Snapshot of the videos table for change detection during a scan
+        self.index_limit = config.get('scan_index_limit', 2000000)
+        self.video_index = None
+        # Videos whose extraction failed, by path, loaded alongside the index
+        self.probe_failures = None
+
+        # Stored directory fingerprints and children, loaded on demand
+        self._directories = None
+        self._subdirectories = None
+
+        # Notebook raw data by path, and combined configs by directory
+        self.reset_config_cache()
+
+        # Instrumentation; the scanner swaps in a ScanStats when it's on
+        self.stats = NULL_STATS
+
+        # Connection tuning. Every connection waits up to db_busy_timeout
+        # seconds for a lock before giving up with "database is locked"
+        self.busy_timeout = config.get('db_busy_timeout', 30)
+        self.synchronous = config.get('db_synchronous', 'NORMAL')
+        self.cache_mb = config.get('db_cache_mb', 64)
+        self.mmap_mb = config.get('db_mmap_mb', 256)
+
+        # Read-only connections for callers on other threads, such as the
+        # stream server's executor: idle ones, and how many may be out at once
+        self._readers = queue.SimpleQueue()
+        self._reader_slots = threading.BoundedSemaphore(config.get('db_readers', 4))
+
+        # The one connection that writes, used from the thread that made it
+        self._con = self._connect()
+        self._con.create_function('fosse_dirname', 1, os.path.dirname, deterministic=True)
         self.init_tables()
+        self.load_lookups()
 
     def __del__(self):
-        self._con.close()
+        self.close()
+
+    def close(self):
+        """
+        Closes the writer and every idle reader. Safe to call more than once.
+        """
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        if getattr(self, '_con', None) is not None:
+            self._con.close()
+            self._con = None
+
+    def _connect(self, read_only=False):
+        """
+        Opens a connection to the database with the db_* pragmas applied.
+
+        The database is kept in WAL mode, so readers see the last commit and
+        never wait on a writer, even one in the middle of a scan's batch.
+
+        Args:
+            read_only (bool): Open a reader for the pool, which can be handed
+                between threads and refuses writes.
+
+        Returns:
+            sqlite3.Connection: The new connection.
+        """
+        con = sqlite3.connect(
+            self.db_file, timeout=self.busy_timeout, check_same_thread=not read_only
+        )
+        if read_only:
+            con.execute("PRAGMA query_only = ON")
+        else:
+            # Stored in the database file, so this only changes anything the
+            # first time
+            mode = con.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+            if mode != 'wal':
+                logger.warning(f"Could not put {self.db_file} in WAL mode, using {mode}")
+        # NORMAL is safe with WAL: a power cut may lose the last commits,
+        # but never corrupts the database
+        con.execute(f"PRAGMA synchronous = {self.synchronous}")
+        # Negative sizes are in KiB
+        con.execute(f"PRAGMA cache_size = {-int(self.cache_mb * 1024)}")
+        con.execute(f"PRAGMA mmap_size = {int(self.mmap_mb * 1024 * 1024)}")
+        return con
+
+    @contextlib.contextmanager
+    def _reader(self):
+        """
+        Borrows a read-only connection from the pool, opening one if none is
+        idle. At most `db_readers` are out at once; other callers wait.
+
+            with self._reader() as con:
+                con.execute(...)
+        """
+        with self._reader_slots:
+            try:
+                con = self._readers.get_nowait()
+            except queue.Empty:
+                con = self._connect(read_only=True)
+            try:
+                yield con
+            finally:
+                self._readers.put(con)
 
     def init_tables(self):
         """
@@ -31,6 +443,8 @@ class FosseData:
                 id INTEGER PRIMARY KEY,
                 config_path TEXT NOT NULL UNIQUE,
                 config_data TEXT NOT NULL,
+                config_hash TEXT,
+                config_format INTEGER,
                 last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
             '''
@@ -48,6 +462,39 @@ class FosseData:
             '''
         )
 
+        # Directory fingerprints, used by incremental scans to skip
+        # directories whose entries haven't changed
+        cursor.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS directories (
+                path TEXT PRIMARY KEY,
+                parent TEXT,
+                mtime_ns INTEGER,
+                nlink INTEGER,
+                inode INTEGER
+            )
+            '''
+        )
+
+        cursor.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_directories_parent ON directories(parent)
+            '''
+        )
+
+        # Extracted metadata by content fingerprint, so videos that are moved
+        # or renamed don't need to be probed again
+        cursor.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS media_cache (
+                fingerprint TEXT PRIMARY KEY,
+                metadata TEXT NOT NULL,
+                last_used TIMESTAMP,
+                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            '''
+        )
+
         # Create normalized tables for shared metadata
         cursor.execute(
             '''
@@ -117,6 +564,29 @@ class FosseData:
                 under_influence BOOLEAN DEFAULT 0,
                 source_notebooks TEXT,
 
+                -- What the file looked like when it was last processed
+                stat_mtime_ns INTEGER,
+                stat_size INTEGER,
+                stat_inode INTEGER,
+                fingerprint TEXT,
+
+                -- Stream details, for choosing between copying and transcoding
+                bit_rate INTEGER,
+                aspect_ratio REAL,
+                container TEXT,
+                overall_bit_rate INTEGER,
+                audio_codec TEXT,
+                audio_channels INTEGER,
+                audio_sample_rate INTEGER,
+                can_remux BOOLEAN DEFAULT 0,
+
+                -- Outcome of the last metadata extraction; failed ones are
+                -- retried once probe_retry_at (unix time) has passed
+                probe_status TEXT,
+                probe_error TEXT,
+                probe_attempts INTEGER DEFAULT 0,
+                probe_retry_at INTEGER,
+
                 -- Foreign key constraints
                 FOREIGN KEY (genre_id) REFERENCES genres(id),
                 FOREIGN KEY (subgenre_id) REFERENCES subgenres(id),
@@ -126,6 +596,49 @@ class FosseData:
             '''
         )
 
+        # Every video, audio and subtitle track of each video
+        cursor.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS tracks (
+                id INTEGER PRIMARY KEY,
+                video_id INTEGER NOT NULL,
+                track_index INTEGER NOT NULL,
+                track_type TEXT NOT NULL,
+                codec TEXT,
+                codec_id TEXT,
+                bit_rate INTEGER,
+                duration_seconds INTEGER,
+                width INTEGER,
+                height INTEGER,
+                frame_rate REAL,
+                gop TEXT,
+                channels INTEGER,
+                sample_rate INTEGER,
+                language TEXT,
+                FOREIGN KEY (video_id) REFERENCES videos(id)
+            )
+            '''
+        )
+
+        # Precomputed channel schedules, times in seconds since the epoch
+        cursor.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS schedule (
+                id INTEGER PRIMARY KEY,
+                channel TEXT NOT NULL,
+                start_time INTEGER NOT NULL,
+                end_time INTEGER NOT NULL,
+                video_id INTEGER NOT NULL,
+                -- Running number within the channel, for HLS media sequences
+                sequence INTEGER NOT NULL,
+                FOREIGN KEY (video_id) REFERENCES videos(id)
+            )
+            '''
+        )
+
+        self._migrate_columns(cursor)
+        self._migrate_notebooks(cursor)
+
         # Create indexes for efficient searching - one statement per execute call
         cursor.execute(
             '''
@@ -157,9 +670,16 @@ class FosseData:
             '''
         )
 
+        # The genre, platform and title indexes carry the column a query by
+        # them is most likely ordered by, so FosseData.query can page through
+        # e.g. a title's episodes by date without sorting. They replace the
+        # single column indexes of older databases.
+        for old_index in ('idx_videos_genre', 'idx_videos_platform', 'idx_videos_title'):
+            cursor.execute(f"DROP INDEX IF EXISTS {old_index}")
+
         cursor.execute(
             '''
-            CREATE INDEX IF NOT EXISTS idx_videos_genre ON videos(genre_id)
+            CREATE INDEX IF NOT EXISTS idx_videos_genre_duration ON videos(genre_id, duration_seconds)
             '''
         )
 
@@ -171,13 +691,13 @@ class FosseData:
 
         cursor.execute(
             '''
-            CREATE INDEX IF NOT EXISTS idx_videos_platform ON videos(platform_id)
+            CREATE INDEX IF NOT EXISTS idx_videos_platform_recorded ON videos(platform_id, recording_date)
             '''
         )
 
         cursor.execute(
             '''
-            CREATE INDEX IF NOT EXISTS idx_videos_title ON videos(title_id)
+            CREATE INDEX IF NOT EXISTS idx_videos_title_recorded ON videos(title_id, recording_date)
             '''
         )
 
@@ -193,15 +713,104 @@ class FosseData:
             '''
         )
 
+        cursor.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_videos_fingerprint ON videos(fingerprint)
+            '''
+        )
+
+        cursor.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_schedule_channel_start ON schedule(channel, start_time)
+            '''
+        )
+
+        cursor.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_videos_can_remux ON videos(can_remux)
+            '''
+        )
+
+        cursor.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_videos_probe_status ON videos(probe_status)
+            '''
+        )
+
+        cursor.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_tracks_video ON tracks(video_id)
+            '''
+        )
+
+        cursor.execute(
+            '''
+            CREATE INDEX IF NOT EXISTS idx_tracks_type_codec ON tracks(track_type, codec)
+            '''
+        )
+
+        self._init_search(cursor)
+
         self._con.commit()
 
-    def insert_video(self, file_path, metadata):
+    def _init_search(self, cursor):
+        """
+        Creates the full-text search index, filling it in for databases that
+        predate it. Without FTS5 in the SQLite library, search falls back to
+        LIKE and the index isn't kept.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'videos_fts'")
+        exists = cursor.fetchone() is not None
+        try:
+            cursor.execute(CREATE_SEARCH_SQL)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Full-text search unavailable ({str(e)}), searching with LIKE instead")
+            self.has_search_index = False
+            return
+        self.has_search_index = True
+
+        if not exists:
+            self.rebuild_search_index()
+
+    def _migrate_columns(self, cursor):
+        """
+        Adds columns from MIGRATED_COLUMNS that an older database lacks.
+        """
+        for table, columns in MIGRATED_COLUMNS.items():
+            cursor.execute(f"PRAGMA table_info({table})")
+            existing = {row[1] for row in cursor.fetchall()}
+            for name, column_type in columns:
+                if name not in existing:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+                    if (table, name) == ('schedule', 'sequence'):
+                        # Number the entries already scheduled, so new ones
+                        # carry on from the last
+                        cursor.execute(
+                            """
+                            UPDATE schedule SET sequence = (
+                                SELECT COUNT(*) FROM schedule AS earlier
+                                WHERE earlier.channel = schedule.channel
+                                AND earlier.start_time < schedule.start_time
+                            )
+                            """
+                        )
+
+    def insert_video(self, file_path, metadata, file_stat=None, fingerprint=None, last_used=None,
+                     probe_attempts=0, probe_retry_at=None):
         """
         Inserts or updates a video in the database.
 
         Args:
             file_path (str): The path to the video file.
             metadata (dict): The metadata for the video.
+            file_stat (os.stat_result): The file's stat at the time the
+                metadata was extracted, used for change detection.
+            fingerprint (str): The file's content fingerprint.
+            last_used (str): When the video was last played, carried over
+                from a previous location. Never overrides a stored value.
+            probe_attempts (int): Failed extractions in a row.
+            probe_retry_at (int): Unix time after which a failed extraction
+                is retried.
         """
         # Extract normalized fields
         genre_name = metadata.get('genre')
@@ -218,73 +827,252 @@ class FosseData:
         title_id = self.get_or_create_title(title_name, platform_id)
         subgenre_id = self.get_or_create_subgenre(subgenre_name, genre_id)
 
+        # Tracks get rows of their own rather than a place in file_data
+        tracks = metadata.get('tracks')
+        if tracks is not None:
+            metadata = {key: value for key, value in metadata.items() if key != 'tracks'}
+
         # Serialize the full metadata for storage
         serialized_metadata = json.dumps(metadata)
 
         # Serialize source notebooks
         serialized_notebooks = json.dumps(source_notebooks)
 
+        row = (
+            file_path, serialized_metadata,
+            metadata.get('duration_seconds', 0),
+            metadata.get('width', 0),
+            metadata.get('height', 0),
+            metadata.get('video_format', 'unknown'),
+            metadata.get('codec', 'unknown'),
+            metadata.get('frame_rate', 0.0),
+            metadata.get('file_size_bytes', 0),
+            genre_id, subgenre_id, platform_id, title_id,
+            recording_date, under_influence, serialized_notebooks,
+            *self._stat_columns(file_stat), fingerprint, last_used,
+            metadata.get('bit_rate'),
+            metadata.get('aspect_ratio'),
+            metadata.get('container'),
+            metadata.get('overall_bit_rate'),
+            metadata.get('audio_codec'),
+            metadata.get('audio_channels'),
+            metadata.get('audio_sample_rate'),
+            bool(metadata.get('can_remux')),
+            metadata.get('probe_status', PROBE_OK),
+            metadata.get('probe_error'),
+            probe_attempts, probe_retry_at,
+        )
+        if tracks is not None:
+            self._pending_tracks.append((file_path, tracks))
+        if self.has_search_index:
+            self._pending_search.append((
+                file_path, title_name, platform_name, genre_name, subgenre_name,
+                self._search_path(file_path), search_notes(metadata),
+            ))
+
+        # During a scan, rows are collected and written in batches
+        if self._pending_videos is not None:
+            self._pending_videos.append(row)
+            if len(self._pending_videos) >= self.batch_size:
+                self.flush()
+            return
+
+        self._con.execute(UPSERT_VIDEO_SQL, row)
+        self._write_tracks()
+        self._write_search()
+        self._con.commit()
+
+    def _write_tracks(self):
+        if not self._pending_tracks:
+            return
+        cursor = self._con.cursor()
+        cursor.executemany(DELETE_TRACKS_SQL, [(path,) for path, _ in self._pending_tracks])
+        cursor.executemany(INSERT_TRACK_SQL, [
+            (index, track['type'], *(track.get(c) for c in TRACK_COLUMNS), path)
+            for path, tracks in self._pending_tracks
+            for index, track in enumerate(tracks)
+        ])
+        self._pending_tracks.clear()
+
+    def _write_search(self):
+        if not self._pending_search:
+            return
+        # Ids are looked up first: FTS5 takes a plain VALUES insert several
+        # times faster than an INSERT ... SELECT per row
         cursor = self._con.cursor()
+        rows = []
+        for file_path, *values in self._pending_search:
+            cursor.execute("SELECT id FROM videos WHERE file_path = ?", (file_path,))
+            rows.append((cursor.fetchone()[0], *values))
+        cursor.executemany("DELETE FROM videos_fts WHERE rowid = ?", [(row[0],) for row in rows])
+        cursor.executemany(INSERT_SEARCH_SQL, rows)
+        self._pending_search.clear()
+
+    def rebuild_search_index(self):
+        """
+        Refills the full-text search index from the videos table.
+        """
+        cursor = self._con.cursor()
+        cursor.execute("DELETE FROM videos_fts")
         cursor.execute(
             """
-            INSERT INTO videos (
-                file_path, file_data, duration_seconds, width, height,
-                video_format, codec, frame_rate, file_size_bytes,
-                genre_id, subgenre_id, platform_id, title_id,
-                recording_date, under_influence, source_notebooks
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(file_path) DO UPDATE SET
-                file_data = excluded.file_data,
-                duration_seconds = excluded.duration_seconds,
-                width = excluded.width,
-                height = excluded.height,
-                video_format = excluded.video_format,
-                codec = excluded.codec,
-                frame_rate = excluded.frame_rate,
-                file_size_bytes = excluded.file_size_bytes,
-                genre_id = excluded.genre_id,
-                subgenre_id = excluded.subgenre_id,
-                platform_id = excluded.platform_id,
-                title_id = excluded.title_id,
-                recording_date = excluded.recording_date,
-                under_influence = excluded.under_influence,
-                source_notebooks = excluded.source_notebooks,
-                last_modified = CURRENT_TIMESTAMP
-            """,
+            SELECT v.id, t.name, p.name, g.name, sg.name, v.file_path, v.file_data
+            FROM videos v
+            LEFT JOIN genres g ON v.genre_id = g.id
+            LEFT JOIN subgenres sg ON v.subgenre_id = sg.id
+            LEFT JOIN platforms p ON v.platform_id = p.id
+            LEFT JOIN titles t ON v.title_id = t.id
+            """
+        )
+        self._con.executemany(
+            INSERT_SEARCH_SQL,
             (
-                file_path, serialized_metadata,
-                metadata.get('duration_seconds', 0),
-                metadata.get('width', 0),
-                metadata.get('height', 0),
-                metadata.get('video_format', 'unknown'),
-                metadata.get('codec', 'unknown'),
-                metadata.get('frame_rate', 0.0),
-                metadata.get('file_size_bytes', 0),
-                genre_id, subgenre_id, platform_id, title_id,
-                recording_date, under_influence, serialized_notebooks
+                (*row[:5], self._search_path(row[5]), search_notes(json.loads(row[6])))
+                for row in cursor.fetchall()
+            ),
+        )
+
+    def _search_path(self, file_path):
+        if self._search_root and file_path.startswith(self._search_root):
+            return file_path[len(self._search_root):]
+        return file_path
+
+    @staticmethod
+    def _stat_columns(file_stat):
+        if file_stat is None:
+            return None, None, None
+        return file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino
+
+    def update_video_stat(self, file_path, file_stat):
+        """
+        Records a file's stat without touching its metadata. Used to adopt
+        videos stored before stat columns existed.
+
+        Args:
+            file_path (str): The path to the video file.
+            file_stat (os.stat_result): The file's current stat.
+        """
+        self._con.execute(
+            """
+            UPDATE videos
+            SET stat_mtime_ns = ?, stat_size = ?, stat_inode = ?
+            WHERE file_path = ?
+            """,
+            (*self._stat_columns(file_stat), file_path)
+        )
+        self._commit()
+
+    def get_cached_metadata(self, fingerprint):
+        """
+        Looks up metadata extracted earlier for a file with the same content.
+
+        Args:
+            fingerprint (str): The file's content fingerprint.
+
+        Returns:
+            tuple: (metadata dict, last_used) or None on a miss. last_used
+                is the most recent play of any copy of the file.
+        """
+        cursor = self._con.cursor()
+        cursor.execute(
+            """
+            SELECT metadata, COALESCE(
+                (SELECT MAX(last_used) FROM videos WHERE fingerprint = media_cache.fingerprint),
+                last_used
             )
+            FROM media_cache WHERE fingerprint = ?
+            """,
+            (fingerprint,)
         )
-        self._con.commit()
+        result = cursor.fetchone()
+        if not result:
+            return None
+        return json.loads(result[0]), result[1]
+
+    def cache_metadata(self, fingerprint, metadata):
+        """
+        Remembers extracted metadata under the file's content fingerprint.
+
+        Args:
+            fingerprint (str): The file's content fingerprint.
+            metadata (dict): Metadata extracted from the file.
+        """
+        self._con.execute(
+            """
+            INSERT INTO media_cache (fingerprint, metadata) VALUES (?, ?)
+            ON CONFLICT(fingerprint) DO UPDATE SET
+                metadata = excluded.metadata,
+                last_seen = CURRENT_TIMESTAMP
+            """,
+            (fingerprint, json.dumps(metadata))
+        )
+        self._commit()
+
+    def flush(self):
+        """
+        Writes any videos batched up during a scan and commits. Everything
+        written since the previous flush lands in a single transaction, so a
+        crash mid-batch leaves the database as of the last flush.
+        """
+        self._write_pending()
+        with self.stats.stage('commit'):
+            self._con.commit()
+
+    def _write_pending(self):
+        if self._pending_videos:
+            with self.stats.stage('db_write'):
+                self._con.executemany(UPSERT_VIDEO_SQL, self._pending_videos)
+                self._write_tracks()
+                self._write_search()
+            self.stats.count('videos_written', len(self._pending_videos))
+            self._pending_videos.clear()
+
+    def _commit(self):
+        """
+        Commits, unless a scan is in progress. Scans commit once per batch
+        (see flush) rather than once per row.
+        """
+        if self._pending_videos is None:
+            self._con.commit()
 
     def insert_notebook(self, config_path, notebook):
         """
         Inserts or updates a Notebook into the database.
         Args:
             config_path (str): The path to the directory containing fosse.yml.
-            config_data (str): The serialized content of the configuration (JSON/YAML).
+            notebook (Notebook): The notebook loaded from that fosse.yml.
+
+        Returns:
+            bool: True if the notebook is new or its content changed.
         """
-        config_data = pickle.dumps(notebook)
+        config_data, config_hash = encode_notebook(notebook.raw())
+
         cur = self._con.cursor()
         cur.execute(
-            """
-            INSERT INTO notebooks (config_path, config_data)
-            VALUES (?, ?)
-            ON CONFLICT(config_path) DO UPDATE SET
-                config_data = excluded.config_data,
-                last_modified = CURRENT_TIMESTAMP;
-            """,
-            (config_path, config_data),
+            "SELECT config_hash FROM notebooks WHERE config_path = ?",
+            (config_path,)
         )
+        existing = cur.fetchone()
+        changed = existing is None or existing[0] != config_hash
+
+        if changed:
+            cur.execute(
+                """
+                INSERT INTO notebooks (config_path, config_data, config_hash, config_format)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(config_path) DO UPDATE SET
+                    config_data = excluded.config_data,
+                    config_hash = excluded.config_hash,
+                    config_format = excluded.config_format,
+                    last_modified = CURRENT_TIMESTAMP;
+                """,
+                (config_path, config_data, config_hash, NOTEBOOK_FORMAT),
+            )
+            # Cached configs at and below this notebook are now stale. Cache
+            # what was stored, so YAML dates are text here too
+            self._get_notebooks()[config_path] = json.loads(config_data)
+            self._invalidate_configs(config_path)
+
         cur.execute(
             """
             INSERT OR IGNORE INTO temp_existing_notebooks (path)
@@ -292,7 +1080,38 @@ class FosseData:
             """,
             (config_path,),
         )
-        self._con.commit()
+        self._commit()
+        return changed
+
+    def _migrate_notebooks(self, cursor):
+        """
+        Converts notebooks stored as pickled Notebook objects by older
+        versions. Rather than unpickling them, each one is rebuilt from its
+        fosse.yml; rows whose fosse.yml is gone are dropped, as the next
+        scan would purge them anyway.
+        """
+        cursor.execute("SELECT config_path FROM notebooks WHERE config_format IS NULL")
+        legacy = [row[0] for row in cursor.fetchall()]
+        if not legacy:
+            return
+
+        logger.info(f"Converting {len(legacy)} notebooks to the current storage format")
+        fosse_file = self.config.get('fosse_file', 'fosse.yml')
+        for config_path in legacy:
+            fosse_path = os.path.join(config_path, fosse_file)
+            if not os.path.isfile(fosse_path):
+                cursor.execute("DELETE FROM notebooks WHERE config_path = ?", (config_path,))
+                continue
+
+            config_data, config_hash = encode_notebook(Notebook(self.config, fosse_path).raw())
+            cursor.execute(
+                """
+                UPDATE notebooks
+                SET config_data = ?, config_hash = ?, config_format = ?
+                WHERE config_path = ?
+                """,
+                (config_data, config_hash, NOTEBOOK_FORMAT, config_path)
+            )
 
     def get_applicable_notebook(self, file_path):
         """
@@ -343,9 +1162,11 @@ class FosseData:
         videos and notebooks allowing for purging of entries that no longer
         exist.
         """
-        self._con.execute("PRAGMA journal_mode = WAL")  # Better performance
         cursor = self._con.cursor()
 
+        # Notebooks may have been changed by someone else since the last scan
+        self.reset_config_cache()
+
         # Create temporary table for existing videos
         cursor.execute("DROP TABLE IF EXISTS temp_existing_files")
         cursor.execute("CREATE TEMPORARY TABLE temp_existing_files (path TEXT PRIMARY KEY)")
@@ -354,24 +1175,64 @@ class FosseData:
         cursor.execute("DROP TABLE IF EXISTS temp_existing_notebooks")
         cursor.execute("CREATE TEMPORARY TABLE temp_existing_notebooks (path TEXT PRIMARY KEY)")
 
+        # Create temporary tables for directories seen, and the subset of
+        # those skipped because their fingerprint didn't change
+        cursor.execute("DROP TABLE IF EXISTS temp_existing_dirs")
+        cursor.execute("CREATE TEMPORARY TABLE temp_existing_dirs (path TEXT PRIMARY KEY)")
+        cursor.execute("DROP TABLE IF EXISTS temp_unchanged_dirs")
+        cursor.execute("CREATE TEMPORARY TABLE temp_unchanged_dirs (path TEXT PRIMARY KEY)")
+        self._directories = None
+        self._subdirectories = None
+        self._pending_dirs = []
+
+        self.load_video_index()
+
         # Begin transaction
         self._con.execute("BEGIN TRANSACTION")
+        self.begin_batch()
+
+    def begin_batch(self):
+        """
+        Starts collecting video writes into batches, as during a scan. Used
+        on its own for small updates, such as the ones made by `fosse watch`.
+        """
+        if self._pending_videos is None:
+            self._pending_videos = []
+
+    def end_batch(self):
+        """
+        Writes everything collected since begin_batch and commits.
+        """
+        self.flush()
+        self._pending_videos = None
 
     def end_of_scan(self):
         """
         To be called at the end of a scan. Will purge entries that no longer
         exist in the filesystem.
         """
+        started = time.perf_counter()
+        self._write_pending()
+        self._pending_videos = None
+        self.video_index = None
+        self.probe_failures = None
+
         cursor = self._con.cursor()
 
-        # Delete videos not in temp_existing_files
+        # Videos in skipped directories were never visited, but still exist
         cursor.execute(
             """
-            DELETE FROM videos
-            WHERE file_path NOT IN (SELECT path FROM temp_existing_files)
+            INSERT OR IGNORE INTO temp_existing_files (path)
+            SELECT file_path FROM videos
+            WHERE fosse_dirname(file_path) IN (SELECT path FROM temp_unchanged_dirs)
             """
         )
 
+        # Delete videos not in temp_existing_files
+        self._delete_videos(
+            "file_path NOT IN (SELECT path FROM temp_existing_files)", ()
+        )
+
         # Delete notebooks not in temp_existing_notebooks
         cursor.execute(
             """
@@ -380,29 +1241,389 @@ class FosseData:
             """
         )
 
+        # Forget cached metadata nothing has referred to for a while
+        cursor.execute(
+            """
+            DELETE FROM media_cache
+            WHERE last_seen < datetime('now', ?)
+            AND fingerprint NOT IN (
+                SELECT fingerprint FROM videos WHERE fingerprint IS NOT NULL
+            )
+            """,
+            (f"-{self.media_cache_days} days",)
+        )
+
+        # Record fingerprints for directories we listed. These are written in
+        # the same transaction as the last batch of videos, so a directory is
+        # only ever skipped once everything in it has been committed.
+        cursor.executemany(
+            """
+            INSERT INTO directories (path, parent, mtime_ns, nlink, inode)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET
+                parent = excluded.parent,
+                mtime_ns = excluded.mtime_ns,
+                nlink = excluded.nlink,
+                inode = excluded.inode
+            """,
+            self._pending_dirs,
+        )
+        self._pending_dirs = None
+
+        # Delete directories not in temp_existing_dirs
+        cursor.execute(
+            """
+            DELETE FROM directories
+            WHERE path NOT IN (SELECT path FROM temp_existing_dirs)
+            """
+        )
+
         # Commit transaction
         self._con.commit()
 
+        # Purged notebooks must not linger in the config cache
+        self.reset_config_cache()
+        self.stats.observe('end_of_scan', time.perf_counter() - started)
+
+    def load_video_index(self):
+        """
+        Loads every tracked video into a VideoIndex, unless there are more
+        than `scan_index_limit` of them, in which case get_video_state falls
+        back to querying per file.
+        """
+        self.video_index = None
+        self.probe_failures = None
+        cursor = self._con.cursor()
+        cursor.execute("SELECT COUNT(*) FROM videos")
+        count = cursor.fetchone()[0]
+        if count > self.index_limit:
+            logger.info(
+                f"{count} videos exceeds scan_index_limit ({self.index_limit}), "
+                "querying per file instead"
+            )
+            return
+
+        cursor.execute(
+            """
+            SELECT file_path, id, stat_mtime_ns, stat_size, stat_inode, last_modified
+            FROM videos
+            ORDER BY file_path
+            """
+        )
+        self.video_index = VideoIndex(
+            (row[0], *VideoIndex.state_from_row(*row[1:])) for row in cursor
+        )
+
+        # Failures are rare, so they get a plain dict rather than a place in
+        # the index
+        cursor.execute(
+            """
+            SELECT file_path, probe_attempts, probe_retry_at FROM videos
+            WHERE probe_status != ?
+            """,
+            (PROBE_OK,)
+        )
+        self.probe_failures = {row[0]: row[1:] for row in cursor}
+
+    def get_video_state(self, file_path):
+        """
+        Looks up what we know about a video file, from the scan's in-memory
+        index when there is one.
+
+        Args:
+            file_path (str): Absolute path of the video.
+
+        Returns:
+            tuple: (id, mtime_ns, size, inode) as recorded when the video was
+                last processed, or None if the video isn't tracked. For rows
+                stored before stat columns existed, inode is None and
+                mtime_ns is the time the row was written.
+        """
+        if self.video_index is not None:
+            return self.video_index.get(file_path)
+
+        cursor = self._con.cursor()
+        cursor.execute(
+            """
+            SELECT id, stat_mtime_ns, stat_size, stat_inode, last_modified
+            FROM videos WHERE file_path = ?
+            """,
+            (file_path,)
+        )
+        result = cursor.fetchone()
+        if not result:
+            return None
+        return VideoIndex.state_from_row(*result)
+
+    def get_probe_failure(self, file_path):
+        """
+        Args:
+            file_path (str): Absolute path of the video.
+
+        Returns:
+            tuple: (attempts, retry_at) if the video's last metadata
+                extraction failed, None otherwise.
+        """
+        if self.probe_failures is not None:
+            return self.probe_failures.get(file_path)
+
+        cursor = self._con.cursor()
+        cursor.execute(
+            "SELECT probe_attempts, probe_retry_at FROM videos WHERE file_path = ? AND probe_status != ?",
+            (file_path, PROBE_OK)
+        )
+        return cursor.fetchone()
+
+    def get_retries_in_unchanged_dirs(self, now):
+        """
+        Args:
+            now (float): Current unix time.
+
+        Returns:
+            list: Paths of videos in directories an incremental scan skipped
+                whose failed extraction is due a retry.
+        """
+        cursor = self._con.cursor()
+        cursor.execute(
+            """
+            SELECT file_path FROM videos
+            WHERE probe_status != ? AND COALESCE(probe_retry_at, 0) <= ?
+            AND fosse_dirname(file_path) IN (SELECT path FROM temp_unchanged_dirs)
+            """,
+            (PROBE_OK, now)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_playable_videos(self):
+        """
+        Returns:
+            cursor: (id, file_path, duration_seconds, genre, subgenre,
+                platform, title, under_influence, last_used) for every video
+                whose metadata could be extracted, with the lookup names
+                resolved.
+        """
+        cursor = self._con.cursor()
+        cursor.execute(
+            """
+            SELECT v.id, v.file_path, v.duration_seconds,
+                   g.name, sg.name, p.name, t.name,
+                   v.under_influence, v.last_used
+            FROM videos v
+            LEFT JOIN genres g ON v.genre_id = g.id
+            LEFT JOIN subgenres sg ON v.subgenre_id = sg.id
+            LEFT JOIN platforms p ON v.platform_id = p.id
+            LEFT JOIN titles t ON v.title_id = t.id
+            WHERE v.probe_status IS NULL OR v.probe_status = ?
+            ORDER BY v.id
+            """,
+            (PROBE_OK,)
+        )
+        return cursor
+
+    def load_directories(self):
+        """
+        Loads the stored directory fingerprints and the parent -> children
+        map used to walk past unchanged directories.
+        """
+        cursor = self._con.cursor()
+        cursor.execute("SELECT path, parent, mtime_ns, nlink, inode FROM directories")
+        self._directories = {}
+        self._subdirectories = {}
+        for path, parent, mtime_ns, nlink, inode in cursor:
+            self._directories[path] = (mtime_ns, nlink, inode)
+            self._subdirectories.setdefault(parent, []).append(path)
+
+    def known_directories(self):
+        """
+        Returns:
+            list: Every directory recorded by the last scan.
+        """
+        cursor = self._con.cursor()
+        cursor.execute("SELECT path FROM directories")
+        return [row[0] for row in cursor]
+
+    def is_known_directory(self, dir_path):
+        """
+        Returns:
+            bool: True if the directory was recorded by an earlier scan.
+        """
+        if self._directories is None:
+            self.load_directories()
+        return dir_path in self._directories
+
+    def directory_unchanged(self, dir_path, fingerprint):
+        """
+        Checks a directory against the fingerprint stored by the last scan.
+
+        Args:
+            dir_path (str): Path to the directory.
+            fingerprint (tuple): (st_mtime_ns, st_nlink, st_ino) of the directory.
+
+        Returns:
+            bool: True if the directory's entries haven't changed.
+        """
+        if self._directories is None:
+            self.load_directories()
+        return self._directories.get(dir_path) == fingerprint
+
+    def get_subdirectories(self, dir_path):
+        """
+        Returns:
+            list: The subdirectories of dir_path as of the last scan.
+        """
+        if self._subdirectories is None:
+            self.load_directories()
+        return self._subdirectories.get(dir_path, [])
+
+    def mark_directory(self, dir_path, fingerprint, changed=True):
+        """
+        Marks a directory as existing for end-of-scan cleanup.
+
+        Args:
+            dir_path (str): Path to the directory.
+            fingerprint (tuple): (st_mtime_ns, st_nlink, st_ino) of the directory.
+            changed (bool): False if the directory was skipped, in which case
+                the videos stored for it are kept as they are.
+        """
+        if self._pending_dirs is None:
+            # Not in a scan: nothing to purge, and recording fingerprints
+            # could make a later incremental scan skip something we missed
+            return
+
+        cursor = self._con.cursor()
+        cursor.execute(
+            "INSERT OR IGNORE INTO temp_existing_dirs (path) VALUES (?)",
+            (dir_path,)
+        )
+        if changed:
+            parent = os.path.dirname(dir_path)
+            if parent == dir_path:
+                parent = None  # Filesystem root
+            self._pending_dirs.append((dir_path, parent, *fingerprint))
+        else:
+            cursor.execute(
+                "INSERT OR IGNORE INTO temp_unchanged_dirs (path) VALUES (?)",
+                (dir_path,)
+            )
+
+    def delete_video(self, file_path):
+        """
+        Removes a single video, e.g. one deleted while watching the tree.
+
+        Args:
+            file_path (str): Absolute path of the video.
+        """
+        self._delete_videos("file_path = ?", (file_path,))
+        self._commit()
+
+    def delete_subtree(self, dir_path):
+        """
+        Removes every video, notebook and directory at or below dir_path.
+
+        Args:
+            dir_path (str): Absolute path of the directory.
+        """
+        low, high = subtree_range(dir_path)
+        self._delete_videos("file_path >= ? AND file_path < ?", (low, high))
+
+        cursor = self._con.cursor()
+        cursor.execute(
+            "DELETE FROM notebooks WHERE config_path = ? OR (config_path >= ? AND config_path < ?)",
+            (dir_path, low, high)
+        )
+        if cursor.rowcount:
+            self.reset_config_cache()
+        cursor.execute(
+            "DELETE FROM directories WHERE path = ? OR (path >= ? AND path < ?)",
+            (dir_path, low, high)
+        )
+        self._commit()
+
+    def _delete_videos(self, where, params):
+        # Keep last_used around in case the videos show up somewhere else
+        self._write_pending()
+        cursor = self._con.cursor()
+        cursor.execute(
+            f"""
+            UPDATE media_cache
+            SET last_used = COALESCE((
+                    SELECT MAX(last_used) FROM videos
+                    WHERE fingerprint = media_cache.fingerprint
+                ), last_used),
+                last_seen = CURRENT_TIMESTAMP
+            WHERE fingerprint IN (SELECT fingerprint FROM videos WHERE {where})
+            """,
+            params
+        )
+        cursor.execute(
+            f"DELETE FROM tracks WHERE video_id IN (SELECT id FROM videos WHERE {where})",
+            params
+        )
+        if self.has_search_index:
+            cursor.execute(
+                f"DELETE FROM videos_fts WHERE rowid IN (SELECT id FROM videos WHERE {where})",
+                params
+            )
+        cursor.execute(f"DELETE FROM videos WHERE {where}", params)
+
+    def remove_notebook(self, config_path):
+        """
+        Removes the notebook stored for a directory.
+
+        Args:
+            config_path (str): The path to the directory that held fosse.yml.
+
+        Returns:
+            bool: True if there was a notebook to remove.
+        """
+        cursor = self._con.cursor()
+        cursor.execute("DELETE FROM notebooks WHERE config_path = ?", (config_path,))
+        if not cursor.rowcount:
+            return False
+
+        self._get_notebooks().pop(config_path, None)
+        self._invalidate_configs(config_path)
+        self._commit()
+        return True
+
+    def has_notebook(self, dir_path):
+        """
+        Returns:
+            bool: True if a notebook is stored for dir_path.
+        """
+        return dir_path in self._get_notebooks()
+
     def update_videos_for_config(self, config_path):
         """
         Updates all videos affected by changes to a config file.
+
+        Videos are grouped by directory, so each directory's combined config
+        and lookup ids are resolved once and its videos are updated with a
+        single executemany.
         """
-        cursor = self._con.cursor()
+        started = time.perf_counter()
+
+        # Make sure videos batched up during a scan are visible to the update
+        if self._pending_videos:
+            self._write_pending()
 
-        # Find all video files in this directory and subdirectories
-        like_pattern = f"{config_path}/%"
+        cursor = self._con.cursor()
 
-        # Get all videos in this directory and subdirectories
+        # Get all videos in this directory and subdirectories, using a range
+        # on file_path rather than LIKE so idx_file_path can be used
+        low, high = subtree_range(config_path)
         cursor.execute("""
             SELECT id, file_path FROM videos
-            WHERE file_path LIKE ? OR file_path = ?
-        """, (like_pattern, config_path))
+            WHERE (file_path >= ? AND file_path < ?) OR file_path = ?
+        """, (low, high, config_path))
 
-        affected_videos = cursor.fetchall()
+        videos_by_dir = {}
+        for video_id, file_path in cursor.fetchall():
+            videos_by_dir.setdefault(os.path.dirname(file_path), []).append((video_id, file_path))
 
-        for video_id, file_path in affected_videos:
-            # Get the combined configuration for this video
-            combined_config = self.get_combined_config_for_file(file_path)
+        for dir_path, videos in videos_by_dir.items():
+            # Get the combined configuration for this directory
+            combined_config = self.get_combined_config_for_dir(dir_path)
 
             # Extract metadata fields
             genre_name = combined_config.get('genre')
@@ -417,9 +1638,10 @@ class FosseData:
             title_id = self.get_or_create_title(title_name, platform_id)
             subgenre_id = self.get_or_create_subgenre(subgenre_name, genre_id)
 
-            # Update the video record with the new configuration
+            # Update the video records with the new configuration
             serialized_config = json.dumps(combined_config)
-            cursor.execute("""
+            serialized_notebooks = json.dumps(combined_config['source_notebooks'])
+            cursor.executemany("""
                 UPDATE videos
                 SET file_data = ?,
                     genre_id = ?,
@@ -427,12 +1649,34 @@ class FosseData:
                     platform_id = ?,
                     title_id = ?,
                     under_influence = ?,
+                    source_notebooks = ?,
                     last_modified = CURRENT_TIMESTAMP
                 WHERE id = ?
-            """, (serialized_config, genre_id, subgenre_id, platform_id, title_id,
-                under_influence, video_id))
+            """, [
+                (serialized_config, genre_id, subgenre_id, platform_id, title_id,
+                    under_influence, serialized_notebooks, video_id)
+                for video_id, _ in videos
+            ])
+
+            if self.has_search_index:
+                notes = search_notes(combined_config)
+                cursor.executemany(
+                    "DELETE FROM videos_fts WHERE rowid = ?",
+                    [(video_id,) for video_id, _ in videos]
+                )
+                cursor.executemany(
+                    INSERT_SEARCH_SQL,
+                    [
+                        (video_id, title_name, platform_name, genre_name, subgenre_name,
+                            self._search_path(file_path), notes)
+                        for video_id, file_path in videos
+                    ]
+                )
+
+        self._commit()
+        self.stats.observe('notebook_update', time.perf_counter() - started)
 
-        self._con.commit()
+    def get_combined_config_for_file(self, file_path):
         """
         Calculates the combined configuration for a file by merging
         all applicable configs from parent directories.
@@ -443,109 +1687,401 @@ class FosseData:
         Returns:
             dict: The combined configuration
         """
-        # Get directory containing the file
-        dir_path = os.path.dirname(file_path)
-        parent_paths = []
+        return self.get_combined_config_for_dir(os.path.dirname(file_path))
 
-        # Generate all possible parent directories
-        while dir_path:
-            parent_paths.append(dir_path)
-            dir_path = os.path.dirname(dir_path)
+    def get_combined_config_for_dir(self, dir_path):
+        """
+        Calculates the combined configuration for the files in a directory.
+        Deeper notebooks take precedence over the ones above them.
 
-        # Add root directory if needed
-        if '/' not in parent_paths:
-            parent_paths.append('/')
+        Results are cached per directory and built from the parent's cached
+        result, so walking down the tree costs one dictionary merge per
+        directory and files in the same directory resolve in O(1).
+
+        Args:
+            dir_path (str): Path to the directory
+
+        Returns:
+            dict: The combined configuration
+        """
+        cached = self._dir_configs.get(dir_path)
+        if cached is None:
+            parent_path = os.path.dirname(dir_path)
+            if dir_path and parent_path != dir_path:
+                parent = self.get_combined_config_for_dir(parent_path)
+            else:
+                parent = {'source_notebooks': []}
+
+            config = self._get_notebooks().get(dir_path)
+            if config:
+                cached = {**parent, **config}
+                # Track which notebooks contributed, most specific first
+                cached['source_notebooks'] = [dir_path] + parent['source_notebooks']
+            else:
+                cached = parent
+            self._dir_configs[dir_path] = cached
+
+        return dict(cached)
+
+    def _get_notebooks(self):
+        """
+        Returns:
+            dict: The raw data of every stored notebook, keyed by path.
+        """
+        if self._notebooks is None:
+            cursor = self._con.cursor()
+            cursor.execute("SELECT config_path, config_data FROM notebooks")
+            self._notebooks = {
+                path: json.loads(config_data)
+                for path, config_data in cursor.fetchall()
+            }
+        return self._notebooks
+
+    def _invalidate_configs(self, config_path):
+        """
+        Drops cached combined configs for a directory and everything below it.
+        """
+        prefix = config_path.rstrip('/') + '/'
+        for dir_path in list(self._dir_configs):
+            if dir_path == config_path or dir_path.startswith(prefix):
+                del self._dir_configs[dir_path]
 
+    def reset_config_cache(self):
+        """
+        Forgets every cached notebook and combined config.
+        """
+        self._notebooks = None
+        self._dir_configs = {}
+
+    def get_schedule_end(self, channel):
+        """
+        Args:
+            channel (str): Channel name.
+
+        Returns:
+            int: When the channel's schedule runs out, or None if it has none.
+        """
         cursor = self._con.cursor()
+        cursor.execute(
+            "SELECT MAX(end_time) FROM schedule WHERE channel = ?",
+            (channel,)
+        )
+        return cursor.fetchone()[0]
 
-        # SQL query to find ALL configs that apply (not just most specific)
-        placeholders = ','.join(['?'] * len(parent_paths))
-        query = f"""
-            SELECT config_path, config_data FROM notebooks
-            WHERE config_path IN ({placeholders})
-            ORDER BY LENGTH(config_path) DESC
+    def add_to_schedule(self, channel, entries):
         """
+        Appends to a channel's schedule and moves the scheduled videos'
+        last_used up to when they will play, in one transaction.
 
-        cursor.execute(query, parent_paths)
-        results = cursor.fetchall()
+        Args:
+            channel (str): Channel name.
+            entries (list): (video_id, start_time, end_time) tuples.
+        """
+        cursor = self._con.cursor()
+        cursor.execute(
+            """
+            SELECT sequence FROM schedule WHERE channel = ?
+            ORDER BY start_time DESC LIMIT 1
+            """,
+            (channel,)
+        )
+        result = cursor.fetchone()
+        first = result[0] + 1 if result else 0
 
-        # Track which notebooks contributed to this config
-        source_notebooks = []
+        cursor.executemany(
+            """
+            INSERT INTO schedule (channel, start_time, end_time, video_id, sequence)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [
+                (channel, start, end, video_id, sequence)
+                for sequence, (video_id, start, end) in enumerate(entries, first)
+            ]
+        )
+        # last_used is 'YYYY-MM-DD HH:MM:SS' UTC, which sorts as text
+        cursor.executemany(
+            """
+            UPDATE videos SET last_used = MAX(COALESCE(last_used, ''), ?)
+            WHERE id = ?
+            """,
+            [
+                (datetime.datetime.fromtimestamp(start, datetime.timezone.utc)
+                    .strftime('%Y-%m-%d %H:%M:%S'), video_id)
+                for video_id, start, _ in entries
+            ]
+        )
+        self._commit()
 
-        # Merge configurations, with deeper directories taking precedence
-        merged_config = {}
-        for path, config_data in results:
-            config = pickle.loads(config_data).raw()
-            if config:
-                # Update the merged config, overriding any existing keys
-                merged_config.update(config)
-                source_notebooks.append(path)
+    def get_scheduled(self, channel, at):
+        """
+        Looks up what a channel is playing at a given time.
 
-        # Add the source notebooks to the config
-        merged_config['source_notebooks'] = source_notebooks
+        Args:
+            channel (str): Channel name.
+            at (int): Seconds since the epoch.
 
-        return merged_config
+        Returns:
+            tuple: (video_id, file_path, start_time, end_time), or None if
+                nothing is scheduled then or the video has since been removed.
+        """
+        with self._reader() as con:
+            result = con.execute(
+                """
+                SELECT s.video_id, v.file_path, s.start_time, s.end_time
+                FROM schedule s
+                JOIN videos v ON v.id = s.video_id
+                WHERE s.channel = ? AND s.start_time <= ?
+                ORDER BY s.start_time DESC
+                LIMIT 1
+                """,
+                (channel, at)
+            ).fetchone()
+        if not result or result[3] <= at:
+            return None
+        return result
 
-    def get_combined_config_for_file(self, file_path):
+    def get_schedule_window(self, channel, at, count):
         """
-        Calculates the combined configuration for a file by merging
-        all applicable configs from parent directories.
+        Looks up what a channel is playing at a given time and what follows.
 
         Args:
-            file_path (str): Path to the video file
+            channel (str): Channel name.
+            at (int): Seconds since the epoch.
+            count (int): Maximum number of entries to return.
 
         Returns:
-            dict: The combined configuration
+            list: (sequence, video_id, file_path, start_time, end_time)
+                tuples in playing order, starting with the entry playing at
+                `at`. Entries for removed videos are left out.
         """
-        # Get directory containing the file
-        dir_path = os.path.dirname(file_path)
-        parent_paths = []
+        with self._reader() as con:
+            rows = con.execute(
+                """
+                SELECT s.sequence, s.video_id, v.file_path, s.start_time, s.end_time
+                FROM schedule s
+                JOIN videos v ON v.id = s.video_id
+                WHERE s.channel = ? AND s.start_time >= COALESCE((
+                    SELECT MAX(start_time) FROM schedule
+                    WHERE channel = ? AND start_time <= ?
+                ), ?)
+                ORDER BY s.start_time
+                LIMIT ?
+                """,
+                (channel, channel, at, at, count)
+            ).fetchall()
+        return [row for row in rows if row[4] > at]
+
+    def query(self, filters=None, order='id', after=None, limit=None, descending=False):
+        """
+        Finds videos by any combination of QUERY_FILTERS and LOOKUP_FILTERS,
+        streaming the rows from the cursor rather than loading them all.
 
-        # Generate all possible parent directories
-        # Keep going until dir_path is empty string or unchanged (at root)
-        prev_dir_path = None
-        while dir_path and dir_path != prev_dir_path:
-            parent_paths.append(dir_path)
-            prev_dir_path = dir_path
-            dir_path = os.path.dirname(dir_path)
+        Pages are fetched with keyset pagination: pass the sort key of the
+        last row of a page as `after` to get the next one. With an index on
+        the order column that costs the same at any depth, unlike OFFSET.
 
-        # Add root directory if needed
-        if '/' not in parent_paths:
-            parent_paths.append('/')
+            rows = list(db.query({'genre': 'Comedy'}, order='duration', limit=100))
+            last = rows[-1]
+            rows = db.query({'genre': 'Comedy'}, order='duration', limit=100,
+                            after=(last['duration_seconds'], last['id']))
 
-        cursor = self._con.cursor()
+        Args:
+            filters (dict): Filter name -> value. All of them must match.
+            order (str): One of QUERY_ORDERS.
+            after: Sort key of the last row already seen: an id for the
+                `id` order, (value, id) for the others.
+            limit (int): Most rows to return.
+            descending (bool): Newest, longest or highest id first.
 
-        # Handle the case when there are no parent paths
-        if not parent_paths:
-            return {'source_notebooks': []}
+        Returns:
+            iterator: A dict per video, with QUERY_COLUMNS as keys.
 
-        # SQL query to find ALL configs that apply (not just most specific)
-        placeholders = ','.join(['?'] * len(parent_paths))
-        query = f"""
-        SELECT config_path, config_data FROM notebooks
-        WHERE config_path IN ({placeholders})
-        ORDER BY LENGTH(config_path) DESC
+        Raises:
+            ValueError: For an unknown filter or order.
+        """
+        if order not in QUERY_ORDERS:
+            raise ValueError(f"Unknown order '{order}', expected one of {list(QUERY_ORDERS)}")
+
+        conditions = []
+        params = []
+        unknown_name = False
+        for name, value in (filters or {}).items():
+            if name in LOOKUP_FILTERS:
+                row_id = self._find_lookup(LOOKUP_FILTERS[name], value)
+                # Nothing can match a name that was never stored
+                unknown_name = unknown_name or row_id is None
+                conditions.append(f"v.{name}_id = ?")
+                params.append(row_id)
+            elif name in QUERY_FILTERS:
+                condition, convert = QUERY_FILTERS[name]
+                value = convert(value)
+                conditions.append(condition)
+                params.extend(value if isinstance(value, tuple) else (value,))
+            else:
+                raise ValueError(
+                    f"Unknown filter '{name}', expected one of "
+                    f"{list(LOOKUP_FILTERS) + list(QUERY_FILTERS)}"
+                )
+        if unknown_name:
+            return iter(())
+
+        column = QUERY_ORDERS[order]
+        direction = 'DESC' if descending else 'ASC'
+        compare = '<' if descending else '>'
+        if column is None:
+            if after is not None:
+                conditions.append(f"v.id {compare} ?")
+                params.append(after)
+            order_by = f"v.id {direction}"
+        else:
+            conditions.append(f"{column} IS NOT NULL")
+            if after is not None:
+                conditions.append(f"({column}, v.id) {compare} (?, ?)")
+                params.extend(after)
+            order_by = f"{column} {direction}, v.id {direction}"
+
+        sql = QUERY_SQL
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY {order_by}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        return self._stream(sql, params, QUERY_COLUMNS)
+
+    def _stream(self, sql, params, columns):
         """
+        Runs a query on a pooled reader, yielding a dict per row. The reader
+        is held until the rows run out or the generator is closed.
+        """
+        with self._reader() as con:
+            cursor = con.execute(sql, params)
+            try:
+                for row in cursor:
+                    yield dict(zip(columns, row))
+            finally:
+                # Ends the read transaction before the reader goes back
+                cursor.close()
+
+    def search(self, text, limit=20, prefix=True):
+        """
+        Finds videos by words in their title, platform, genre, subgenre,
+        path or notebook fields, best matches first. Every word has to
+        match somewhere.
 
-        cursor.execute(query, parent_paths)
-        results = cursor.fetchall()
+        Args:
+            text (str): Search words. FTS5 syntax isn't interpreted.
+            limit (int): Most rows to return.
+            prefix (bool): Also match words starting with each word, so
+                `sea` finds `season`.
 
-        # Track which notebooks contributed to this config
-        source_notebooks = []
+        Returns:
+            list: A dict per video, with SEARCH_COLUMNS as keys. rank is the
+                bm25 score (lower is better), or None without an index.
+        """
+        if not text.split():
+            return []
 
-        # Merge configurations, with deeper directories taking precedence
-        merged_config = {}
-        for path, config_data in results:
-            config = pickle.loads(config_data).raw()
-            if config:
-                # Update the merged config, overriding any existing keys
-                merged_config.update(config)
-                source_notebooks.append(path)
+        with self._reader() as con:
+            rows = self._search_rows(con.cursor(), text, limit, prefix)
+        return [dict(zip(SEARCH_COLUMNS, row)) for row in rows]
 
-        # Add the source notebooks to the config
-        merged_config['source_notebooks'] = source_notebooks
+    def _search_rows(self, cursor, text, limit, prefix):
+        """
+        Returns:
+            list: Rows for search, in SEARCH_COLUMNS order.
+        """
+        if self.has_search_index:
+            weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+            # Rank in the index first, and only join the page that's returned
+            cursor.execute(
+                f"""
+                SELECT v.id, v.file_path, t.name, p.name, g.name, sg.name, m.score
+                FROM (
+                    SELECT rowid, bm25(videos_fts, {weights}) AS score
+                    FROM videos_fts
+                    WHERE videos_fts MATCH ?
+                    ORDER BY score
+                    LIMIT ?
+                ) AS m
+                JOIN videos v ON v.id = m.rowid
+                LEFT JOIN genres g ON v.genre_id = g.id
+                LEFT JOIN subgenres sg ON v.subgenre_id = sg.id
+                LEFT JOIN platforms p ON v.platform_id = p.id
+                LEFT JOIN titles t ON v.title_id = t.id
+                ORDER BY m.score
+                """,
+                (search_query(text, prefix), limit)
+            )
+        else:
+            # Every word somewhere in the path or the names, unranked
+            haystack = (
+                "(v.file_path || ' ' || COALESCE(t.name, '') || ' ' || COALESCE(p.name, '')"
+                " || ' ' || COALESCE(g.name, '') || ' ' || COALESCE(sg.name, ''))"
+            )
+            condition = f"{haystack} LIKE ? ESCAPE '\\'"
+            words = text.split()
+            cursor.execute(
+                f"""
+                SELECT v.id, v.file_path, t.name, p.name, g.name, sg.name, NULL
+                FROM videos v
+                LEFT JOIN genres g ON v.genre_id = g.id
+                LEFT JOIN subgenres sg ON v.subgenre_id = sg.id
+                LEFT JOIN platforms p ON v.platform_id = p.id
+                LEFT JOIN titles t ON v.title_id = t.id
+                WHERE {' AND '.join([condition] * len(words))}
+                ORDER BY v.id
+                LIMIT ?
+                """,
+                (*(like_pattern(word) for word in words), limit)
+            )
+        return cursor.fetchall()
 
-        return merged_config
+    def _find_lookup(self, table, name):
+        """
+        Returns:
+            int: ID of `name` in one of LOOKUP_TABLES, or None if there is no
+                such row. Unlike _get_or_create, nothing is inserted.
+        """
+        row_id = self._lookups[table].get(name)
+        if row_id is None:
+            with self._reader() as con:
+                result = con.execute(
+                    f"SELECT id FROM {table} WHERE name = ?", (name,)
+                ).fetchone()
+            if result:
+                row_id = self._lookups[table][name] = result[0]
+        return row_id
+
+    def get_video_path(self, video_id):
+        """
+        Returns:
+            str: Path of the video with the given ID, or None.
+        """
+        with self._reader() as con:
+            result = con.execute(
+                "SELECT file_path FROM videos WHERE id = ?", (video_id,)
+            ).fetchone()
+        return result[0] if result else None
+
+    def prune_schedule(self, before, channels):
+        """
+        Drops schedule entries that finished before the given time, as well
+        as schedules for channels no longer configured.
+
+        Args:
+            before (int): Seconds since the epoch.
+            channels (list): Names of the configured channels.
+        """
+        channels = list(channels)
+        cursor = self._con.cursor()
+        cursor.execute("DELETE FROM schedule WHERE end_time < ?", (before,))
+        cursor.execute(
+            f"DELETE FROM schedule WHERE channel NOT IN ({','.join('?' * len(channels))})",
+            channels
+        )
+        self._commit()
 
     def get_or_create_genre(self, genre_name):
         """
@@ -557,19 +2093,7 @@ class FosseData:
         Returns:
             int: The ID of the genre
         """
-        if not genre_name:
-            return None
-
-        cursor = self._con.cursor()
-        cursor.execute("SELECT id FROM genres WHERE name = ?", (genre_name,))
-        result = cursor.fetchone()
-
-        if result:
-            return result[0]
-
-        cursor.execute("INSERT INTO genres (name) VALUES (?)", (genre_name,))
-        self._con.commit()
-        return cursor.lastrowid
+        return self._get_or_create('genres', genre_name)
 
     def get_or_create_platform(self, platform_name):
         """
@@ -581,19 +2105,7 @@ class FosseData:
         Returns:
             int: The ID of the platform
         """
-        if not platform_name:
-            return None
-
-        cursor = self._con.cursor()
-        cursor.execute("SELECT id FROM platforms WHERE name = ?", (platform_name,))
-        result = cursor.fetchone()
-
-        if result:
-            return result[0]
-
-        cursor.execute("INSERT INTO platforms (name) VALUES (?)", (platform_name,))
-        self._con.commit()
-        return cursor.lastrowid
+        return self._get_or_create('platforms', platform_name)
 
     def get_or_create_title(self, title_name, platform_id):
         """
@@ -606,20 +2118,7 @@ class FosseData:
         Returns:
             int: The ID of the title
         """
-        if not title_name:
-            return None
-
-        cursor = self._con.cursor()
-        cursor.execute("SELECT id FROM titles WHERE name = ?", (title_name,))
-        result = cursor.fetchone()
-
-        if result:
-            return result[0]
-
-        cursor.execute("INSERT INTO titles (name, platform_id) VALUES (?, ?)",
-                    (title_name, platform_id))
-        self._con.commit()
-        return cursor.lastrowid
+        return self._get_or_create('titles', title_name, 'platform_id', platform_id)
 
     def get_or_create_subgenre(self, subgenre_name, genre_id):
         """
@@ -632,17 +2131,59 @@ class FosseData:
         Returns:
             int: The ID of the subgenre
         """
-        if not subgenre_name:
+        return self._get_or_create('subgenres', subgenre_name, 'genre_id', genre_id)
+
+    def load_lookups(self):
+        """
+        Loads the genre, subgenre, platform and title tables into memory as
+        name -> id dictionaries. These tables are tiny and only ever grow,
+        so a cached id never goes stale; names added by another process are
+        picked up on the first miss.
+        """
+        cursor = self._con.cursor()
+        self._lookups = {}
+        for table in LOOKUP_TABLES:
+            cursor.execute(f"SELECT name, id FROM {table}")
+            self._lookups[table] = dict(cursor.fetchall())
+
+    def _get_or_create(self, table, name, parent_column=None, parent_id=None):
+        """
+        Looks a name up in one of the lookup tables, inserting it if needed.
+
+        Args:
+            table (str): One of LOOKUP_TABLES.
+            name (str): The name to look up.
+            parent_column (str): Extra column to fill in on insert, if any.
+            parent_id (int): Value for parent_column.
+
+        Returns:
+            int: The ID of the row, or None when name is empty.
+        """
+        if not name:
             return None
 
+        cache = self._lookups[table]
+        row_id = cache.get(name)
+        if row_id is not None:
+            return row_id
+
+        # Not cached: another process may have added it since we loaded
         cursor = self._con.cursor()
-        cursor.execute("SELECT id FROM subgenres WHERE name = ?", (subgenre_name,))
+        cursor.execute(f"SELECT id FROM {table} WHERE name = ?", (name,))
         result = cursor.fetchone()
 
         if result:
-            return result[0]
-
-        cursor.execute("INSERT INTO subgenres (name, genre_id) VALUES (?, ?)",
-                    (subgenre_name, genre_id))
-        self._con.commit()
-        return cursor.lastrowid
\ No newline at end of file
+            row_id = result[0]
+        else:
+            if parent_column:
+                cursor.execute(
+                    f"INSERT INTO {table} (name, {parent_column}) VALUES (?, ?)",
+                    (name, parent_id)
+                )
+            else:
+                cursor.execute(f"INSERT INTO {table} (name) VALUES (?)", (name,))
+            self._commit()
+            row_id = cursor.lastrowid
+
+        cache[name] = row_id
+        return row_id
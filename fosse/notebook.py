@@ -1,3 +1,8 @@
+import datetime
+import functools
+import re
+
+from loguru import logger
 from yaml import load, dump
 
 try:
@@ -8,14 +13,229 @@ except ImportError:
 from fosse.utils import safeget
 
 
+DEFAULT_DATE_FORMAT = '%Y-%m-%d'
+DEFAULT_TIME_FORMAT = '%H:%M:%S'
+
+# Directives the fixed-width date parser handles, with their widths and the
+# datetime field they fill
+FIXED_DIRECTIVES = {
+    'Y': (4, 0),
+    'm': (2, 1),
+    'd': (2, 2),
+    'H': (2, 3),
+    'M': (2, 4),
+    'S': (2, 5),
+}
+
+
+class FixedFormat:
+    """
+    Parser for strptime formats made only of zero padded numeric fields
+    (%Y %m %d %H %M %S) and literal separators, e.g. '%Y-%m-%d %H-%M-%S'.
+    Slicing at known offsets is several times faster than strptime.
+    """
+
+    def __init__(self, fields, literals, length):
+        self.fields = fields
+        self.literals = literals
+        self.length = length
+
+    @classmethod
+    def compile(cls, fmt):
+        """
+        Returns:
+            FixedFormat: A parser for fmt, or None if fmt uses anything other
+                than the fixed-width directives.
+        """
+        fields = []
+        literals = []
+        pos = 0
+        i = 0
+        while i < len(fmt):
+            if fmt[i] == '%':
+                directive = FIXED_DIRECTIVES.get(fmt[i + 1:i + 2])
+                if directive is None:
+                    return None
+                width, index = directive
+                fields.append((pos, pos + width, index))
+                pos += width
+                i += 2
+            else:
+                literals.append((pos, fmt[i]))
+                pos += 1
+                i += 1
+        return cls(fields, literals, pos)
+
+    def parse(self, text):
+        """
+        Returns:
+            datetime.datetime: The parsed value, or None if text doesn't
+                have exactly this layout.
+        """
+        if len(text) != self.length:
+            return None
+        for pos, char in self.literals:
+            if text[pos] != char:
+                return None
+
+        parts = [1900, 1, 1, 0, 0, 0]
+        for start, end, index in self.fields:
+            digits = text[start:end]
+            if not (digits.isascii() and digits.isdigit()):
+                return None
+            parts[index] = int(digits)
+        try:
+            return datetime.datetime(*parts)
+        except ValueError:
+            return None
+
+
 class Decoding:
     def __init__(
-        self, regexp=None, date_group=None, time_group=None, name_group=None
+        self, regexp=None, date_group=None, time_group=None, name_group=None,
+        date_format=None, time_format=None
     ):
         self.regexp = regexp
         self.date_group = date_group
         self.time_group = time_group
         self.name_group = name_group
+        self.date_format = date_format or DEFAULT_DATE_FORMAT
+        self.time_format = time_format or DEFAULT_TIME_FORMAT
+
+        # Compiled once here rather than per file
+        self.pattern = None
+        if regexp:
+            try:
+                self.pattern = re.compile(regexp)
+            except re.error as e:
+                logger.warning(f"Invalid decoding regexp {regexp!r}: {str(e)}")
+        self._date_only = FixedFormat.compile(self.date_format)
+        self._date_time = FixedFormat.compile(f"{self.date_format} {self.time_format}")
+
+    def can_parse(self):
+        """
+        Returns:
+            bool: True if there's a regexp and a group to take the date from.
+        """
+        return self.pattern is not None and bool(self.date_group)
+
+    def _group(self, match, group):
+        if not group:
+            return None
+        try:
+            return match.group(group)
+        except IndexError:
+            # No such group number or name
+            return None
+
+    def parse(self, filename):
+        """
+        Extracts a recording date from a filename.
+
+        Args:
+            filename (str): The file's name, without its directory.
+
+        Returns:
+            str: The date in ISO 8601 format, or None if the filename doesn't
+                match or has no date group.
+
+        Raises:
+            ValueError: If the filename matches but its date can't be parsed.
+        """
+        if not self.can_parse():
+            return None
+
+        match = self.pattern.match(filename)
+        if not match:
+            return None
+
+        date_str = self._group(match, self.date_group)
+        if date_str is None:
+            return None
+        time_str = self._group(match, self.time_group)
+
+        if time_str is None:
+            parsed = self._parse(date_str, self._date_only, self.date_format)
+        else:
+            parsed = self._parse(
+                f"{date_str} {time_str}", self._date_time,
+                f"{self.date_format} {self.time_format}"
+            )
+        return parsed.isoformat()
+
+    @staticmethod
+    def _parse(text, fixed, fmt):
+        if fixed is not None:
+            parsed = fixed.parse(text)
+            if parsed is not None:
+                return parsed
+        # Anything the fixed-width parser can't handle, such as month names
+        # or unpadded numbers, goes through strptime
+        return datetime.datetime.strptime(text, fmt)
+
+    def parse_many(self, filenames):
+        """
+        Extracts recording dates for a batch of filenames, such as all the
+        videos in one directory. Filenames often share dates, so each
+        distinct date string is only parsed once.
+
+        Args:
+            filenames (iterable): File names, without their directory.
+
+        Returns:
+            dict: filename -> ISO 8601 date, or None where there's no date.
+        """
+        dates = {}
+        if not self.can_parse():
+            return dict.fromkeys(filenames)
+
+        parsed = {}
+        match = self.pattern.match
+        for filename in filenames:
+            found = match(filename)
+            if not found:
+                dates[filename] = None
+                continue
+
+            key = (self._group(found, self.date_group), self._group(found, self.time_group))
+            if key not in parsed:
+                try:
+                    parsed[key] = self.parse(filename)
+                except ValueError:
+                    logger.warning(f"Could not parse date from filename: {filename}")
+                    parsed[key] = None
+            dates[filename] = parsed[key]
+        return dates
+
+
+@functools.lru_cache(maxsize=1024)
+def _cached_decoding(regexp, date_group, time_group, name_group, date_format, time_format):
+    return Decoding(regexp, date_group, time_group, name_group, date_format, time_format)
+
+
+def decoding_for(config):
+    """
+    Returns the Decoding described by a (combined) config, shared between
+    every directory with the same settings so each regexp is compiled once.
+
+    Args:
+        config (dict): Config with a `decoding` section and optional
+            `date_format` and `time_format`.
+
+    Returns:
+        Decoding: The decoding, or None if config has no `decoding` section.
+    """
+    decoding = config.get('decoding') if config else None
+    if not decoding:
+        return None
+    return _cached_decoding(
+        decoding.get('regexp'),
+        decoding.get('date-group'),
+        decoding.get('time-group'),
+        decoding.get('name-group'),
+        config.get('date_format'),
+        config.get('time_format'),
+    )
 
 
 class Notebook:
@@ -97,6 +317,8 @@ class Notebook:
             date_group=safeget(self._fosse, 'decoding', 'date-group'),
             time_group=safeget(self._fosse, 'decoding', 'time-group'),
             name_group=safeget(self._fosse, 'decoding', 'name-group'),
+            date_format=safeget(self._fosse, 'date_format'),
+            time_format=safeget(self._fosse, 'time_format'),
         )
 
     def raw(self):
@@ -0,0 +1,285 @@
+import datetime
+import heapq
+import random
+import time
+
+
+def parse_last_used(value):
+    """
+    Converts a stored last_used value to a POSIX timestamp.
+
+    Args:
+        value (str): UTC timestamp in SQLite's 'YYYY-MM-DD HH:MM:SS' form.
+
+    Returns:
+        float: Seconds since the epoch, or None if value is empty.
+    """
+    if not value:
+        return None
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def format_last_used(timestamp):
+    """
+    Converts a POSIX timestamp to the form last_used is stored in.
+
+    Args:
+        timestamp (float): Seconds since the epoch.
+
+    Returns:
+        str: UTC timestamp as 'YYYY-MM-DD HH:MM:SS'.
+    """
+    moment = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class FenwickTree:
+    """
+    Binary indexed tree over a list of weights, giving O(log n) updates and
+    O(log n) weighted sampling.
+    """
+
+    def __init__(self, weights):
+        n = len(weights)
+        self._tree = [0.0] * (n + 1)
+        for i, weight in enumerate(weights, 1):
+            self._tree[i] += weight
+            parent = i + (i & -i)
+            if parent <= n:
+                self._tree[parent] += self._tree[i]
+        self._size = n
+        self.total = sum(weights)
+        # Highest power of two not above n, where find() starts
+        self._top = 1 << (n.bit_length() - 1) if n else 0
+
+    def add(self, i, delta):
+        """
+        Adds delta to the weight at position i.
+        """
+        self.total += delta
+        i += 1
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def find(self, value):
+        """
+        Returns:
+            int: The position whose cumulative weight range contains value,
+                for 0 <= value < total.
+        """
+        pos = 0
+        step = self._top
+        while step:
+            nxt = pos + step
+            if nxt <= self._size and self._tree[nxt] <= value:
+                pos = nxt
+                value -= self._tree[nxt]
+            step >>= 1
+        return min(pos, self._size - 1)
+
+
+class Catalog:
+    """
+    In-memory copy of the playable videos and the fields playlists filter
+    and weight on. Shared by every channel's Playlist.
+    """
+
+    FIELDS = (
+        'id', 'file_path', 'duration_seconds', 'genre', 'subgenre',
+        'platform', 'title', 'under_influence', 'last_used',
+    )
+
+    def __init__(self, rows):
+        """
+        Args:
+            rows (iterable): Tuples in FIELDS order.
+        """
+        columns = list(zip(*rows)) or [()] * len(self.FIELDS)
+        for name, column in zip(self.FIELDS, columns):
+            setattr(self, name, list(column))
+        self.last_used = [parse_last_used(value) for value in self.last_used]
+
+    def __len__(self):
+        return len(self.id)
+
+    @classmethod
+    def load(cls, db):
+        """
+        Args:
+            db (FosseData): Database to load from.
+
+        Returns:
+            Catalog: Every video in the database.
+        """
+        return cls(db.get_playable_videos())
+
+    def matching(self, filters):
+        """
+        Args:
+            filters (dict): Field name -> accepted value, or list of values.
+
+        Returns:
+            list: Positions of the videos matching every filter.
+        """
+        if not filters:
+            return list(range(len(self)))
+
+        checks = []
+        for field, accepted in filters.items():
+            if field not in self.FIELDS:
+                raise ValueError(f"Can't filter on unknown field '{field}'")
+            if not isinstance(accepted, (list, tuple, set)):
+                accepted = [accepted]
+            checks.append((getattr(self, field), set(accepted)))
+
+        return [
+            i for i in range(len(self))
+            if all(column[i] in accepted for column, accepted in checks)
+        ]
+
+
+class Playlist:
+    """
+    Endless weighted shuffle over (part of) a Catalog.
+
+    Each pick is a weighted random choice made in O(log n) with a Fenwick
+    tree. A video that has played gets weight zero until `no_repeat`
+    seconds of playlist time have passed, tracked with a heap of expiry
+    times. Picks advance a virtual clock by the video's duration, so the
+    window works the same whether the playlist is played live or scheduled
+    ahead.
+    """
+
+    def __init__(self, catalog, positions=None, weights=None, no_repeat=0, start=None, rng=None):
+        """
+        Args:
+            catalog (Catalog): Videos to pick from.
+            positions (list): Catalog positions to restrict the playlist to.
+                Defaults to the whole catalog.
+            weights (dict): Field name ('genre', 'platform', ...) -> {value:
+                weight}. A video's weight is the product of its matching
+                weights; values that aren't listed weigh 1, and a weight of
+                0 excludes them.
+            no_repeat (float): Seconds before a video may play again.
+            start (float): POSIX timestamp the playlist starts at. Defaults
+                to now.
+            rng (random.Random): Source of randomness.
+        """
+        self.catalog = catalog
+        self.positions = list(range(len(catalog))) if positions is None else list(positions)
+        self.no_repeat = no_repeat
+        self.clock = time.time() if start is None else start
+        self._rng = rng or random.Random()
+
+        self._weights = [self._weight(pos, weights or {}) for pos in self.positions]
+        self._cooling = []  # (expires, index) heap
+        self._live = live = list(self._weights)
+        if no_repeat:
+            for i, pos in enumerate(self.positions):
+                last_used = catalog.last_used[pos]
+                if live[i] and last_used is not None and last_used + no_repeat > self.clock:
+                    live[i] = 0.0
+                    self._cooling.append((last_used + no_repeat, i))
+            heapq.heapify(self._cooling)
+        self._tree = FenwickTree(live)
+
+    def _weight(self, pos, weights):
+        weight = 1.0
+        for field, table in weights.items():
+            weight *= table.get(getattr(self.catalog, field)[pos], 1.0)
+        return float(weight)
+
+    @classmethod
+    def from_config(cls, catalog, settings, positions=None, start=None):
+        """
+        Builds a playlist from a `stream` (or channel) config section with
+        optional `weights` and `no_repeat_hours` keys.
+        """
+        return cls(
+            catalog,
+            positions=positions,
+            weights=settings.get('weights'),
+            no_repeat=settings.get('no_repeat_hours', 0) * 3600,
+            start=start,
+        )
+
+    def __iter__(self):
+        while True:
+            entry = self.next()
+            if entry is None:
+                return
+            yield entry
+
+    def next(self):
+        """
+        Picks the next video and advances the clock past it.
+
+        Returns:
+            tuple: (catalog position, start time), or None if nothing can
+                ever be played.
+        """
+        # Let videos whose window has passed back in
+        while self._cooling and self._cooling[0][0] <= self.clock:
+            _, i = heapq.heappop(self._cooling)
+            self._set_live(i, self._weights[i])
+
+        i = None
+        # Float drift in the tree's sums can land on a video that's cooling
+        # down, so retry a few times before giving up on weighting
+        for _ in range(3):
+            if self._tree.total <= 1e-9:
+                break
+            candidate = self._tree.find(self._rng.random() * self._tree.total)
+            if self._live[candidate]:
+                i = candidate
+                break
+
+        if i is None:
+            if not self._cooling:
+                return None
+            # Everything has played recently: take whatever comes back first
+            _, i = heapq.heappop(self._cooling)
+            self._set_live(i, self._weights[i])
+
+        pos = self.positions[i]
+        start = self.clock
+        self.clock += self.length(pos)
+        self.catalog.last_used[pos] = start
+
+        if self.no_repeat:
+            self._set_live(i, 0.0)
+            heapq.heappush(self._cooling, (start + self.no_repeat, i))
+
+        return pos, start
+
+    def length(self, pos):
+        """
+        Returns:
+            int: Seconds a video takes up in the playlist. Videos without a
+                known duration count as one second so the clock moves on.
+        """
+        return max(self.catalog.duration_seconds[pos] or 0, 1)
+
+    def _set_live(self, i, weight):
+        self._tree.add(i, weight - self._live[i])
+        self._live[i] = weight
+
+    def take(self, seconds):
+        """
+        Picks videos until they add up to at least `seconds` of playtime.
+
+        Returns:
+            list: (catalog position, start time) tuples.
+        """
+        end = self.clock + seconds
+        picks = []
+        while self.clock < end:
+            entry = self.next()
+            if entry is None:
+                break
+            picks.append(entry)
+        return picks
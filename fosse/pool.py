@@ -0,0 +1,287 @@
+import multiprocessing
+import signal
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import wait
+
+from loguru import logger
+
+from fosse.probe import default_metadata, PROBE_FAILED, PROBE_TIMEOUT, PROBE_CRASHED
+
+class MetadataPool:
+    """
+    Runs metadata extraction on a pool of threads while the caller keeps
+    sole ownership of the database. Process workers are run by ProbePool.
+
+    Work is submitted with an opaque context. Results are handed back to
+    `on_result(context, metadata)` on the submitting thread, so the
+    callback is free to write to the database. At most `queue_size`
+    extractions are in flight; once the queue is full, `submit()` blocks
+    on the oldest one before accepting more.
+    """
+
+    def __init__(self, extract, on_result, workers, queue_size=None):
+        """
+        Args:
+            extract (callable): Takes a file path and the extra arguments
+                given to submit, returns a metadata dict.
+            on_result (callable): Called with (context, metadata) for each
+                finished extraction.
+            workers (int): Number of pool threads.
+            queue_size (int): Maximum number of in-flight extractions.
+                Defaults to four per worker.
+        """
+        self._extract = extract
+        self._on_result = on_result
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._queue_size = queue_size or workers * 4
+        self._pending = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.drain()
+        self.shutdown()
+
+    def submit(self, file_path, context, *args):
+        """
+        Queues a file for extraction.
+
+        Args:
+            file_path (str): Path to the video file.
+            context: Passed back untouched to `on_result`.
+            *args: Passed on to `extract` after the path.
+        """
+        # Hand back anything that is already finished before blocking
+        while self._pending and self._pending[0][0].done():
+            self._complete(*self._pending.popleft())
+
+        while len(self._pending) >= self._queue_size:
+            self._complete(*self._pending.popleft())
+
+        future = self._executor.submit(self._extract, file_path, *args)
+        self._pending.append((future, file_path, context))
+
+    def drain(self):
+        """
+        Waits for every in-flight extraction and delivers its result.
+        """
+        while self._pending:
+            self._complete(*self._pending.popleft())
+
+    def shutdown(self):
+        """
+        Stops the workers. Pending results are discarded.
+        """
+        for future, _, _ in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+
+    def _complete(self, future, file_path, context):
+        try:
+            metadata = future.result()
+        except Exception as e:
+            logger.error(f"Metadata worker failed on {file_path}: {str(e)}")
+            metadata = default_metadata(PROBE_FAILED, str(e))
+        self._on_result(context, metadata)
+
+
+def _probe_worker(conn, extract):
+    """
+    Main loop of a ProbePool worker process: extracts metadata for each
+    (path, args) job received on `conn` and sends the result back, until it
+    receives None.
+    """
+    # Ctrl-C reaches the whole process group; the parent decides what to do
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        file_path, args = job
+        try:
+            metadata = extract(file_path, *args)
+        except Exception as e:
+            metadata = default_metadata(PROBE_FAILED, str(e))
+        conn.send(metadata)
+
+
+class ProbeWorker:
+    """
+    A long-lived extraction process and the file it's working on, if any.
+    """
+
+    def __init__(self, extract):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_probe_worker, args=(child, extract), name='fosse-probe', daemon=True,
+        )
+        self.process.start()
+        # Only the worker holds the other end, so a crash shows up as EOF
+        child.close()
+        self.job = None
+        self.deadline = None
+
+    def start(self, job, timeout):
+        file_path, _, args = job
+        self.conn.send((file_path, args))
+        self.job = job
+        self.deadline = time.monotonic() + timeout if timeout else None
+
+    def finish(self):
+        job, self.job, self.deadline = self.job, None, None
+        return job
+
+    def stop(self):
+        """
+        Asks an idle worker to exit, and kills a busy one.
+        """
+        if self.job is None:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+            self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ProbePool:
+    """
+    Runs metadata extraction in long-lived worker processes, so a file that
+    crashes MediaInfo or hangs on a dead mount can't take the scan with it.
+
+    Works like MetadataPool: results are handed to `on_result(context,
+    metadata)` on the submitting thread, and at most `queue_size` files are
+    in flight. A worker that takes longer than `timeout` seconds on a file
+    is killed, as is one that dies; either way it's replaced by a fresh
+    process and the file gets default metadata with a `timeout` or `crashed`
+    probe status.
+    """
+
+    def __init__(self, extract, on_result, workers, timeout=None, queue_size=None):
+        """
+        Args:
+            extract (callable): Takes a file path and the extra arguments
+                given to submit, returns a metadata dict. Must be picklable.
+            on_result (callable): Called with (context, metadata) for each
+                finished extraction.
+            workers (int): Number of worker processes.
+            timeout (float): Seconds a worker gets per file. None to wait
+                forever.
+            queue_size (int): Maximum number of in-flight extractions.
+                Defaults to four per worker.
+        """
+        self._extract = extract
+        self._on_result = on_result
+        self._timeout = timeout
+        self._queue_size = queue_size or workers * 4
+        self._workers = [ProbeWorker(extract) for _ in range(workers)]
+        self._backlog = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.drain()
+        self.shutdown()
+
+    def submit(self, file_path, context, *args):
+        """
+        Queues a file for extraction.
+
+        Args:
+            file_path (str): Path to the video file.
+            context: Passed back untouched to `on_result`.
+            *args: Passed on to `extract` after the path. Must be picklable.
+        """
+        # Hand back anything that is already finished before blocking
+        self._collect(block=False)
+        self._backlog.append((file_path, context, args))
+        self._dispatch()
+
+        while self._in_flight() >= self._queue_size:
+            self._collect(block=True)
+            self._dispatch()
+
+    def drain(self):
+        """
+        Waits for every in-flight extraction and delivers its result.
+        """
+        while self._in_flight():
+            self._dispatch()
+            self._collect(block=True)
+
+    def shutdown(self):
+        """
+        Stops the workers. Pending results are discarded.
+        """
+        self._backlog.clear()
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+
+    def _in_flight(self):
+        return len(self._backlog) + sum(1 for worker in self._workers if worker.job)
+
+    def _dispatch(self):
+        for worker in self._workers:
+            if not self._backlog:
+                break
+            if worker.job is None:
+                worker.start(self._backlog.popleft(), self._timeout)
+
+    def _collect(self, block):
+        """
+        Delivers finished extractions, and deals with workers that died or
+        ran out of time. With `block`, waits until at least one of those
+        happens.
+        """
+        busy = [worker for worker in self._workers if worker.job]
+        if not busy:
+            return
+
+        timeout = 0
+        if block:
+            deadlines = [worker.deadline for worker in busy if worker.deadline is not None]
+            timeout = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+
+        ready = wait([worker.conn for worker in busy], timeout)
+        now = time.monotonic()
+        for worker in busy:
+            if worker.conn in ready:
+                try:
+                    metadata = worker.conn.recv()
+                except (EOFError, OSError):
+                    file_path, context, _ = worker.job
+                    worker.process.join(1)
+                    code = worker.process.exitcode
+                    logger.error(f"Metadata worker died on {file_path} (exit code {code}), restarting it")
+                    self._replace(worker)
+                    metadata = default_metadata(PROBE_CRASHED, f"Worker exited with code {code}")
+                else:
+                    file_path, context, _ = worker.finish()
+                self._on_result(context, metadata)
+
+            elif worker.deadline is not None and worker.deadline <= now:
+                file_path, context, _ = worker.job
+                logger.warning(f"Metadata extraction for {file_path} timed out after {self._timeout}s, restarting worker")
+                self._replace(worker)
+                self._on_result(
+                    context, default_metadata(PROBE_TIMEOUT, f"No result after {self._timeout}s")
+                )
+
+    def _replace(self, worker):
+        # Still marked busy, so stop() kills it rather than asking nicely
+        worker.stop()
+        self._workers[self._workers.index(worker)] = ProbeWorker(self._extract)
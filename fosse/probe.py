@@ -0,0 +1,236 @@
+from loguru import logger
+
+from fosse.fingerprint import content_fingerprint
+
+# Outcomes of probing a file, stored as videos.probe_status. Anything but
+# PROBE_OK leaves the file with default metadata and a retry backoff.
+PROBE_OK = 'ok'
+PROBE_FAILED = 'failed'
+PROBE_NO_VIDEO = 'no_video'
+PROBE_TIMEOUT = 'timeout'
+PROBE_CRASHED = 'crashed'
+# pymediainfo isn't installed: nothing wrong with the file, so it's retried
+# on the next scan rather than backed off
+PROBE_UNAVAILABLE = 'unavailable'
+
+# Work a pool worker can be given for a file, see run_job
+JOB_FINGERPRINT = 'fingerprint'
+JOB_PROBE = 'probe'
+
+
+def to_int(value):
+    return int(float(value))
+
+
+def to_seconds(value):
+    # MediaInfo reports durations in milliseconds
+    return int(float(value)) // 1000
+
+
+def to_float(value):
+    return float(value)
+
+
+# Metadata read from the video track: (metadata key, MediaInfo attribute,
+# converter, default). Only these attributes are looked at.
+VIDEO_FIELDS = (
+    ('duration_seconds', 'duration', to_seconds, 0),
+    ('width', 'width', to_int, 0),
+    ('height', 'height', to_int, 0),
+    ('video_format', 'format', None, 'unknown'),
+    ('codec', 'codec_id', None, 'unknown'),
+    ('frame_rate', 'frame_rate', to_float, 0.0),
+    ('bit_rate', 'bit_rate', to_int, 0),
+    ('aspect_ratio', 'display_aspect_ratio', to_float, None),
+)
+
+# Container level metadata, from the General track
+GENERAL_FIELDS = (
+    ('container', 'format', None, None),
+    ('overall_bit_rate', 'overall_bit_rate', to_int, None),
+)
+
+# Metadata from the first audio track
+AUDIO_FIELDS = (
+    ('audio_codec', 'format', None, None),
+    ('audio_channels', 'channel_s', to_int, None),
+    ('audio_sample_rate', 'sampling_rate', to_int, None),
+)
+
+# Per-track details kept for every video, audio and text track, as rows of
+# the tracks table
+TRACK_FIELDS = (
+    ('codec', 'format', None, None),
+    ('codec_id', 'codec_id', None, None),
+    ('bit_rate', 'bit_rate', to_int, None),
+    ('duration_seconds', 'duration', to_seconds, None),
+    ('width', 'width', to_int, None),
+    ('height', 'height', to_int, None),
+    ('frame_rate', 'frame_rate', to_float, None),
+    ('gop', 'format_settings__gop', None, None),
+    ('channels', 'channel_s', to_int, None),
+    ('sample_rate', 'sampling_rate', to_int, None),
+    ('language', 'language', None, None),
+)
+TRACK_TYPES = ('Video', 'Audio', 'Text')
+
+# Codecs that can be copied into an MPEG-TS/HLS stream as they are
+REMUXABLE_VIDEO = {'AVC', 'HEVC', 'MPEG Video'}
+REMUXABLE_AUDIO = {'AAC', 'MPEG Audio', 'AC-3', 'E-AC-3'}
+
+
+def read_fields(data, fields):
+    """
+    Picks declared fields out of a track's attributes.
+
+    Args:
+        data (dict): The track's attributes, from Track.to_data().
+        fields (tuple): (key, attribute, converter, default) tuples.
+
+    Returns:
+        dict: Converted values by key, with defaults for anything missing
+            or unparseable.
+    """
+    values = {}
+    for key, attribute, convert, default in fields:
+        value = data.get(attribute)
+        if value is None:
+            value = default
+        elif convert is not None:
+            try:
+                value = convert(value)
+            except (ValueError, TypeError):
+                logger.debug("Could not convert {} value {!r}", attribute, value)
+                value = default
+        values[key] = value
+    return values
+
+
+def extract_video_metadata(file_path, dump_tracks=False):
+    """
+    Extracts metadata from a video file using pymediainfo.
+
+    This lives at module level (rather than on the Scanner) so it can be
+    handed to a worker pool, including process pools, which need a
+    picklable callable.
+
+    Args:
+        file_path (str): Path to the video file.
+        dump_tracks (bool): Log every attribute of every track at TRACE
+            level, for working out what MediaInfo reports for a file.
+
+    Returns:
+        dict: Metadata extracted from the video file.
+    """
+    try:
+        from pymediainfo import MediaInfo
+
+        logger.debug("Extracting metadata for: {}", file_path)
+
+        media_info = MediaInfo.parse(file_path)
+
+        if dump_tracks:
+            for track in media_info.tracks:
+                # Only built if a TRACE handler is listening
+                logger.opt(lazy=True).trace(
+                    "{} track of {}: {}",
+                    lambda: track.track_type,
+                    lambda: file_path,
+                    lambda: track.to_data(),
+                )
+
+        # Everything comes from the one parse: the first track of each kind
+        # fills the summary columns, and every track gets a tracks row
+        first = {}
+        tracks = []
+        for track in media_info.tracks:
+            kind = track.track_type
+            data = track.to_data()
+            first.setdefault(kind, data)
+            if kind in TRACK_TYPES:
+                tracks.append({'type': kind, **read_fields(data, TRACK_FIELDS)})
+
+        if 'Video' not in first:
+            logger.warning(f"No video track found in {file_path}")
+            return default_metadata(PROBE_NO_VIDEO, "No video track")
+
+        metadata = read_fields(first['Video'], VIDEO_FIELDS)
+        metadata.update(read_fields(first.get('General', {}), GENERAL_FIELDS))
+        metadata.update(read_fields(first.get('Audio', {}), AUDIO_FIELDS))
+        metadata['can_remux'] = can_remux(tracks)
+        metadata['tracks'] = tracks
+        metadata['probe_status'] = PROBE_OK
+        metadata['probe_error'] = None
+        return metadata
+
+    except ImportError:
+        logger.warning("pymediainfo not installed. Using default metadata values.")
+        return default_metadata(PROBE_UNAVAILABLE, "pymediainfo not installed")
+    except Exception as e:
+        logger.error(f"Error extracting metadata from {file_path}: {str(e)}")
+        logger.opt(exception=True).debug("Exception details:")  # Full traceback for debugging
+        return default_metadata(PROBE_FAILED, str(e))
+
+
+def run_job(file_path, job, size=None, dump_tracks=False):
+    """
+    Does one piece of work on a file for an extraction pool worker. Both
+    kinds of job read the file, so they run in the workers, under the
+    pool's timeout, rather than on the scan's main thread.
+
+    Args:
+        file_path (str): Path to the video file.
+        job (str): JOB_FINGERPRINT for the file's content fingerprint, or
+            JOB_PROBE for its metadata.
+        size (int): The file's size, for fingerprints.
+        dump_tracks (bool): See extract_video_metadata.
+
+    Returns:
+        dict: {'fingerprint': str or None, 'error': str or None} for a
+            fingerprint, the metadata for a probe.
+    """
+    if job == JOB_FINGERPRINT:
+        try:
+            return {'fingerprint': content_fingerprint(file_path, size), 'error': None}
+        except OSError as e:
+            return {'fingerprint': None, 'error': str(e)}
+    return extract_video_metadata(file_path, dump_tracks)
+
+
+def can_remux(tracks):
+    """
+    Decides whether a file can be streamed by copying its streams into
+    MPEG-TS, rather than transcoding.
+
+    Args:
+        tracks (list): Track dicts as built by extract_video_metadata.
+
+    Returns:
+        bool: True if every video and audio track has a codec that can be
+            copied as-is.
+    """
+    video = [t['codec'] for t in tracks if t['type'] == 'Video']
+    audio = [t['codec'] for t in tracks if t['type'] == 'Audio']
+    return bool(video) and all(c in REMUXABLE_VIDEO for c in video) \
+        and all(c in REMUXABLE_AUDIO for c in audio)
+
+
+def default_metadata(status=PROBE_FAILED, error=None):
+    """
+    Returns default metadata when extraction fails.
+
+    Args:
+        status (str): Why extraction failed, one of the PROBE_* values.
+        error (str): Details of the failure.
+
+    Returns:
+        dict: Default metadata values.
+    """
+    metadata = {}
+    for fields in (VIDEO_FIELDS, GENERAL_FIELDS, AUDIO_FIELDS):
+        metadata.update((key, default) for key, _, _, default in fields)
+    metadata['can_remux'] = False
+    metadata['tracks'] = []
+    metadata['probe_status'] = status
+    metadata['probe_error'] = error
+    return metadata
@@ -1,19 +1,58 @@
 import os
-import datetime
+import fnmatch
+from collections import deque
+import functools
 import mimetypes
-import pickle
-import json
+import time
 from pathlib import Path
 from loguru import logger
 
-from fosse.notebook import Notebook
+from fosse.notebook import Notebook, decoding_for
 from fosse.db import FosseData
+from fosse.fingerprint import content_fingerprint
+from fosse.pool import MetadataPool, ProbePool
+from fosse.probe import (
+    extract_video_metadata, default_metadata, run_job, JOB_FINGERPRINT, JOB_PROBE, PROBE_OK,
+    PROBE_UNAVAILABLE,
+)
+from fosse.stats import ScanStats, make_stats
+
+# Parts of a file's stat that count as a change by default
+CHANGE_KEYS = ('mtime', 'size', 'inode')
+
+# Values of scan_pool: threads run by MetadataPool, processes by ProbePool
+POOL_KINDS = ('thread', 'process')
 
 
 class Scanner:
-    def __init__(self, config):
+    def __init__(self, config, stats=False):
+        """
+        Args:
+            config (Config): Configuration instance.
+            stats (bool): Collect per-stage timings and counters even if the
+                config doesn't ask for them.
+        """
         self.config = config
         self.db = FosseData(config)
+        self.stats = self.db.stats = make_stats(config, stats)
+        self._pool = None
+        # Contexts of fingerprinted videos waiting to go back to the pool
+        # for extraction, see _submit
+        self._probe_backlog = deque()
+        # Whether the pool outlives each scan, see open_pool
+        self._keep_pool = False
+        self._change_keys = set(config.get('change_detection', CHANGE_KEYS))
+        self.fosse_file = config.get('fosse_file', 'fosse.yml')
+        # Log every MediaInfo attribute of every file, at TRACE level
+        self._dump_tracks = config.get('probe_dump_tracks', False)
+        # Lowercased once, for a single str.endswith call per file
+        self._video_suffixes = tuple(ext.lower() for ext in config['video_extensions'])
+        # Directories whose notebook changed during the current scan
+        self._updated_notebooks = set()
+        # Backoff between retries of a failed extraction: doubles with every
+        # failure, from probe_retry_hours up to probe_retry_max_hours
+        self._retry_seconds = config.get('probe_retry_hours', 1) * 3600
+        self._retry_max_seconds = config.get('probe_retry_max_hours', 168) * 3600
 
     def handle_fosse_yml(self, dirpath):
         """
@@ -22,86 +61,270 @@ class Scanner:
         Args:
             dirpath (str): The path of the directory being scanned.
         """
-        notebook = Notebook(self.config, f"{dirpath}/{self.config['fosse_file']}")
-        logger.debug(f"Found Notebook: {notebook.name()}")
+        with self.stats.stage('notebook'):
+            notebook = Notebook(self.config, f"{dirpath}/{self.fosse_file}")
+            logger.debug(f"Found Notebook: {notebook.name()}")
 
-        # Check if this is a new or updated notebook
-        cursor = self.db._con.cursor()
-        cursor.execute(
-            "SELECT config_data FROM notebooks WHERE config_path = ?",
-            (dirpath,)
-        )
-        existing_notebook = cursor.fetchone()
-
-        is_updated = False
-        if existing_notebook:
-            old_notebook = pickle.loads(existing_notebook[0])
-            # Compare old and new notebook data to see if it changed
-            if old_notebook.raw() != notebook.raw():
-                is_updated = True
-
-        # Insert or update the notebook
-        self.db.insert_notebook(dirpath, notebook)
+            # Insert or update the notebook
+            is_updated = self.db.insert_notebook(dirpath, notebook)
+        self.stats.count('notebooks_seen')
 
-        # If the notebook was updated, update all affected videos
+        # If the notebook is new or was updated, update all affected videos
         if is_updated:
             logger.info(f"Config updated at {dirpath}, updating affected videos...")
+            self._updated_notebooks.add(dirpath)
             self.db.update_videos_for_config(dirpath)
 
-    def handle_video_file(self, dirpath, filename):
+    def handle_video_file(self, dirpath, filename, dates=None, entry=None):
         """
         Handles a video file in the directory.
 
         Args:
             dirpath (str): The path of the directory containing the video file.
             filename (str): The name of the video file.
+            dates (dict): Recording dates already extracted for the
+                directory's files, by filename.
+            entry (os.DirEntry): The file's entry from the walk, whose cached
+                stat is used rather than stat-ing the path again.
         """
-        file_path = os.path.join(dirpath, filename)
-        full_path = os.path.abspath(file_path)
+        if entry is not None:
+            full_path = entry.path
+        else:
+            full_path = os.path.abspath(os.path.join(dirpath, filename))
 
         # Check if file exists in database and if it's been modified
-        cursor = self.db._con.cursor()
-        cursor.execute(
-            "SELECT id, last_modified FROM videos WHERE file_path = ?",
-            (full_path,)
-        )
-        result = cursor.fetchone()
+        state = self.db.get_video_state(full_path)
 
-        file_stat = os.stat(full_path)
-        file_mtime = datetime.datetime.fromtimestamp(file_stat.st_mtime)
+        with self.stats.stage('stat'):
+            file_stat = entry.stat() if entry is not None else os.stat(full_path)
+        self.stats.count('videos_seen')
 
         # Mark this file as existing for end-of-scan cleanup
-        cursor.execute(
+        self.db._con.execute(
             "INSERT OR IGNORE INTO temp_existing_files (path) VALUES (?)",
             (full_path,)
         )
 
         # If file doesn't exist in DB or has been modified, process it
-        if not result or (result and file_mtime > datetime.datetime.fromisoformat(result[1])):
-            logger.info(f"Processing video file: {full_path}")
+        if self._is_changed(full_path, state, file_stat):
+            attempts = 0
+        else:
+            # Unchanged files are only looked at again to retry a failed
+            # extraction, once its backoff is over
+            attempts = self._retry_due(full_path)
+            if attempts is None:
+                return
+            logger.info(f"Retrying metadata extraction for {full_path}")
+            self.stats.count('probe_retries')
+
+        logger.info(f"Processing video file: {full_path}")
+        self.stats.count('videos_changed')
+        self.stats.count('bytes_processed', file_stat.st_size)
+
+        # Get combined configuration for this file
+        with self.stats.stage('config'):
+            config_data = self.db.get_combined_config_for_file(full_path)
 
-            # Get video metadata
-            metadata = self.extract_video_metadata(full_path)
+        # Extract recording date from filename if possible
+        with self.stats.stage('date'):
+            if dates is not None:
+                recording_date = dates.get(filename)
+            else:
+                recording_date = self.extract_recording_date(filename, dirpath)
+
+        context = {
+            'file_path': full_path,
+            'file_stat': file_stat,
+            'fingerprint': None,
+            'last_used': None,
+            'file_size_bytes': file_stat.st_size,
+            'recording_date': recording_date,
+            'config_data': config_data,
+            'probe_attempts': attempts,
+        }
 
-            # Get combined configuration for this file
-            config_data = self.db.get_combined_config_for_file(full_path)
+        # Reading the file can hang on a bad mount, so with a pool even the
+        # fingerprint is taken by a worker, under its timeout
+        if self._pool:
+            context['job'] = JOB_FINGERPRINT
+            self._submit(context, file_stat.st_size)
+            return
+
+        try:
+            with self.stats.stage('fingerprint'):
+                fingerprint = content_fingerprint(full_path, file_stat.st_size)
+        except OSError as e:
+            logger.warning(f"Could not fingerprint {full_path}: {str(e)}")
+            fingerprint = None
+        self._fingerprinted(context, fingerprint)
+
+    def _fingerprinted(self, context, fingerprint):
+        """
+        Stores a video straight from the metadata cache if its content was
+        seen before, e.g. the file was moved or renamed, or has its metadata
+        extracted otherwise.
+        """
+        full_path = context['file_path']
+        context['fingerprint'] = fingerprint
+        with self.stats.stage('cache_lookup'):
+            cached = self.db.get_cached_metadata(fingerprint) if fingerprint else None
+        if cached:
+            logger.debug(f"Reusing cached metadata for {full_path}")
+            self.stats.count('cache_hits')
+            metadata, context['last_used'] = cached
+            self._store_video(context, metadata, cache=False)
+            return
+
+        self.stats.count('videos_probed')
+        if self._pool:
+            # Submitted once the pool is done handing back results, see
+            # _submit
+            context['job'] = JOB_PROBE
+            self._probe_backlog.append(context)
+        else:
+            with self.stats.stage('probe'):
+                metadata = self.extract_video_metadata(full_path)
+            self._store_video(context, metadata)
+
+    def _submit(self, context, *args):
+        """
+        Hands a job to the pool, then any probes that fingerprints coming
+        back have asked for. Those are only queued by _on_result, as the
+        pool can't take new work while it's delivering results.
+        """
+        # Metadata extraction is the slow part; only blocks once the pool's
+        # queue is full
+        with self.stats.stage('probe_wait'):
+            self._pool.submit(context['file_path'], context, context['job'], *args)
+            while self._probe_backlog:
+                context = self._probe_backlog.popleft()
+                self._pool.submit(context['file_path'], context, context['job'])
+
+    def _drain_pool(self):
+        """
+        Waits for the pool to finish everything, including the probes asked
+        for by the last fingerprints.
+        """
+        with self.stats.stage('probe_wait'):
+            self._pool.drain()
+        while self._probe_backlog:
+            self._submit(self._probe_backlog.popleft())
+            with self.stats.stage('probe_wait'):
+                self._pool.drain()
+
+    def _on_result(self, context, result):
+        """
+        Takes a finished pool job, on the thread that owns the database.
+        """
+        if context['job'] == JOB_FINGERPRINT and 'fingerprint' in result:
+            if result['error']:
+                logger.warning(f"Could not fingerprint {context['file_path']}: {result['error']}")
+            self._fingerprinted(context, result['fingerprint'])
+        else:
+            # Probe results, and fingerprints that timed out or crashed
+            self._store_video(context, result)
+
+    def _is_changed(self, full_path, state, file_stat):
+        """
+        Decides whether a video needs its metadata (re-)extracted, by
+        comparing the stat recorded when it was last processed with the
+        current one. Which of mtime, size and inode take part is set by the
+        `change_detection` config option; all three by default.
+
+        Args:
+            full_path (str): Absolute path of the video.
+            state (tuple): (id, mtime_ns, size, inode) from the database, or None.
+            file_stat (os.stat_result): The file's current stat.
+
+        Returns:
+            bool: True if the video is new or has changed.
+        """
+        if state is None:
+            return True
+
+        _, mtime_ns, size, inode = state
+
+        if inode is None:
+            # Stored before we tracked stat. The row's write time is all we
+            # have; if the file is older than that, adopt its stat as-is.
+            if file_stat.st_mtime_ns > mtime_ns:
+                return True
+            self.db.update_video_stat(full_path, file_stat)
+            return False
+
+        return (
+            ('mtime' in self._change_keys and file_stat.st_mtime_ns != mtime_ns)
+            or ('size' in self._change_keys and file_stat.st_size != size)
+            or ('inode' in self._change_keys and file_stat.st_ino != inode)
+        )
+
+    def _retry_due(self, full_path):
+        """
+        Returns:
+            int: Number of failed extractions so far, if full_path failed
+                before and its backoff is over. None if it doesn't need
+                retrying yet, or at all.
+        """
+        failure = self.db.get_probe_failure(full_path)
+        if failure is None:
+            return None
+        attempts, retry_at = failure
+        if retry_at is not None and retry_at > time.time():
+            return None
+        return attempts or 0
 
-            # Extract recording date from filename if possible
-            recording_date = self.extract_recording_date(filename, dirpath)
+    def _store_video(self, context, metadata, cache=True):
+        """
+        Writes a processed video to the database. Always runs on the thread
+        that owns the database connection.
 
-            # Combine all metadata
-            combined_metadata = {
-                'file_path': full_path,
-                'file_size_bytes': file_stat.st_size,
-                'recording_date': recording_date,
-                **metadata,
-                **config_data
-            }
+        Args:
+            context (dict): File information gathered by handle_video_file.
+            metadata (dict): Metadata extracted from the video file.
+            cache (bool): Whether to add the metadata to the fingerprint cache.
+        """
+        full_path = context['file_path']
+
+        # Failures aren't cached, so a copy of the file gets a fresh attempt
+        if metadata.get('probe_status', PROBE_OK) == PROBE_OK:
+            attempts, retry_at = 0, None
+            if cache and context['fingerprint']:
+                self.db.cache_metadata(context['fingerprint'], metadata)
+        elif metadata['probe_status'] == PROBE_UNAVAILABLE:
+            # Not the file's fault: no backoff, so the next scan tries again
+            attempts, retry_at = context['probe_attempts'], None
+            self.stats.count('probe_unavailable')
+        else:
+            attempts = context['probe_attempts'] + 1
+            delay = min(self._retry_seconds * 2 ** (attempts - 1), self._retry_max_seconds)
+            retry_at = int(time.time() + delay)
+            self.stats.count('probe_failures')
+            logger.warning(
+                f"Could not extract metadata from {full_path} ({metadata['probe_status']}, "
+                f"attempt {attempts}), retrying in {delay / 3600:g}h"
+            )
 
-            # Insert or update the video in the database
-            self.db.insert_video(full_path, combined_metadata)
+        # Combine all metadata
+        combined_metadata = {
+            'file_path': full_path,
+            'file_size_bytes': context['file_size_bytes'],
+            'recording_date': context['recording_date'],
+            **metadata,
+            **context['config_data']
+        }
 
-            logger.debug(f"Added/updated video: {filename}")
+        # Insert or update the video in the database
+        self.db.insert_video(
+            full_path,
+            combined_metadata,
+            context['file_stat'],
+            fingerprint=context['fingerprint'],
+            last_used=context['last_used'],
+            probe_attempts=attempts,
+            probe_retry_at=retry_at,
+        )
+
+        logger.debug(f"Added/updated video: {os.path.basename(full_path)}")
 
     def extract_video_metadata(self, file_path):
         """
@@ -113,76 +336,16 @@ class Scanner:
         Returns:
             dict: Metadata extracted from the video file.
         """
-        try:
-            from pymediainfo import MediaInfo
-
-            logger.debug(f"Extracting metadata for: {file_path}")
-
-            media_info = MediaInfo.parse(file_path)
-
-            # Get the video track (usually the first video track)
-            video_track = None
-            for track in media_info.tracks:
-                if track.track_type == 'Video':
-                    video_track = track
-                    break
+        return extract_video_metadata(file_path, self._dump_tracks)
 
-            if not video_track:
-                logger.warning(f"No video track found in {file_path}")
-                return self._get_default_metadata()
-            else:
-                # Log all available attributes for debugging
-                logger.debug(f"Available video track attributes: {dir(video_track)}")
-                for attr in dir(video_track):
-                    if not attr.startswith('_'):  # Skip private attributes
-                        try:
-                            value = getattr(video_track, attr)
-                            if not callable(value):  # Skip methods
-                                logger.debug(f"  {attr}: {value}")
-                        except Exception:
-                            pass
-
-
-            # Helper function to safely get numeric attributes
-            def safe_int(obj, attr, default=0):
-                if hasattr(obj, attr) and getattr(obj, attr) is not None:
-                    try:
-                        return int(float(getattr(obj, attr)))
-                    except (ValueError, TypeError):
-                        logger.debug(f"Could not convert {attr} to int: {getattr(obj, attr)}")
-                        return default
-                return default
-
-            def safe_float(obj, attr, default=0.0):
-                if hasattr(obj, attr) and getattr(obj, attr) is not None:
-                    try:
-                        return float(getattr(obj, attr))
-                    except (ValueError, TypeError):
-                        logger.debug(f"Could not convert {attr} to float: {getattr(obj, attr)}")
-                        return default
-                return default
-
-            # Extract relevant metadata with safer conversions
-            metadata = {
-                'duration_seconds': safe_int(video_track, 'duration', 0) // 1000,  # Convert ms to seconds
-                'width': safe_int(video_track, 'width', 0),
-                'height': safe_int(video_track, 'height', 0),
-                'video_format': getattr(video_track, 'format', 'unknown') if hasattr(video_track, 'format') else 'unknown',
-                'codec': getattr(video_track, 'codec_id', 'unknown') if hasattr(video_track, 'codec_id') else 'unknown',
-                'frame_rate': safe_float(video_track, 'frame_rate', 0.0),
-                'bit_rate': safe_int(video_track, 'bit_rate', 0),
-                'aspect_ratio': getattr(video_track, 'display_aspect_ratio', None) if hasattr(video_track, 'display_aspect_ratio') else None,
-            }
-
-            return metadata
-
-        except ImportError:
-            logger.warning("pymediainfo not installed. Using default metadata values.")
-            return self._get_default_metadata()
-        except Exception as e:
-            logger.error(f"Error extracting metadata from {file_path}: {str(e)}")
-            logger.debug(f"Exception details:", exc_info=True)  # Add full traceback for debugging
-            return self._get_default_metadata()
+    def _run_job(self, file_path, job, size=None):
+        """
+        run_job for thread workers, which extract with this scanner's
+        extract_video_metadata.
+        """
+        if job == JOB_PROBE:
+            return self.extract_video_metadata(file_path)
+        return run_job(file_path, job, size)
 
     def _get_default_metadata(self):
         """
@@ -191,90 +354,381 @@ class Scanner:
         Returns:
             dict: Default metadata values.
         """
-        return {
-            'duration_seconds': 0,
-            'width': 0,
-            'height': 0,
-            'video_format': 'unknown',
-            'codec': 'unknown',
-            'frame_rate': 0.0,
-            'bit_rate': 0,
-            'aspect_ratio': None,
-        }
+        return default_metadata()
 
-    def extract_recording_date(self, filename, dirpath):
+    def _make_pool(self):
         """
-        Attempts to extract recording date from filename using notebook decoding rules.
+        Builds the metadata extraction pool configured by `scan_workers`,
+        `scan_pool`, `scan_queue_size`, `probe_timeout` and
+        `probe_isolation`.
+
+        Without workers, extraction still runs in a single worker process
+        so a bad file can be timed out, unless `probe_isolation` is off.
+
+        Returns:
+            MetadataPool or ProbePool: The pool, or None to extract serially
+                in this process.
+        """
+        workers = self.config.get('scan_workers', 0)
+        kind = self.config.get('scan_pool', 'thread')
+        if not workers:
+            if not self.config.get('probe_isolation', True):
+                return None
+            workers, kind = 1, 'process'
+        if kind not in POOL_KINDS:
+            raise ValueError(f"Unknown pool kind '{kind}', expected one of {list(POOL_KINDS)}")
+
+        queue_size = self.config.get('scan_queue_size')
+        logger.info(f"Extracting metadata with {workers} {kind} workers")
+
+        # Process workers can't share our bound method, so they get the
+        # module-level one instead
+        if kind == 'process':
+            return ProbePool(
+                functools.partial(run_job, dump_tracks=self._dump_tracks),
+                self._on_result,
+                workers,
+                timeout=self.config.get('probe_timeout', 120),
+                queue_size=queue_size,
+            )
+        return MetadataPool(
+            self._run_job,
+            self._on_result,
+            workers,
+            queue_size=queue_size,
+        )
+
+    def open_pool(self):
+        """
+        Starts an extraction pool that every scan and apply_changes call
+        uses until close_pool, rather than each starting and stopping its
+        own. For `fosse watch`, whose batches are often a file or two.
         """
-        import re
-        from datetime import datetime
+        self._keep_pool = True
+        self._acquire_pool()
 
-        # Get combined config for this file path
-        file_path = os.path.join(dirpath, filename)
-        combined_config = self.db.get_combined_config_for_file(file_path)
+    def close_pool(self):
+        """
+        Stops the pool started by open_pool.
+        """
+        self._keep_pool = False
+        self._release_pool()
 
-        # Check if we have decoding information
-        if not combined_config or 'decoding' not in combined_config:
-            return None
+    def _acquire_pool(self):
+        if self._pool is None:
+            self._pool = self._make_pool()
 
-        decoding = combined_config.get('decoding', {})
-        regexp = decoding.get('regexp')
-        date_group = decoding.get('date-group')
-        time_group = decoding.get('time-group')
+    def _release_pool(self, failed=False):
+        """
+        Stops the pool, unless open_pool is keeping it. A call that failed
+        part way always stops it, dropping whatever was in flight; a kept
+        pool is started again by the next call.
+        """
+        if self._pool and (failed or not self._keep_pool):
+            self._pool.shutdown()
+            self._pool = None
+            self._probe_backlog.clear()
 
-        if not regexp or not date_group:
+    def extract_recording_date(self, filename, dirpath):
+        """
+        Attempts to extract recording date from filename using notebook decoding rules.
+        """
+        decoding = self._get_decoding(dirpath)
+        if decoding is None:
             return None
 
         try:
-            # Apply the regular expression to the filename
-            match = re.match(regexp, filename)
-            if not match:
-                return None
+            return decoding.parse(filename)
+        except ValueError:
+            logger.warning(f"Could not parse date from filename: {filename}")
+            return None
+        except Exception as e:
+            logger.error(f"Error extracting date from {filename}: {str(e)}")
+            return None
 
-            # Extract date and time if available
-            date_str = match.group(date_group)
-            time_str = match.group(time_group) if time_group and time_group <= len(match.groups()) else "00:00:00"
+    def extract_recording_dates(self, dirpath, filenames):
+        """
+        Extracts the recording dates of several files in one directory.
 
-            # Parse date format - this would need to be adjusted based on your date format
-            # Assuming format is YYYY-MM-DD or similar
-            date_format = combined_config.get('date_format', '%Y-%m-%d')
-            time_format = combined_config.get('time_format', '%H:%M:%S')
+        Returns:
+            dict: filename -> ISO 8601 date, or None where there's no date.
+        """
+        decoding = self._get_decoding(dirpath)
+        if decoding is None:
+            return dict.fromkeys(filenames)
+        return decoding.parse_many(filenames)
+
+    def _get_decoding(self, dirpath):
+        """
+        Returns:
+            Decoding: The decoding rules that apply in a directory, compiled
+                once per distinct set of rules, or None.
+        """
+        return decoding_for(self.db.get_combined_config_for_dir(os.path.abspath(dirpath)))
 
-            # Try to parse the date
+    def _walk(self, root, incremental=False):
+        """
+        Walks the tree top-down with os.scandir, recording a fingerprint for
+        each directory. Subdirectories skipped or excluded by the notebooks
+        above them aren't descended into.
+
+        Args:
+            root (Path): Directory to start from.
+            incremental (bool): Whether unchanged directories can be skipped.
+
+        Yields:
+            tuple: (dirpath, entries) for every directory that was listed,
+                entries being the os.DirEntry of each file in it. Skipped
+                directories aren't yielded; their notebook is still handled
+                and their subdirectories are taken from the database.
+        """
+        stack = [str(root)]
+        while stack:
+            dirpath = stack.pop()
             try:
-                recording_date = datetime.strptime(f"{date_str} {time_str}", f"{date_format} {time_format}")
-                return recording_date.isoformat()
-            except ValueError:
-                logger.warning(f"Could not parse date from filename: {filename}")
-                return None
+                dir_stat = os.stat(dirpath)
+            except OSError as e:
+                logger.warning(f"Could not stat {dirpath}: {str(e)}")
+                continue
+
+            fingerprint = (dir_stat.st_mtime_ns, dir_stat.st_nlink, dir_stat.st_ino)
+
+            if incremental and self.db.directory_unchanged(dirpath, fingerprint):
+                # Notebooks can be edited in place without touching the
+                # directory, and they're cheap to re-read
+                if self.db.has_notebook(dirpath):
+                    self.handle_fosse_yml(dirpath)
+
+                # A changed notebook may skip or exclude things that were
+                # scanned before, so everything below it is listed again
+                if not self._under_updated_notebook(dirpath):
+                    logger.debug(f"Skipping unchanged {dirpath}")
+                    self.stats.count('dirs_skipped')
+                    self.db.mark_directory(dirpath, fingerprint, changed=False)
+                    stack.extend(reversed(self.db.get_subdirectories(dirpath)))
+                    continue
+
+            subdirs = []
+            files = []
+            try:
+                with self.stats.stage('walk'), os.scandir(dirpath) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            # Like os.walk, don't follow symlinked directories
+                            if not entry.is_symlink():
+                                subdirs.append(entry.name)
+                        else:
+                            files.append(entry)
+            except OSError as e:
+                logger.warning(f"Could not list {dirpath}: {str(e)}")
+                continue
+            self.stats.count('dirs_listed')
+
+            self.db.mark_directory(dirpath, fingerprint)
+            yield dirpath, files
+
+            # The consumer has handled this directory's notebook by now, so
+            # its rules apply to what is below
+            excluded = self._get_exclusion(dirpath)
+            if excluded is True:
+                continue
+            stack.extend(
+                os.path.join(dirpath, name) for name in reversed(subdirs)
+                if not (excluded and excluded(name))
+            )
 
-        except Exception as e:
-            logger.error(f"Error extracting date from {filename}: {str(e)}")
+    def _is_excluded(self, dirpath, name):
+        """
+        Returns:
+            bool: True if notebook rules leave out `name` in `dirpath`.
+        """
+        excluded = self._get_exclusion(dirpath)
+        return excluded is True or bool(excluded and excluded(name))
+
+    def _under_updated_notebook(self, dirpath):
+        """
+        Returns:
+            bool: True if dirpath or a directory above it had its notebook
+                changed during this scan.
+        """
+        if not self._updated_notebooks:
+            return False
+        while True:
+            if dirpath in self._updated_notebooks:
+                return True
+            parent = os.path.dirname(dirpath)
+            if parent == dirpath:
+                return False
+            dirpath = parent
+
+    def _get_exclusion(self, dirpath):
+        """
+        Reads the `skip` and `exclude` rules that apply in a directory from
+        its combined config. `skip: true` leaves out the directory's videos
+        and everything below it; `exclude` is a list of shell-style patterns
+        for file and directory names to leave out.
+
+        Returns:
+            True if the directory is skipped, a function telling whether a
+            name is excluded, or None if there are no rules.
+        """
+        config = self.db.get_combined_config_for_dir(dirpath)
+        if config.get('skip'):
+            return True
+
+        patterns = config.get('exclude')
+        if not patterns:
             return None
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        return lambda name: any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
 
-    def scan(self):
+    def is_video(self, filename):
+        """
+        Returns:
+            bool: True if filename has one of the configured video extensions.
+        """
+        return filename.lower().endswith(self._video_suffixes)
+
+    def scan_directory(self, dirpath, entries):
+        """
+        Handles the notebook and video files of a single listed directory.
+
+        Args:
+            dirpath (str): The path of the directory being scanned.
+            entries (list): os.DirEntry of each file in the directory.
+        """
+        logger.debug(f"Scanning {dirpath}...")
+
+        # Handle fosse.yml file if it exists
+        if any(entry.name == self.fosse_file for entry in entries):
+            self.handle_fosse_yml(dirpath)
+        elif self.db.has_notebook(dirpath):
+            # Removed since the last scan; its rules must not outlive it
+            # until end_of_scan purges it
+            self.db.remove_notebook(dirpath)
+            logger.info(f"Config removed at {dirpath}, updating affected videos...")
+            self._updated_notebooks.add(dirpath)
+            self.db.update_videos_for_config(dirpath)
+
+        excluded = self._get_exclusion(dirpath)
+        if excluded is True:
+            logger.debug(f"Skipping {dirpath} as its notebook says")
+            return
+
+        suffixes = self._video_suffixes
+        videos = {
+            entry.name: entry for entry in entries
+            if entry.name.lower().endswith(suffixes)
+            and not (excluded and excluded(entry.name))
+        }
+
+        # Every video in a directory we haven't seen before is new, so their
+        # dates can be extracted in one go
+        dates = None
+        if videos and not self.db.is_known_directory(dirpath):
+            with self.stats.stage('date'):
+                dates = self.extract_recording_dates(dirpath, videos)
+
+        # Handle video files
+        for filename, entry in videos.items():
+            self.handle_video_file(dirpath, filename, dates, entry)
+
+    def apply_changes(self, paths):
+        """
+        Brings the database up to date for a set of paths that changed, e.g.
+        as reported by filesystem events, without walking the whole tree.
+        Each path is looked at as it is now, so it doesn't matter whether it
+        was created, modified, moved or deleted, or how often.
+
+        Args:
+            paths (iterable): Absolute paths of changed files and directories.
+
+        Returns:
+            list: Every directory that was walked because it appeared.
+        """
+        notebooks = set()
+        new_dirs = []
+        videos = []
+        gone = []
+        for path in sorted(set(paths)):
+            dirpath, name = os.path.split(path)
+            if name == self.fosse_file:
+                notebooks.add(dirpath)
+            elif os.path.isdir(path) and not os.path.islink(path):
+                if not self._is_excluded(dirpath, name):
+                    new_dirs.append(path)
+            elif os.path.isfile(path):
+                if self.is_video(name) and not self._is_excluded(dirpath, name):
+                    videos.append((dirpath, name))
+            else:
+                gone.append(path)
+
+        walked = []
+        self.db.begin_batch()
+        self._acquire_pool()
+        try:
+            # Notebooks first, so the videos below pick up their config
+            for dirpath in sorted(notebooks):
+                if os.path.isfile(os.path.join(dirpath, self.fosse_file)):
+                    self.handle_fosse_yml(dirpath)
+                elif self.db.remove_notebook(dirpath):
+                    logger.info(f"Config removed at {dirpath}, updating affected videos...")
+                    self.db.update_videos_for_config(dirpath)
+
+            for dirpath in new_dirs:
+                for subdir, entries in self._walk(Path(dirpath)):
+                    walked.append(subdir)
+                    self.scan_directory(subdir, entries)
+
+            for dirpath, filename in videos:
+                self.handle_video_file(dirpath, filename)
+
+            if self._pool:
+                self._drain_pool()
+        except BaseException:
+            self._release_pool(failed=True)
+            raise
+        self._release_pool()
+
+        # Deletions last, so a video that was moved can still find its
+        # last_used under the old path
+        for path in gone:
+            logger.debug(f"Removing {path}")
+            self.db.delete_video(path)
+            self.db.delete_subtree(path)
+
+        self.db.end_batch()
+        return walked
+
+    def scan(self, incremental=False):
         """
         Scans the directory specified in the config for video files. Populates
         the database.
 
+        Args:
+            incremental (bool): Skip directories whose fingerprint (mtime,
+                link count and inode) matches the last scan. Their videos and
+                notebooks are kept. Files rewritten in place without touching
+                their directory are only picked up by a full scan.
+
         Returns:
             bool: True if the scan was successful, False otherwise.
         """
         logger.info("Starting scan...")
+        if self.stats.enabled:
+            # Fresh numbers for every scan, e.g. the rescans of `fosse watch`
+            self.stats = self.db.stats = ScanStats()
+        self.stats.start()
+        self._updated_notebooks.clear()
         self.db.begin_of_scan()
 
         # Initialize mimetypes
         mimetypes.init()
 
-        # Define video extensions to look for
-        video_extensions = self.config['video_extensions']
-
-        fosse_file = "fosse.yml"  # Default fosse file name
-        if 'fosse_file' in self.config:
-            fosse_file = self.config['fosse_file']
-
-        # Convert to Path object for better path handling
-        root = Path(self.config['root'])
+        # Convert to Path object for better path handling. Notebooks are keyed
+        # by directory and videos by absolute path, so walk an absolute root.
+        root = Path(os.path.abspath(self.config['root']))
 
         # Check if the root path exists
         if not root.exists():
@@ -283,22 +737,56 @@ class Scanner:
             )
             return False
 
-        # Walk through all directories and files
-        for dirpath, dirnames, filenames in os.walk(root):
-            logger.debug(f"Scanning {dirpath}...")
-
-            # Handle fosse.yml file if it exists
-            if fosse_file in filenames:
-                self.handle_fosse_yml(dirpath)
+        # Either commit per directory, or let the DB commit per batch
+        commit_per_directory = self.config.get('scan_commit') == 'directory'
 
-            # Handle video files
-            for filename in filenames:
-                # Check if file has a video extension
-                if any(filename.lower().endswith(ext) for ext in video_extensions):
-                    self.handle_video_file(dirpath, filename)
+        self._acquire_pool()
+        try:
+            # Walk through all directories and files
+            for dirpath, entries in self._walk(root, incremental):
+                self.scan_directory(dirpath, entries)
+
+                if commit_per_directory:
+                    self.db.flush()
+
+            # Skipped directories can still hold failures due a retry
+            if incremental:
+                for full_path in self.db.get_retries_in_unchanged_dirs(time.time()):
+                    if os.path.isfile(full_path):
+                        dirpath, filename = os.path.split(full_path)
+                        self.handle_video_file(dirpath, filename)
+
+            # Collect whatever the workers are still chewing on
+            if self._pool:
+                self._drain_pool()
+        except BaseException:
+            self._release_pool(failed=True)
+            raise
+        self._release_pool()
 
         # Clean up database entries for files that no longer exist
         self.db.end_of_scan()
+        self.stats.stop()
         logger.info("Scan completed successfully")
 
-        return True
\ No newline at end of file
+        if self.stats.enabled:
+            self.report_stats()
+
+        return True
+
+    def report_stats(self):
+        """
+        Logs the stats of the last scan, and writes them to the files named
+        by `scan_stats_json` and `scan_stats_prometheus`.
+        """
+        logger.info(f"Scan stats:\n{self.stats.summary()}")
+
+        json_path = self.config.get('scan_stats_json')
+        if json_path:
+            self.stats.write_json(json_path)
+
+        prometheus_path = self.config.get('scan_stats_prometheus')
+        if prometheus_path:
+            # Write then rename, so collectors never read a partial file
+            self.stats.write_prometheus(f"{prometheus_path}.tmp")
+            os.replace(f"{prometheus_path}.tmp", prometheus_path)
\ No newline at end of file
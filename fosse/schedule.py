@@ -0,0 +1,88 @@
+import time
+
+from loguru import logger
+
+from fosse.db import FosseData
+from fosse.playlist import Catalog, Playlist
+
+DEFAULT_CHANNEL = 'default'
+
+
+class Scheduler:
+    """
+    Keeps a precomputed schedule for every channel in config['channels'],
+    so what's on a channel at any time is a single indexed lookup.
+
+    Each channel has optional `filters` (field -> value or list of values,
+    as in Catalog.matching), `weights` and `no_repeat_hours`, as in the
+    `stream` section. With no channels configured there is a single
+    DEFAULT_CHANNEL using the `stream` section.
+    """
+
+    def __init__(self, config, db=None):
+        self.config = config
+        self.db = db or FosseData(config)
+        # Without any channels configured, the `stream` section is the one
+        self.channels = config.get('channels') or {DEFAULT_CHANNEL: config.get('stream') or {}}
+        # How far ahead schedules are filled in
+        self.horizon = config.get('schedule_hours', 24) * 3600
+        # How long finished entries are kept
+        self.keep = config.get('schedule_keep_hours', 24) * 3600
+
+    def extend(self, now=None):
+        """
+        Fills every channel's schedule up to `schedule_hours` from now,
+        continuing from where each one currently ends.
+
+        Args:
+            now (int): Seconds since the epoch. Defaults to the current time.
+
+        Returns:
+            dict: Channel name -> number of entries added.
+        """
+        now = int(time.time() if now is None else now)
+        until = now + self.horizon
+        self.db.prune_schedule(now - self.keep, self.channels)
+
+        # Loaded once and shared, so each channel sees what the channels
+        # before it just scheduled
+        catalog = None
+        added = {}
+        for name, settings in self.channels.items():
+            settings = settings or {}
+            start = max(self.db.get_schedule_end(name) or now, now)
+            if start >= until:
+                added[name] = 0
+                continue
+
+            if catalog is None:
+                catalog = Catalog.load(self.db)
+
+            positions = catalog.matching(settings.get('filters'))
+            if not positions:
+                logger.warning(f"Channel '{name}' has no matching videos")
+                added[name] = 0
+                continue
+
+            playlist = Playlist.from_config(catalog, settings, positions=positions, start=start)
+            entries = [
+                (catalog.id[pos], int(begin), int(begin + playlist.length(pos)))
+                for pos, begin in playlist.take(until - start)
+            ]
+            # Picks are made in memory, so write them all in one go
+            self.db.add_to_schedule(name, entries)
+            added[name] = len(entries)
+            logger.debug(f"Scheduled {len(entries)} videos on '{name}'")
+
+        return added
+
+    def now_playing(self, channel, at=None):
+        """
+        Args:
+            channel (str): Channel name.
+            at (int): Seconds since the epoch. Defaults to the current time.
+
+        Returns:
+            tuple: (video_id, file_path, start_time, end_time), or None.
+        """
+        return self.db.get_scheduled(channel, int(time.time() if at is None else at))
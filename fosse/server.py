@@ -0,0 +1,471 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import mimetypes
+import os
+import sqlite3
+import time
+import urllib.parse
+
+from loguru import logger
+
+from fosse.schedule import Scheduler
+
+STATUS_TEXT = {
+    200: 'OK',
+    206: 'Partial Content',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    416: 'Range Not Satisfiable',
+    503: 'Service Unavailable',
+}
+
+
+def parse_range(header, size):
+    """
+    Parses a single-range `Range` header.
+
+    Args:
+        header (str): The header's value, or None.
+        size (int): Size of the file being requested.
+
+    Returns:
+        tuple: (first, last) byte positions, inclusive, or None to send the
+            whole file (no header, or one we don't handle).
+
+    Raises:
+        ValueError: If the range lies outside the file.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    # Multiple ranges may be answered with the whole file
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+
+    first, _, last = spec.strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(last), 0)
+            end = size - 1
+    except ValueError:
+        return None
+
+    end = min(end, size - 1)
+    if start >= size or start > end:
+        raise ValueError(f"Range {header} outside of {size} bytes")
+    return start, end
+
+
+def prefetch(file_path, length):
+    """
+    Asks the kernel to start reading the beginning of a file into the page
+    cache, so it's there by the time it is played.
+
+    Args:
+        file_path (str): File to prefetch.
+        length (int): Bytes to prefetch from the start, 0 for all of it.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, length, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.warning(f"Could not prefetch {file_path}: {str(e)}")
+
+
+class Broadcaster:
+    """
+    Plays a channel's schedule as one continuous byte stream. Each file is
+    read once, slightly ahead of the schedule, and every chunk is handed to
+    all of the channel's viewers.
+    """
+
+    def __init__(self, server, channel):
+        self.server = server
+        self.channel = channel
+        self.viewers = set()
+        self._task = None
+        # Point in the schedule the next chunk belongs to
+        self._position = None
+
+    def join(self):
+        """
+        Returns:
+            asyncio.Queue: Chunks for a new viewer; None marks the end.
+        """
+        queue = asyncio.Queue(maxsize=self.server.queue_chunks)
+        self.viewers.add(queue)
+        if self._task is None or self._task.done():
+            self._position = time.time()
+            self._task = asyncio.ensure_future(self._run())
+        return queue
+
+    def leave(self, queue):
+        self.viewers.discard(queue)
+        if not self.viewers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _send(self, chunk):
+        for queue in list(self.viewers):
+            if queue.full():
+                # Too slow to keep up: cut them off rather than hold up
+                # everyone else
+                self.viewers.discard(queue)
+                self._end(queue)
+                continue
+            queue.put_nowait(chunk)
+
+    @staticmethod
+    def _end(queue):
+        """
+        Replaces whatever a viewer hasn't read yet with the end marker, which
+        always fits.
+        """
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def _run(self):
+        try:
+            while self.viewers:
+                entries = await self.server.read(
+                    self.server.db.get_schedule_window, self.channel, int(self._position), 1
+                )
+                if not entries:
+                    await asyncio.sleep(1)
+                    self._position = max(self._position, time.time())
+                    continue
+
+                _, _, file_path, start, end = entries[0]
+                await self._play(file_path, start, end)
+                self._position = end
+        except Exception as e:
+            logger.error(f"Stream of channel '{self.channel}' failed: {str(e)}")
+            for queue in list(self.viewers):
+                self._end(queue)
+            raise
+
+    async def _play(self, file_path, start, end):
+        loop = asyncio.get_running_loop()
+        try:
+            fd = os.open(file_path, os.O_RDONLY)
+        except OSError as e:
+            logger.warning(f"Skipping {file_path}: {str(e)}")
+            return
+
+        try:
+            size = os.fstat(fd).st_size
+            # Bytes per second of schedule time
+            rate = size / max(end - start, 1)
+            offset = int(rate * max(self._position - start, 0))
+            while offset < size and self.viewers:
+                chunk = await loop.run_in_executor(
+                    None, os.pread, fd, self.server.chunk_size, offset
+                )
+                if not chunk:
+                    break
+                self._send(chunk)
+                offset += len(chunk)
+
+                # Stay stream_buffer_seconds ahead of the schedule
+                delay = start + offset / rate - self.server.buffer_seconds - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        finally:
+            os.close(fd)
+
+
+class StreamServer:
+    """
+    HTTP server for the scheduled channels:
+
+        /channels              JSON list of channels and what's on
+        /channels/<name>.m3u8  HLS-style live playlist of whole files
+        /channels/<name>       the channel as one continuous byte stream
+        /video/<id>            a single video, with range requests
+    """
+
+    def __init__(self, config):
+        self.config = config
+        # Schedule updates run on a thread of their own, which owns the
+        # database's writer connection, so they never hold up the event
+        # loop. Lookups go through self.read, on pooled readers.
+        self._writer = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='fosse-writer'
+        )
+        self.scheduler = self._writer.submit(Scheduler, config).result()
+        self.db = self.scheduler.db
+
+        self.host = config.get('stream_host', '127.0.0.1')
+        self.port = config.get('stream_port', 8080)
+        # Entries listed in each HLS playlist
+        self.playlist_length = config.get('stream_playlist_length', 5)
+        # Continuous streams: read size, how far to run ahead of the
+        # schedule, and how many chunks a viewer may fall behind
+        self.chunk_size = config.get('stream_chunk_size', 256 * 1024)
+        self.buffer_seconds = config.get('stream_buffer_seconds', 5)
+        self.queue_chunks = config.get('stream_queue_chunks', 64)
+        # When and how much of the next file to pull into the page cache
+        self.prefetch_seconds = config.get('stream_prefetch_seconds', 30)
+        self.prefetch_bytes = config.get('stream_prefetch_mb', 64) * 1024 * 1024
+
+        self._broadcasters = {}
+
+    async def read(self, method, *args):
+        """
+        Runs one of the database's read methods on the executor, on a pooled
+        reader, so lookups don't hold up the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+
+    def run(self):
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            logger.info("Stopped streaming")
+        finally:
+            self._writer.submit(self.db.close).result()
+            self._writer.shutdown()
+
+    async def _extend(self):
+        """
+        Tops up the schedules, on the writer thread.
+
+        Returns:
+            bool: False if the database stayed locked, e.g. by a scan, past
+                db_busy_timeout. What's already scheduled keeps playing.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._writer, self.scheduler.extend)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Could not extend the schedules, will retry: {str(e)}")
+            return False
+        return True
+
+    async def _serve(self):
+        await self._extend()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(
+            f"Streaming {len(self.scheduler.channels)} channels on "
+            f"http://{self.host}:{self.port}/channels"
+        )
+        async with server:
+            await asyncio.gather(server.serve_forever(), self._maintain())
+
+    async def _maintain(self):
+        """
+        Keeps the schedules topped up, and prefetches what each channel plays
+        next shortly before the current video ends.
+        """
+        loop = asyncio.get_running_loop()
+        interval = min(self.scheduler.horizon / 4, 3600)
+        next_extend = time.monotonic() + interval
+        prefetched = {}  # channel -> sequence of the last prefetched entry
+
+        while True:
+            # Retried on the next tick if it fails
+            if time.monotonic() >= next_extend and await self._extend():
+                next_extend = time.monotonic() + interval
+
+            now = time.time()
+            for channel in self.scheduler.channels:
+                entries = await self.read(self.db.get_schedule_window, channel, int(now), 2)
+                if len(entries) < 2:
+                    continue
+                current, upcoming = entries
+                if prefetched.get(channel) == upcoming[0]:
+                    continue
+                if current[4] - now <= self.prefetch_seconds:
+                    prefetched[channel] = upcoming[0]
+                    logger.debug(f"Prefetching {upcoming[2]} for '{channel}'")
+                    await loop.run_in_executor(
+                        None, prefetch, upcoming[2], self.prefetch_bytes
+                    )
+
+            await asyncio.sleep(1)
+
+    async def _handle(self, reader, writer):
+        try:
+            request = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            if len(request) != 3:
+                await self._respond(writer, 400)
+                return
+            method, target, _ = request
+            if method not in ('GET', 'HEAD'):
+                await self._respond(writer, 405, {'Allow': 'GET, HEAD'})
+                return
+
+            path = urllib.parse.unquote(urllib.parse.urlsplit(target).path)
+            await self._route(writer, method, path, headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _route(self, writer, method, path, headers):
+        head = method == 'HEAD'
+        if path == '/channels':
+            await self._send_channels(writer, head)
+            return
+
+        if path.startswith('/video/'):
+            video_id = path[len('/video/'):]
+            await self._send_video(writer, head, video_id, headers)
+            return
+
+        if path.startswith('/channels/'):
+            name = path[len('/channels/'):]
+            if name.endswith('.m3u8') and name[:-len('.m3u8')] in self.scheduler.channels:
+                await self._send_playlist(writer, head, name[:-len('.m3u8')])
+                return
+            if name in self.scheduler.channels:
+                await self._send_stream(writer, head, name)
+                return
+
+        await self._respond(writer, 404)
+
+    def _start(self, writer, status, headers):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}", 'Connection: close']
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    async def _respond(self, writer, status, headers=None, body=b'', head=False):
+        headers = dict(headers or {})
+        headers['Content-Length'] = str(len(body))
+        self._start(writer, status, headers)
+        if not head:
+            writer.write(body)
+        await writer.drain()
+
+    async def _send_channels(self, writer, head):
+        now = int(time.time())
+        channels = []
+        for name in self.scheduler.channels:
+            playing = await self.read(self.db.get_scheduled, name, now)
+            channels.append({
+                'name': name,
+                'playlist': f"/channels/{urllib.parse.quote(name)}.m3u8",
+                'stream': f"/channels/{urllib.parse.quote(name)}",
+                'now_playing': None if playing is None else {
+                    'video_id': playing[0],
+                    'file': os.path.basename(playing[1]),
+                    'start_time': playing[2],
+                    'end_time': playing[3],
+                },
+            })
+        body = json.dumps(channels, indent=2).encode('utf-8')
+        await self._respond(writer, 200, {'Content-Type': 'application/json'}, body, head)
+
+    async def _send_playlist(self, writer, head, channel):
+        now = time.time()
+        entries = await self.read(
+            self.db.get_schedule_window, channel, int(now), self.playlist_length
+        )
+        if not entries:
+            await self._respond(writer, 503)
+            return
+
+        first = entries[0]
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f"#EXT-X-TARGETDURATION:{max(end - start for _, _, _, start, end in entries)}",
+            f"#EXT-X-MEDIA-SEQUENCE:{first[0]}",
+            f"#EXT-X-DISCONTINUITY-SEQUENCE:{first[0]}",
+            f"#EXT-X-START:TIME-OFFSET={now - first[3]:.3f}",
+        ]
+        for i, (_, video_id, file_path, start, end) in enumerate(entries):
+            # Every file is encoded separately
+            if i:
+                lines.append('#EXT-X-DISCONTINUITY')
+            lines.append(f"#EXTINF:{end - start},{os.path.basename(file_path)}")
+            lines.append(f"/video/{video_id}")
+
+        body = ('\n'.join(lines) + '\n').encode('utf-8')
+        headers = {'Content-Type': 'application/vnd.apple.mpegurl', 'Cache-Control': 'no-cache'}
+        await self._respond(writer, 200, headers, body, head)
+
+    async def _send_video(self, writer, head, video_id, headers):
+        file_path = await self.read(self.db.get_video_path, int(video_id)) \
+            if video_id.isascii() and video_id.isdigit() else None
+        try:
+            video = open(file_path, 'rb') if file_path else None
+        except OSError as e:
+            logger.warning(f"Could not open {file_path}: {str(e)}")
+            video = None
+        if video is None:
+            await self._respond(writer, 404)
+            return
+
+        with video:
+            size = os.fstat(video.fileno()).st_size
+            try:
+                byte_range = parse_range(headers.get('range'), size)
+            except ValueError:
+                await self._respond(writer, 416, {'Content-Range': f"bytes */{size}"})
+                return
+
+            status = 200
+            start, end = 0, size - 1
+            response = {
+                'Content-Type': mimetypes.guess_type(file_path)[0] or 'application/octet-stream',
+                'Accept-Ranges': 'bytes',
+            }
+            if byte_range is not None:
+                status = 206
+                start, end = byte_range
+                response['Content-Range'] = f"bytes {start}-{end}/{size}"
+            response['Content-Length'] = str(end - start + 1)
+
+            self._start(writer, status, response)
+            await writer.drain()
+            if head or end < start:
+                return
+            # Zero-copy through os.sendfile where the transport allows it
+            await asyncio.get_running_loop().sendfile(
+                writer.transport, video, start, end - start + 1
+            )
+
+    async def _send_stream(self, writer, head, channel):
+        self._start(writer, 200, {'Content-Type': 'application/octet-stream'})
+        await writer.drain()
+        if head:
+            return
+
+        broadcaster = self._broadcasters.get(channel)
+        if broadcaster is None:
+            broadcaster = self._broadcasters[channel] = Broadcaster(self, channel)
+
+        queue = broadcaster.join()
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            broadcaster.leave(queue)
@@ -0,0 +1,241 @@
+import contextlib
+import json
+import time
+from bisect import bisect_left
+
+# Upper bounds, in seconds, of the duration histogram buckets
+BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# Stages reported by the scanner and the database, in the order they're
+# printed
+STAGES = {
+    'walk': 'listing directories',
+    'stat': 'os.stat of video files',
+    'config': 'config resolution',
+    'date': 'recording date extraction',
+    'fingerprint': 'content fingerprinting',
+    'cache_lookup': 'media cache lookups',
+    'probe': 'metadata extraction (serial)',
+    'probe_wait': 'waiting on the extraction pool',
+    'notebook': 'loading and storing notebooks',
+    'notebook_update': 'applying notebook changes to videos',
+    'db_write': 'video upserts',
+    'commit': 'commits',
+    'end_of_scan': 'purging removed entries',
+}
+
+
+class Histogram:
+    """
+    Durations bucketed Prometheus-style, plus count, sum and max.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """
+        Returns:
+            float: Upper bound of the bucket holding the q-th quantile.
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (self.max,), self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], self.buckets)),
+        }
+
+
+class ScanStats:
+    """
+    Per-stage timings and counters for a scan.
+
+        with stats.stage('probe'):
+            ...
+        stats.count('videos_probed')
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self._started = None
+        self.elapsed = 0.0
+
+    def start(self):
+        self._started = time.perf_counter()
+
+    def stop(self):
+        if self._started is not None:
+            self.elapsed = time.perf_counter() - self._started
+            self._started = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        histogram = self.stages.get(name)
+        if histogram is None:
+            histogram = self.stages[name] = Histogram()
+        histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def throughput(self):
+        """
+        Returns:
+            tuple: (files per second, MB per second). Files are every video
+                looked at; megabytes are those of the videos processed.
+        """
+        if not self.elapsed:
+            return 0.0, 0.0
+        files = self.counters.get('videos_seen', 0) / self.elapsed
+        megabytes = self.counters.get('bytes_processed', 0) / 1e6 / self.elapsed
+        return files, megabytes
+
+    def _ordered_stages(self):
+        names = [name for name in STAGES if name in self.stages]
+        return names + sorted(name for name in self.stages if name not in STAGES)
+
+    def summary(self):
+        """
+        Returns:
+            str: Human readable report.
+        """
+        files, megabytes = self.throughput()
+        lines = [
+            f"Scan took {self.elapsed:.2f}s: {files:.1f} files/s, {megabytes:.2f} MB/s",
+            f"  {'stage':<16} {'calls':>9} {'total':>9} {'share':>6} {'p50':>9} {'p99':>9} {'max':>9}",
+        ]
+        for name in self._ordered_stages():
+            h = self.stages[name]
+            share = h.sum / self.elapsed * 100 if self.elapsed else 0.0
+            lines.append(
+                f"  {name:<16} {h.count:>9} {h.sum:>8.3f}s {share:>5.1f}% "
+                f"{h.quantile(0.5) * 1000:>7.2f}ms {h.quantile(0.99) * 1000:>7.2f}ms "
+                f"{h.max * 1000:>7.2f}ms"
+            )
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"  {name:<16} {value:>9}")
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        files, megabytes = self.throughput()
+        return {
+            'elapsed': self.elapsed,
+            'files_per_second': files,
+            'megabytes_per_second': megabytes,
+            'counters': dict(self.counters),
+            'stages': {name: self.stages[name].to_dict() for name in self._ordered_stages()},
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def write_prometheus(self, path):
+        """
+        Writes the stats in the Prometheus text format, e.g. for the node
+        exporter's textfile collector.
+        """
+        files, megabytes = self.throughput()
+        lines = [
+            '# HELP fosse_scan_seconds Wall time of the last scan.',
+            '# TYPE fosse_scan_seconds gauge',
+            f"fosse_scan_seconds {self.elapsed}",
+            '# HELP fosse_scan_files_per_second Videos looked at per second.',
+            '# TYPE fosse_scan_files_per_second gauge',
+            f"fosse_scan_files_per_second {files}",
+            '# HELP fosse_scan_bytes_per_second Bytes of processed videos per second.',
+            '# TYPE fosse_scan_bytes_per_second gauge',
+            f"fosse_scan_bytes_per_second {megabytes * 1e6}",
+            '# HELP fosse_scan_total Counters from the last scan.',
+            '# TYPE fosse_scan_total gauge',
+        ]
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'fosse_scan_total{{counter="{name}"}} {value}')
+
+        lines.append('# HELP fosse_scan_stage_seconds Time spent per scan stage.')
+        lines.append('# TYPE fosse_scan_stage_seconds histogram')
+        for name in self._ordered_stages():
+            h = self.stages[name]
+            cumulative = 0
+            for bound, count in zip([str(b) for b in BUCKETS] + ['+Inf'], h.buckets):
+                cumulative += count
+                lines.append(f'fosse_scan_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'fosse_scan_stage_seconds_sum{{stage="{name}"}} {h.sum}')
+            lines.append(f'fosse_scan_stage_seconds_count{{stage="{name}"}} {h.count}')
+
+        with open(path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+
+
+class NullStats:
+    """
+    Stand-in for ScanStats when instrumentation is off; every call is a
+    no-op so the hot paths pay for little more than the method call.
+    """
+
+    enabled = False
+    _context = contextlib.nullcontext()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def stage(self, name):
+        return self._context
+
+    def observe(self, name, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+
+NULL_STATS = NullStats()
+
+
+def make_stats(config, enabled=False):
+    """
+    Returns:
+        ScanStats or NullStats: Instrumentation, on if `enabled` or if any
+            of `scan_stats`, `scan_stats_json` or `scan_stats_prometheus` is
+            set in the config.
+    """
+    if enabled or config.get('scan_stats') or config.get('scan_stats_json') \
+            or config.get('scan_stats_prometheus'):
+        return ScanStats()
+    return NULL_STATS
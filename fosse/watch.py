@@ -0,0 +1,276 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+from loguru import logger
+
+from fosse.scanner import Scanner
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# Files are picked up once they are closed or moved in, rather than when
+# they're created, so half-written uploads aren't probed
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF
+)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyBackend:
+    """
+    Reports changed paths using Linux inotify, through libc via ctypes.
+    One watch is needed per directory.
+    """
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+
+        self._poll = select.poll()
+        self._poll.register(self._fd, select.POLLIN)
+        self._paths = {}  # watch descriptor -> directory
+        self._wds = {}  # directory -> watch descriptor
+
+    def close(self):
+        os.close(self._fd)
+
+    def watching(self, path):
+        return path in self._wds
+
+    def add(self, path):
+        """
+        Starts watching a directory.
+
+        Raises:
+            OSError: On failure. ENOSPC means the fs.inotify.max_user_watches
+                limit has been reached.
+        """
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self._paths[wd] = path
+        self._wds[path] = wd
+
+    def remove_subtree(self, path):
+        """
+        Stops watching a directory and everything below it.
+        """
+        prefix = path.rstrip('/') + '/'
+        for watched in [p for p in self._wds if p == path or p.startswith(prefix)]:
+            wd = self._wds.pop(watched)
+            self._paths.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def wait(self, timeout, debounce, max_delay):
+        """
+        Blocks until something changes, then keeps collecting events until
+        none arrive for `debounce` seconds or `max_delay` seconds pass.
+
+        Args:
+            timeout (float): Seconds to wait for a first event, None for ever.
+            debounce (float): Quiet period that ends a batch.
+            max_delay (float): Longest a batch is held back.
+
+        Returns:
+            set: Paths that changed, empty on timeout. None if events were
+                lost and the whole tree needs checking.
+        """
+        paths = set()
+        if not self._poll.poll(None if timeout is None else timeout * 1000):
+            return paths
+
+        deadline = time.monotonic() + max_delay
+        while True:
+            if not self._read_events(paths):
+                return None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._poll.poll(min(debounce, remaining) * 1000):
+                return paths
+
+    def _read_events(self, paths):
+        """
+        Reads whatever events are queued, adding their paths to `paths`.
+
+        Returns:
+            bool: False if the kernel's event queue overflowed.
+        """
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return True
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length]
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                return False
+
+            if mask & IN_IGNORED:
+                path = self._paths.pop(wd, None)
+                if path is not None and self._wds.get(path) == wd:
+                    del self._wds[path]
+                continue
+
+            dirpath = self._paths.get(wd)
+            # The parent directory reports deletions of watched directories
+            if dirpath is None or mask & IN_DELETE_SELF:
+                continue
+
+            path = os.path.join(dirpath, os.fsdecode(name.rstrip(b'\0')))
+            if mask & IN_ISDIR:
+                if mask & (IN_MOVED_FROM | IN_DELETE):
+                    self.remove_subtree(path)
+            elif mask & IN_CREATE:
+                # Wait for IN_CLOSE_WRITE
+                continue
+            paths.add(path)
+
+        return True
+
+
+class PollingBackend:
+    """
+    Fallback for platforms without inotify: asks for an incremental scan
+    every `interval` seconds, which only lists directories whose
+    fingerprint changed.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+
+    def close(self):
+        pass
+
+    def watching(self, path):
+        return True
+
+    def add(self, path):
+        pass
+
+    def remove_subtree(self, path):
+        pass
+
+    def wait(self, timeout, debounce, max_delay):
+        time.sleep(self.interval if timeout is None else min(self.interval, timeout))
+        return None
+
+
+class Watcher:
+    """
+    Keeps the database in sync with the tree under config['root']: one
+    initial scan, then incremental updates as files change.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.scanner = Scanner(config)
+        # Seconds of quiet that end a batch of events, and the longest a
+        # batch may be held back
+        self.debounce = config.get('watch_debounce', 0.2)
+        self.max_delay = config.get('watch_max_delay', 1.0)
+        # Safety net for anything the event stream misses
+        self.rescan_interval = config.get('watch_rescan_interval', 3600)
+        self.backend = self._make_backend()
+
+    def _make_backend(self):
+        kind = self.config.get('watch_backend', 'auto')
+        if kind in ('auto', 'inotify'):
+            try:
+                return InotifyBackend()
+            except (OSError, AttributeError) as e:
+                if kind == 'inotify':
+                    raise
+                logger.warning(f"inotify unavailable ({str(e)}), falling back to polling")
+        return self._polling_backend()
+
+    def _polling_backend(self):
+        return PollingBackend(self.config.get('watch_poll_interval', 60))
+
+    def run(self):
+        """
+        Scans, then watches for changes until interrupted.
+
+        Returns:
+            bool: False if the initial scan failed.
+        """
+        # One pool for the whole session, rather than one per batch
+        self.scanner.open_pool()
+        try:
+            return self._run()
+        finally:
+            self.scanner.close_pool()
+
+    def _run(self):
+        if not self.scanner.scan(incremental=True):
+            return False
+
+        self._watch(self.scanner.db.known_directories())
+        logger.info("Watching for changes...")
+
+        next_rescan = self._next_rescan()
+        try:
+            while True:
+                timeout = None
+                if next_rescan is not None:
+                    timeout = max(0, next_rescan - time.monotonic())
+
+                paths = self.backend.wait(timeout, self.debounce, self.max_delay)
+
+                if paths is None or (next_rescan is not None and time.monotonic() >= next_rescan):
+                    self.scanner.scan(incremental=True)
+                    self._watch(self.scanner.db.known_directories())
+                    next_rescan = self._next_rescan()
+                elif paths:
+                    logger.debug(f"{len(paths)} paths changed")
+                    self._watch(self.scanner.apply_changes(paths))
+        except KeyboardInterrupt:
+            logger.info("Stopped watching")
+        finally:
+            self.backend.close()
+
+        return True
+
+    def _next_rescan(self):
+        if not self.rescan_interval:
+            return None
+        return time.monotonic() + self.rescan_interval
+
+    def _watch(self, dirpaths):
+        for dirpath in dirpaths:
+            if self.backend.watching(dirpath):
+                continue
+            try:
+                self.backend.add(dirpath)
+            except OSError as e:
+                if e.errno != errno.ENOSPC:
+                    logger.warning(f"Could not watch {dirpath}: {str(e)}")
+                    continue
+                logger.error(
+                    "Out of inotify watches, raise fs.inotify.max_user_watches. "
+                    "Falling back to polling."
+                )
+                self.backend.close()
+                self.backend = self._polling_backend()
+                return
@@ -11,7 +11,7 @@ setup(
     author='Sam Hart',
     author_email='hartsn@gmail.com',
     url='foo.com',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     install_requires=[
         'click',
         'pyyaml',
@@ -0,0 +1,173 @@
+import os
+import tempfile
+import unittest
+
+from fosse.db import FosseData
+
+
+class QueryTest(unittest.TestCase):
+    """
+    Pages through a small library with FosseData.query, checking every row
+    comes up exactly once in either direction.
+    """
+
+    # Order -> the row key holding its sort value
+    ORDERS = {
+        'id': None,
+        'duration': 'duration_seconds',
+        'recording_date': 'recording_date',
+        'last_used': 'last_used',
+    }
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = FosseData({'db_file': os.path.join(self.tmp.name, 'fosse.db')})
+        self.addCleanup(self.db.close)
+
+        directories = ['/lib/a', '/lib/a/sub', '/lib/ab', '/lib/b']
+        for i in range(30):
+            # Few distinct values, so pages split runs of ties, and some
+            # videos without each order column
+            self.db.insert_video(
+                f"{directories[i % 4]}/video{i:02}.mp4",
+                {
+                    'duration_seconds': None if i % 7 == 3 else (i * 5) % 4 * 60,
+                    'recording_date': None if i % 5 == 1 else f"2024-01-0{i % 3 + 1}T12:00:00",
+                    'genre': 'rpg' if i % 2 else 'racing',
+                },
+                last_used=None if i % 3 == 2 else f"2024-02-01 0{i % 4}:00:00",
+            )
+        self.all_rows = list(self.db.query())
+
+    def _page_through(self, order, descending, limit=4, filters=None):
+        """
+        Returns:
+            list: Every row, fetched `limit` at a time.
+        """
+        key = self.ORDERS[order]
+        rows = []
+        after = None
+        while True:
+            page = list(self.db.query(
+                filters, order=order, after=after, limit=limit, descending=descending
+            ))
+            self.assertLessEqual(len(page), limit)
+            rows.extend(page)
+            if len(page) < limit:
+                return rows
+            last = page[-1]
+            after = last['id'] if key is None else (last[key], last['id'])
+
+    def _expected(self, order, descending, rows=None):
+        key = self.ORDERS[order]
+        rows = self.all_rows if rows is None else rows
+        if key is None:
+            return sorted(rows, key=lambda row: row['id'], reverse=descending)
+        return sorted(
+            (row for row in rows if row[key] is not None),
+            key=lambda row: (row[key], row['id']),
+            reverse=descending,
+        )
+
+    def test_fixture(self):
+        self.assertEqual(len(self.all_rows), 30)
+        for key in ('duration_seconds', 'recording_date', 'last_used'):
+            with self.subTest(key=key):
+                self.assertTrue(any(row[key] is None for row in self.all_rows))
+
+    def test_pages_in_both_directions(self):
+        for order in self.ORDERS:
+            for descending in (False, True):
+                with self.subTest(order=order, descending=descending):
+                    rows = self._page_through(order, descending)
+                    ids = [row['id'] for row in rows]
+                    self.assertEqual(len(ids), len(set(ids)))
+                    self.assertEqual(rows, self._expected(order, descending))
+
+    def test_null_order_column_left_out(self):
+        for order, key in self.ORDERS.items():
+            if key is None:
+                continue
+            with self.subTest(order=order):
+                rows = list(self.db.query(order=order))
+                self.assertTrue(rows)
+                self.assertTrue(all(row[key] is not None for row in rows))
+                self.assertEqual(
+                    len(rows), sum(row[key] is not None for row in self.all_rows)
+                )
+
+    def test_under(self):
+        rows = list(self.db.query({'under': '/lib/a'}))
+        paths = {row['file_path'] for row in rows}
+        self.assertEqual(paths, {
+            row['file_path'] for row in self.all_rows
+            if row['file_path'].startswith('/lib/a/')
+        })
+        self.assertTrue(any(path.startswith('/lib/a/sub/') for path in paths))
+        self.assertFalse(any(path.startswith('/lib/ab/') for path in paths))
+        # A trailing slash means the same directory
+        self.assertEqual(list(self.db.query({'under': '/lib/a/'})), rows)
+
+    def test_pages_with_filters(self):
+        filters = {'under': '/lib/a', 'genre': 'rpg'}
+        matching = [
+            row for row in self.all_rows
+            if row['file_path'].startswith('/lib/a/') and row['genre'] == 'rpg'
+        ]
+        for descending in (False, True):
+            with self.subTest(descending=descending):
+                self.assertEqual(
+                    self._page_through('duration', descending, limit=2, filters=filters),
+                    self._expected('duration', descending, matching),
+                )
+
+    def test_unknown_lookup_value(self):
+        self.assertEqual(list(self.db.query({'genre': 'puzzle'})), [])
+
+    def test_unknown_filter_and_order(self):
+        with self.assertRaises(ValueError):
+            self.db.query({'colour': 'red'})
+        with self.assertRaises(ValueError):
+            self.db.query(order='colour')
+
+
+class LikeSearchTest(unittest.TestCase):
+    """
+    Search without a full-text index, as when SQLite lacks FTS5.
+    """
+
+    PATHS = [
+        '/lib/100%_run.mp4',
+        '/lib/1000_run.mp4',
+        '/lib/boss_rush.mp4',
+        '/lib/bossXrush.mp4',
+        '/lib/back\\slash.mp4',
+        '/lib/backslash.mp4',
+    ]
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = FosseData({'db_file': os.path.join(self.tmp.name, 'fosse.db')})
+        self.addCleanup(self.db.close)
+        self.db.has_search_index = False
+        for path in self.PATHS:
+            self.db.insert_video(path, {'title': 'Speedrun'})
+
+    def _search(self, text):
+        return [row['file_path'] for row in self.db.search(text)]
+
+    def test_wildcards_match_literally(self):
+        self.assertEqual(self._search('100%'), ['/lib/100%_run.mp4'])
+        self.assertEqual(self._search('%'), ['/lib/100%_run.mp4'])
+        self.assertEqual(self._search('boss_rush'), ['/lib/boss_rush.mp4'])
+        self.assertEqual(self._search('\\'), ['/lib/back\\slash.mp4'])
+
+    def test_every_word(self):
+        self.assertEqual(self._search('speedrun rush'), ['/lib/boss_rush.mp4', '/lib/bossXrush.mp4'])
+        self.assertIsNone(self.db.search('rush')[0]['rank'])
+
+
+if __name__ == '__main__':
+    unittest.main()
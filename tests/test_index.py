@@ -0,0 +1,132 @@
+import datetime
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from fosse.index import VideoIndex
+from fosse.scanner import Scanner
+
+
+class PinnedTimeZone:
+    """
+    Sets the TZ environment variable for the duration of a with block.
+    """
+
+    def __init__(self, zone):
+        self.zone = zone
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = os.environ.get('TZ')
+        os.environ['TZ'] = self.zone
+        time.tzset()
+
+    def __exit__(self, *exc):
+        if self.previous is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = self.previous
+        time.tzset()
+
+
+# West and east of UTC, where reading a UTC timestamp as local time is off
+# by hours in opposite directions
+ZONES = ('America/New_York', 'Asia/Tokyo', 'UTC')
+
+
+class ParseTimestampTest(unittest.TestCase):
+    def test_reads_current_timestamp_as_utc(self):
+        expected = int(datetime.datetime(
+            2024, 1, 15, 12, 0, 0, tzinfo=datetime.timezone.utc
+        ).timestamp() * 1e9)
+        for zone in ZONES:
+            with self.subTest(zone=zone), PinnedTimeZone(zone):
+                self.assertEqual(
+                    VideoIndex.parse_timestamp_ns('2024-01-15 12:00:00'), expected
+                )
+
+    def test_matches_sqlite_clock(self):
+        for zone in ZONES:
+            with self.subTest(zone=zone), PinnedTimeZone(zone):
+                written = sqlite3.connect(':memory:').execute(
+                    "SELECT CURRENT_TIMESTAMP"
+                ).fetchone()[0]
+                parsed = VideoIndex.parse_timestamp_ns(written) / 1e9
+                self.assertLess(abs(parsed - time.time()), 5)
+
+    def test_empty(self):
+        self.assertEqual(VideoIndex.parse_timestamp_ns(None), 0)
+        self.assertEqual(VideoIndex.parse_timestamp_ns(''), 0)
+
+
+class LookupTest(unittest.TestCase):
+    ROWS = [
+        ('/videos/b.mp4', 2, 20, 200, None),
+        ('/videos/a.mp4', 1, 10, 100, 1000),
+        ('/videos/c.mp4', 3, 30, 300, 3000),
+    ]
+
+    def test_rows_in_any_order(self):
+        for rows in (sorted(self.ROWS), self.ROWS):
+            with self.subTest(rows=rows):
+                index = VideoIndex(iter(rows))
+                self.assertEqual(len(index), 3)
+                self.assertEqual(index.get('/videos/a.mp4'), (1, 10, 100, 1000))
+                self.assertEqual(index.get('/videos/b.mp4'), (2, 20, 200, None))
+                self.assertEqual(index.get('/videos/c.mp4'), (3, 30, 300, 3000))
+                self.assertIsNone(index.get('/videos/d.mp4'))
+
+
+class LegacyRowTest(unittest.TestCase):
+    """
+    Rows written before stat columns existed are compared against the time
+    the row was written, in UTC.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.scanner = Scanner({
+            'root': self.tmp.name,
+            'db_file': os.path.join(self.tmp.name, 'fosse.db'),
+            'video_extensions': ['.mp4'],
+        })
+        self.addCleanup(self.scanner.db.close)
+        self.video = os.path.join(self.tmp.name, 'video.mp4')
+        with open(self.video, 'wb') as file:
+            file.write(b'\0' * 16)
+
+    def _is_changed(self, written, modified):
+        """
+        Args:
+            written (datetime): When the legacy row was written, in UTC.
+            modified (datetime): The file's mtime.
+        """
+        os.utime(self.video, (modified.timestamp(), modified.timestamp()))
+        state = VideoIndex.state_from_row(
+            1, None, None, None, written.strftime('%Y-%m-%d %H:%M:%S')
+        )
+        return self.scanner._is_changed(self.video, state, os.stat(self.video))
+
+    def test_modified_after_row_written(self):
+        written = datetime.datetime(2024, 1, 15, 12, 0, 0, tzinfo=datetime.timezone.utc)
+        # Within the UTC offset of either zone
+        for zone in ZONES:
+            with self.subTest(zone=zone), PinnedTimeZone(zone):
+                self.assertTrue(
+                    self._is_changed(written, written + datetime.timedelta(hours=1))
+                )
+
+    def test_modified_before_row_written(self):
+        written = datetime.datetime(2024, 1, 15, 12, 0, 0, tzinfo=datetime.timezone.utc)
+        for zone in ZONES:
+            with self.subTest(zone=zone), PinnedTimeZone(zone):
+                self.assertFalse(
+                    self._is_changed(written, written - datetime.timedelta(hours=1))
+                )
+
+
+if __name__ == '__main__':
+    unittest.main()
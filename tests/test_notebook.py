@@ -0,0 +1,106 @@
+import datetime
+import unittest
+
+from fosse.notebook import Decoding, FixedFormat
+
+
+class FixedFormatTest(unittest.TestCase):
+    FORMATS = {
+        '%Y-%m-%d': ['2024-01-15', '1999-12-31', '2024-02-29'],
+        '%Y%m%d': ['20240115', '20001231'],
+        '%Y-%m-%d %H:%M:%S': ['2024-01-15 12:34:56', '2024-01-15 00:00:00'],
+        '%Y-%m-%d %H-%M-%S': ['2024-01-15 23-59-59'],
+        '%d.%m.%Y_%H%M': ['15.01.2024_0930'],
+    }
+
+    # Wrong layout or impossible values, which strptime rejects too
+    INVALID = {
+        '%Y-%m-%d': ['2024/01/15', '2024-01-15x', '2024-13-01', '2023-02-29', '2024-0a-15'],
+        '%Y-%m-%d %H:%M:%S': ['2024-01-15 24:00:00', '2024-01-15 12:60:00'],
+    }
+
+    def test_matches_strptime(self):
+        for fmt, values in self.FORMATS.items():
+            fixed = FixedFormat.compile(fmt)
+            self.assertIsNotNone(fixed)
+            for text in values:
+                with self.subTest(fmt=fmt, text=text):
+                    self.assertEqual(
+                        fixed.parse(text), datetime.datetime.strptime(text, fmt)
+                    )
+
+    def test_rejects_what_strptime_rejects(self):
+        for fmt, values in self.INVALID.items():
+            fixed = FixedFormat.compile(fmt)
+            for text in values:
+                with self.subTest(fmt=fmt, text=text):
+                    self.assertIsNone(fixed.parse(text))
+                    with self.assertRaises(ValueError):
+                        datetime.datetime.strptime(text, fmt)
+
+    def test_unpadded_falls_back_to_strptime(self):
+        fmt = '%Y-%m-%d %H:%M:%S'
+        text = '2024-1-5 9:30:00'
+        self.assertIsNone(FixedFormat.compile(fmt).parse(text))
+        self.assertEqual(
+            Decoding._parse(text, FixedFormat.compile(fmt), fmt),
+            datetime.datetime(2024, 1, 5, 9, 30),
+        )
+
+    def test_rejects_non_ascii_digits(self):
+        self.assertIsNone(FixedFormat.compile('%Y-%m-%d').parse('２０２４-01-15'))
+
+    def test_non_numeric_formats(self):
+        for fmt in ('%Y-%b-%d', '%d %B %Y', '%y%m%d', '%Y-%m-%d %I:%M %p', '%j'):
+            with self.subTest(fmt=fmt):
+                self.assertIsNone(FixedFormat.compile(fmt))
+
+
+class DecodingTest(unittest.TestCase):
+    REGEXP = r'(?P<date>[^_]+)_(?P<time>[^_]+)_(?P<name>.+)\.mp4'
+
+    def test_parse_many_matches_strptime(self):
+        cases = [
+            ('%Y-%m-%d', '%H-%M-%S', '2024-01-15_12-34-56_boss.mp4', '2024-01-15 12-34-56'),
+            ('%Y%m%d', '%H%M', '20240115_0930_intro.mp4', '20240115 0930'),
+            # Not fixed-width, so these go through strptime
+            ('%Y-%b-%d', '%H:%M', '2024-Jan-15_09:30_intro.mp4', '2024-Jan-15 09:30'),
+            ('%Y-%m-%d', '%H-%M-%S', '2024-1-5_9-30-00_intro.mp4', '2024-1-5 9-30-00'),
+        ]
+        for date_format, time_format, filename, text in cases:
+            with self.subTest(filename=filename):
+                decoding = Decoding(self.REGEXP, 'date', 'time', 'name', date_format, time_format)
+                expected = datetime.datetime.strptime(text, f"{date_format} {time_format}")
+                self.assertEqual(
+                    decoding.parse_many([filename]), {filename: expected.isoformat()}
+                )
+                self.assertEqual(decoding.parse(filename), expected.isoformat())
+
+    def test_no_time_group_is_midnight(self):
+        decoding = Decoding(r'(?P<date>\d{8})-(?P<name>.+)\.mp4', 'date', None, 'name', '%Y%m%d')
+        self.assertEqual(
+            decoding.parse_many(['20240115-boss.mp4']),
+            {'20240115-boss.mp4': '2024-01-15T00:00:00'},
+        )
+
+    def test_shared_and_unparseable_dates(self):
+        decoding = Decoding(self.REGEXP, 'date', 'time', 'name', None, '%H-%M-%S')
+        filenames = [
+            '2024-01-15_12-00-00_a.mp4',
+            '2024-01-15_12-00-00_b.mp4',
+            '2024-13-15_12-00-00_c.mp4',
+            'no-date.mp4',
+        ]
+        self.assertEqual(decoding.parse_many(filenames), {
+            '2024-01-15_12-00-00_a.mp4': '2024-01-15T12:00:00',
+            '2024-01-15_12-00-00_b.mp4': '2024-01-15T12:00:00',
+            '2024-13-15_12-00-00_c.mp4': None,
+            'no-date.mp4': None,
+        })
+
+    def test_without_regexp(self):
+        self.assertEqual(Decoding().parse_many(['a.mp4']), {'a.mp4': None})
+
+
+if __name__ == '__main__':
+    unittest.main()
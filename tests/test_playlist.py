@@ -0,0 +1,118 @@
+import random
+import unittest
+
+from fosse.playlist import Catalog, FenwickTree, Playlist, format_last_used
+
+
+def make_catalog(videos):
+    """
+    Args:
+        videos (list): (genre, duration_seconds, last_used) tuples.
+
+    Returns:
+        Catalog: One row per video, with ids counting from 1.
+    """
+    return Catalog(
+        (i, f'/videos/{i}.mp4', duration, genre, None, None, f'Video {i}', None, last_used)
+        for i, (genre, duration, last_used) in enumerate(videos, 1)
+    )
+
+
+START = 1705320000.0  # 2024-01-15 12:00:00 UTC
+
+
+class FenwickTreeTest(unittest.TestCase):
+    def test_find(self):
+        tree = FenwickTree([1.0, 0.0, 2.0, 3.0, 0.5])
+        self.assertEqual(tree.total, 6.5)
+        cases = [(0, 0), (0.99, 0), (1, 2), (2.99, 2), (3, 3), (5.99, 3), (6, 4), (6.49, 4)]
+        for value, expected in cases:
+            with self.subTest(value=value):
+                self.assertEqual(tree.find(value), expected)
+
+    def test_add(self):
+        tree = FenwickTree([1.0, 0.0, 2.0])
+        tree.add(1, 4.0)
+        self.assertEqual(tree.total, 7.0)
+        self.assertEqual(tree.find(1), 1)
+        self.assertEqual(tree.find(4.99), 1)
+        self.assertEqual(tree.find(5), 2)
+        tree.add(0, -1.0)
+        self.assertEqual(tree.find(0), 1)
+
+    def test_matches_linear_search(self):
+        rng = random.Random(7)
+        weights = [rng.choice([0.0, 0.5, 1.0, 3.0]) for _ in range(37)]
+        tree = FenwickTree(weights)
+        for _ in range(500):
+            value = rng.random() * tree.total
+            expected, running = 0, 0.0
+            for expected, weight in enumerate(weights):
+                running += weight
+                if value < running:
+                    break
+            self.assertEqual(tree.find(value), expected)
+
+
+class PlaylistTest(unittest.TestCase):
+    def test_weighted_proportions(self):
+        catalog = make_catalog([('rpg', 60, None), ('racing', 60, None)])
+        playlist = Playlist(
+            catalog, weights={'genre': {'rpg': 3}}, start=START, rng=random.Random(1)
+        )
+        picks = [playlist.next()[0] for _ in range(20000)]
+        self.assertAlmostEqual(picks.count(0) / len(picks), 0.75, delta=0.02)
+
+    def test_zero_weight_excluded(self):
+        catalog = make_catalog([('rpg', 60, None), ('racing', 60, None), ('puzzle', 60, None)])
+        playlist = Playlist(
+            catalog, weights={'genre': {'racing': 0}}, start=START, rng=random.Random(2)
+        )
+        picks = {playlist.next()[0] for _ in range(2000)}
+        self.assertEqual(picks, {0, 2})
+
+    def test_nothing_playable(self):
+        catalog = make_catalog([('rpg', 60, None)])
+        playlist = Playlist(catalog, weights={'genre': {'rpg': 0}}, start=START)
+        self.assertIsNone(playlist.next())
+        self.assertEqual(playlist.take(3600), [])
+
+    def test_no_repeat_window(self):
+        catalog = make_catalog([('rpg', 600, None)] * 5)
+        playlist = Playlist.from_config(catalog, {'no_repeat_hours': 0.5}, start=START)
+        last_start = {}
+        for pos, start in playlist.take(48 * 3600):
+            if pos in last_start:
+                self.assertGreaterEqual(start - last_start[pos], 1800)
+            last_start[pos] = start
+        self.assertEqual(len(last_start), 5)
+
+    def test_no_repeat_counts_stored_last_used(self):
+        catalog = make_catalog([
+            ('rpg', 600, format_last_used(START - 600)),
+            ('rpg', 600, None),
+        ])
+        playlist = Playlist(catalog, no_repeat=3600, start=START, rng=random.Random(3))
+        self.assertEqual(playlist.next(), (1, START))
+
+    def test_fallback_picks_window_ending_first(self):
+        # Every video played within the last hour, the second longest ago
+        catalog = make_catalog([
+            ('rpg', 600, format_last_used(START - 600)),
+            ('rpg', 600, format_last_used(START - 1800)),
+            ('rpg', 600, format_last_used(START - 1200)),
+        ])
+        playlist = Playlist(catalog, no_repeat=3600, start=START, rng=random.Random(4))
+        self.assertEqual(
+            [pos for pos, _ in playlist.take(1800)], [1, 2, 0]
+        )
+
+    def test_take_advances_clock(self):
+        catalog = make_catalog([('rpg', 600, None), ('rpg', None, None)])
+        playlist = Playlist(catalog, positions=[1], start=START)
+        self.assertEqual(playlist.take(3), [(1, START), (1, START + 1), (1, START + 2)])
+        self.assertEqual(playlist.clock, START + 3)
+
+
+if __name__ == '__main__':
+    unittest.main()